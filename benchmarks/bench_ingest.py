@@ -0,0 +1,168 @@
+# type: ignore
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.decoding import decode_depth_diff, parse_levels
+from binance_data_saver.main import load_config
+from binance_data_saver.manage_ws_depth import DepthCacheManager
+from binance_data_saver.orderbook import ORDERBOOK_ENGINES, make_orderbook
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.row_buffer import ColumnarRowBuffer
+
+
+def time_calls(fn: Callable, messages: List) -> Dict:
+    latencies = np.empty(len(messages), dtype=np.int64)
+    clock = time.perf_counter_ns
+    start = clock()
+    for i, message in enumerate(messages):
+        t0 = clock()
+        fn(message)
+        latencies[i] = clock() - t0
+    elapsed_s = (clock() - start) / 1e9
+    return {
+        "messages": len(messages),
+        "msg_per_s": len(messages) / elapsed_s,
+        "p50_us": float(np.percentile(latencies, 50)) / 1e3,
+        "p99_us": float(np.percentile(latencies, 99)) / 1e3,
+        "max_us": float(latencies.max()) / 1e3,
+    }
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bench_rss_per_row(config: Dict, market: SyntheticMarket, n_rows: int) -> Dict:
+    """Peak RSS growth of a filled row buffer, run first so the peak is fresh."""
+    top = parse_levels(market.snapshot()["bids"][:config["n_depth_pairs"]])
+    before = peak_rss_bytes()
+    row_buffer = ColumnarRowBuffer(config, n_rows)
+    for i in range(n_rows):
+        row_buffer.set_depth(i, top, top)
+    after = peak_rss_bytes()
+    return {"rows": n_rows, "peak_rss_bytes_per_row": (after - before) / n_rows}
+
+
+def new_depth_cache_manager(config: Dict, market: SyntheticMarket) -> DepthCacheManager:
+    depth_cache_manager = DepthCacheManager(config, should_plot=False)
+    depth_cache_manager.initialize_params("bench")
+    depth_cache_manager.update_callback = lambda data: None
+    depth_cache_manager.orderbook = make_orderbook(config, market.tick_size)
+    depth_cache_manager.complete_resync(market.snapshot())
+    return depth_cache_manager
+
+
+def bench_depth(config: Dict, args) -> Dict:
+    results = {}
+    for engine in args.engines:
+        engine_config = dict(config, orderbook_engine=engine)
+        market = SyntheticMarket(seed=args.seed, book_size=args.book_size,
+                                 levels_per_diff=args.levels_per_diff)
+        depth_cache_manager = new_depth_cache_manager(engine_config, market)
+        raw_messages = market.depth_diffs(args.messages)
+        results[f"on_message[{engine}]"] = time_calls(
+            lambda message: depth_cache_manager.on_message(None, message), raw_messages
+        )
+        market = SyntheticMarket(seed=args.seed, book_size=args.book_size,
+                                 levels_per_diff=args.levels_per_diff)
+        depth_cache_manager = new_depth_cache_manager(engine_config, market)
+        parsed = [decode_depth_diff(message) for message in market.depth_diffs(args.messages)]
+        results[f"process_updates[{engine}]"] = time_calls(
+            depth_cache_manager.process_updates, parsed
+        )
+    return results
+
+
+def bench_saver(config: Dict, args, suffix: str = "") -> Dict:
+    market = SyntheticMarket(seed=args.seed, book_size=args.book_size,
+                             levels_per_diff=args.levels_per_diff,
+                             trades_per_second=args.trades_per_second)
+    # large enough that no flush happens while timing the callbacks
+    save_dir = tempfile.mkdtemp(prefix="bench_")
+    saver_config = dict(config, n_events_per_write=4 * args.messages, s3_bucket="",
+                        save_dir=save_dir, wal_dir=os.path.join(save_dir, "wal"))
+    saver = ParquetSaver(saver_config)
+    depth_cache_manager = new_depth_cache_manager(saver_config, market)
+    depth_payloads = []
+    depth_cache_manager.update_callback = depth_payloads.append
+    for message in market.depth_diffs(args.messages):
+        depth_cache_manager.on_message(None, message)
+
+    results = {
+        f"ohlc_cb{suffix}": time_calls(saver.ohlc_cb, market.klines(args.messages)),
+        f"agg_trades_cb{suffix}": time_calls(saver.agg_trades_cb,
+                                             market.agg_trades(args.messages)),
+        f"depth_cb{suffix}": time_calls(saver.depth_cb, depth_payloads),
+    }
+
+    n_rows = len(saver.time_to_row_data)
+    start = time.perf_counter()
+    saver.save_to_parquet()
+    submit_s = time.perf_counter() - start
+    saver.close()
+    flush = saver.writer.metrics()
+    results[f"save_to_parquet{suffix}"] = {
+        "rows": n_rows,
+        "submit_ms": submit_s * 1e3,
+        "flush_ms": flush["max_flush_ms"],
+        "rows_per_s": n_rows / (flush["max_flush_ms"] / 1e3) if flush["max_flush_ms"] else 0.0,
+    }
+    return results
+
+
+def print_results(results: Dict) -> None:
+    for name, stats in results.items():
+        values = ", ".join(
+            f"{key}={value:,.2f}" if isinstance(value, float) else f"{key}={value:,}"
+            for key, value in stats.items()
+        )
+        print(f"{name:32s} {values}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ingestion hot paths")
+    parser.add_argument("--messages", type=int, default=20_000, help="messages per stream")
+    parser.add_argument("--book-size", type=int, default=1000, help="levels per side in the snapshot")
+    parser.add_argument("--levels-per-diff", type=int, default=20)
+    parser.add_argument("--trades-per-second", type=float, default=50.0)
+    parser.add_argument("--n-depth-pairs", type=int, help="overrides n_depth_pairs of config.yaml")
+    parser.add_argument("--engines", nargs="+", default=list(ORDERBOOK_ENGINES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.n_depth_pairs:
+        config["n_depth_pairs"] = args.n_depth_pairs
+
+    results = {}
+    results["row_buffer_rss"] = bench_rss_per_row(
+        config, SyntheticMarket(seed=args.seed, book_size=args.book_size),
+        config["n_events_per_write"],
+    )
+    results.update(bench_depth(config, args))
+    results.update(bench_saver(config, args))
+    # same callbacks with every buffer update appended to the write-ahead log
+    results.update(bench_saver(dict(config, wal_enabled=True), args, suffix="[wal]"))
+    # callbacks only queue the events, the aligner thread fills the buffer
+    results.update(bench_saver(dict(config, align_streams=True), args, suffix="[aligned]"))
+    # submit_ms includes the feature columns and bars computed at seal time
+    results.update(bench_saver(dict(config, features=True), args, suffix="[features]"))
+    # trades are appended to the tape, merged into the rows at seal time
+    results.update(bench_saver(dict(config, trade_tape=True), args, suffix="[tape]"))
+    # one depth row per kline second, the other updates are only held
+    results.update(bench_saver(dict(config, depth_conflation="kline_aligned",
+                                    depth_conflation_ms=1000), args, suffix="[conflated]"))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
@@ -0,0 +1,113 @@
+# type: ignore
+import copy
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+SAMPLE_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    "binance_data_saver",
+    "sample_data.json",
+)
+
+
+class SyntheticMarket:
+    """
+    Generates depth diffs, klines and aggTrades shaped like the messages in
+    sample_data.json: a random walk mid price, a book of book_size levels per
+    side and event times following the requested rates.
+    """
+
+    def __init__(self, seed: int = 0, tick_size: float = 0.01, book_size: int = 1000,
+                 levels_per_diff: int = 20, depth_rate_ms: int = 100,
+                 trades_per_second: float = 50.0):
+        with open(SAMPLE_DATA_PATH, "r") as f:
+            self.sample = json.load(f)
+        self.rng = np.random.default_rng(seed)
+        self.tick_size = tick_size
+        self.decimals = max(len(f"{tick_size:f}".rstrip("0").split(".")[1]), 0)
+        self.book_size = book_size
+        self.levels_per_diff = levels_per_diff
+        self.depth_rate_ms = depth_rate_ms
+        self.trades_per_second = trades_per_second
+        self.mid_tick = int(round(self.sample["depth"]["top_asks"][0][0] / tick_size))
+        self.start_time = self.sample["depth"]["E"]
+        self.update_id = 1_000_000
+
+    def _price(self, tick: int) -> str:
+        return f"{tick * self.tick_size:.{self.decimals}f}"
+
+    def snapshot(self) -> Dict:
+        offsets = np.arange(1, self.book_size + 1)
+        qtys = self.rng.exponential(5.0, size=(2, self.book_size))
+        return {
+            "lastUpdateId": self.update_id,
+            "bids": [[self._price(self.mid_tick - o), f"{q:.4f}"]
+                     for o, q in zip(offsets, qtys[0])],
+            "asks": [[self._price(self.mid_tick + o - 1), f"{q:.4f}"]
+                     for o, q in zip(offsets, qtys[1])],
+        }
+
+    def _side_updates(self, sign: int) -> List[List[str]]:
+        # most activity happens close to the touch
+        offsets = np.minimum(
+            self.rng.geometric(0.05, self.levels_per_diff), self.book_size
+        )
+        removed = self.rng.random(self.levels_per_diff) < 0.3
+        qtys = np.where(removed, 0.0, self.rng.exponential(5.0, self.levels_per_diff))
+        if sign < 0:
+            ticks = self.mid_tick - offsets
+        else:
+            ticks = self.mid_tick + offsets - 1
+        return [[self._price(t), f"{q:.4f}"] for t, q in zip(ticks, qtys)]
+
+    def depth_diffs(self, n: int) -> List[str]:
+        """n consecutive depthUpdate payloads as raw JSON strings."""
+        messages = []
+        event_time = self.start_time
+        for _ in range(n):
+            event_time += self.depth_rate_ms
+            self.mid_tick += int(self.rng.integers(-2, 3))
+            first_id = self.update_id + 1
+            self.update_id += int(self.rng.integers(1, 2 * self.levels_per_diff))
+            messages.append(json.dumps({
+                "e": "depthUpdate",
+                "E": event_time,
+                "s": self.sample["ohlc"]["s"],
+                "U": first_id,
+                "u": self.update_id,
+                "b": self._side_updates(-1),
+                "a": self._side_updates(1),
+            }))
+        return messages
+
+    def klines(self, n: int) -> List[Dict]:
+        messages = []
+        for i in range(n):
+            kline = copy.deepcopy(self.sample["ohlc"])
+            kline["E"] = self.start_time + 1000 * i + 1
+            price = self._price(self.mid_tick + int(self.rng.integers(-5, 6)))
+            for key in ("o", "h", "l", "c"):
+                kline["k"][key] = price
+            kline["k"]["v"] = f"{self.rng.exponential(2.0):.4f}"
+            messages.append(kline)
+        return messages
+
+    def agg_trades(self, n: int) -> List[Dict]:
+        messages = []
+        gaps = self.rng.exponential(1000.0 / self.trades_per_second, n).astype(np.int64)
+        event_times = self.start_time + np.cumsum(gaps)
+        for i in range(n):
+            trade = copy.deepcopy(self.sample["trades"])
+            trade["E"] = int(event_times[i])
+            trade["T"] = int(event_times[i]) - 1
+            trade["a"] += i
+            trade["f"] += i
+            trade["l"] += i
+            trade["p"] = self._price(self.mid_tick + int(self.rng.integers(-1, 1)))
+            trade["q"] = f"{self.rng.exponential(0.5):.4f}"
+            trade["m"] = bool(self.rng.random() < 0.5)
+            messages.append(trade)
+        return messages
@@ -0,0 +1,120 @@
+# type: ignore
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from operator import itemgetter
+from typing import Callable, Dict, List, Tuple
+
+log = logging.getLogger(__file__)
+
+_event_time = itemgetter(0)
+
+
+class EventTimeAligner:
+    """
+    Orders the events of several streams by event time before they reach
+    the row buffer. Producers append (event_time, stream, event) to a per
+    stream deque, which is safe without a lock, and return. An aligner
+    thread drains the deques every interval_ms, sorts what it drained (one
+    timsort of mostly sorted runs per interval, no per event insert) and
+    emits, through emit(events), every event at or below the watermark:
+    the smallest latest event time over the streams, minus lateness_ms.
+    A stream silent for idle_ms no longer holds the watermark back; once
+    every stream is, all pending events are emitted.
+
+    Events arriving below a watermark that was already emitted are late:
+    they are counted and emitted with the next batch rather than dropped.
+    """
+
+    def __init__(self, streams: List[str], emit: Callable, lateness_ms: int = 500,
+                 interval_ms: int = 50, idle_ms: int = 5000, name: str = "aligner"):
+        self.emit = emit
+        self.lateness_ms = lateness_ms
+        self.interval_s = interval_ms / 1000
+        self.idle_s = idle_ms / 1000
+        self.inboxes: Dict[str, deque] = {stream: deque() for stream in streams}
+        # latest event time and local arrival time of every stream
+        self.latest: Dict[str, int] = {}
+        self.arrival: Dict[str, float] = {}
+        self.pending: List[Tuple] = []
+        self.watermark = None
+        self.n_late = 0
+        self.n_emitted = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def push(self, stream: str, event_time: int, event) -> None:
+        self.inboxes[stream].append((event_time, stream, event))
+
+    def _drain(self) -> None:
+        now = time.monotonic()
+        for stream, inbox in self.inboxes.items():
+            n = len(inbox)
+            if n == 0:
+                continue
+            latest = self.latest.get(stream)
+            for _ in range(n):
+                item = inbox.popleft()
+                self.pending.append(item)
+                if latest is None or item[0] > latest:
+                    latest = item[0]
+            self.latest[stream] = latest
+            self.arrival[stream] = now
+
+    def current_watermark(self) -> int:
+        """Event time up to which every stream is assumed complete, None before any event."""
+        now = time.monotonic()
+        active = [self.latest[stream] for stream, arrival in self.arrival.items()
+                  if now - arrival < self.idle_s]
+        if not active:
+            if not self.latest:
+                return None
+            # every stream idle, nothing more is expected for what is pending
+            return max(self.latest.values())
+        return min(active) - self.lateness_ms
+
+    def step(self, flush: bool = False) -> int:
+        """Drain, emit what the watermark allows (everything with flush), returns the count."""
+        self._drain()
+        if not self.pending:
+            return 0
+        self.pending.sort(key=_event_time)
+        watermark = self.current_watermark()
+        if flush or watermark is None:
+            n_ready = len(self.pending) if flush else 0
+        else:
+            n_ready = bisect.bisect_right(self.pending, watermark, key=_event_time)
+        if self.watermark is not None and self.pending[0][0] <= self.watermark:
+            # below a watermark that was already emitted
+            n_late = bisect.bisect_right(self.pending, self.watermark, key=_event_time)
+            self.n_late += n_late
+            n_ready = max(n_ready, n_late)
+        if n_ready == 0:
+            return 0
+        ready = self.pending[:n_ready]
+        del self.pending[:n_ready]
+        if watermark is not None and (self.watermark is None or watermark > self.watermark):
+            self.watermark = watermark
+        self.emit(ready)
+        self.n_emitted += n_ready
+        return n_ready
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval_s):
+            try:
+                self.step()
+            except Exception:
+                log.exception("Aligner step failed")
+
+    @property
+    def n_pending(self) -> int:
+        return len(self.pending) + sum(len(inbox) for inbox in self.inboxes.values())
+
+    def close(self) -> None:
+        """Stop the thread and emit everything still pending."""
+        self.stopped.set()
+        self.thread.join()
+        self.step(flush=True)
@@ -0,0 +1,186 @@
+# type: ignore
+import asyncio
+import logging
+from typing import Dict
+
+import aiohttp
+
+from binance_data_saver.decoding import (
+    REST_BASE_URL,
+    WS_BASE_URL,
+    check_depth_snapshot,
+    decode_agg_trade,
+    decode_kline,
+    loads,
+    parse_levels,
+    tick_size_from_exchange_info,
+)
+from binance_data_saver.manage_ws_depth import SYNC_STATE_LIVE, DepthCacheManager
+from binance_data_saver.orderbook import make_orderbook
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.recorder import (
+    KIND_AGG_TRADE,
+    KIND_EXCHANGE_INFO,
+    KIND_KLINE,
+    KIND_SNAPSHOT,
+)
+
+log = logging.getLogger(__file__)
+
+
+class AsyncIngestionEngine:
+    """
+    Collects kline, aggTrade and depth of one symbol on a single asyncio
+    event loop, over one combined-stream websocket connection, with every
+    REST call going through one pooled aiohttp session. The depth stream
+    still goes through DepthCacheManager for sequencing and resyncs, only
+    its snapshot requests are made on the loop instead of on threads.
+    """
+
+    def __init__(self, symbol: str, config: Dict, data_handler: ParquetSaver,
+                 depth_cache_manager: DepthCacheManager = None, recorder=None):
+        self.symbol = symbol.lower()
+        self.config = config
+        self.data_handler = data_handler
+        self.recorder = recorder
+        self.ws_base_url = config.get("ws_base_url", WS_BASE_URL)
+        self.rest_base_url = config.get("rest_base_url", REST_BASE_URL)
+        self.kline_interval = "1s"
+        self.depth_cache_manager = depth_cache_manager or DepthCacheManager(
+            config, should_plot=False
+        )
+        self.depth_cache_manager.recorder = recorder
+        self.depth_cache_manager.initialize_params(self.symbol)
+        self.depth_cache_manager.update_callback = data_handler.depth_cb
+        # snapshot requests of the resync state machine go through the loop
+        self.depth_cache_manager.request_snapshot = self.request_snapshot
+        self.session = None
+        self.loop = None
+        self.tasks = set()
+
+    def stream_url(self) -> str:
+        streams = "/".join([
+            f"{self.symbol}@kline_{self.kline_interval}",
+            f"{self.symbol}@aggTrade",
+            f"{self.symbol}@depth@{self.config['depth_update_rate']}ms",
+        ])
+        return f"{self.ws_base_url}/stream?streams={streams}"
+
+    async def get_json(self, path: str, record_kind: int = None):
+        async with self.session.get(f"{self.rest_base_url}{path}",
+                                    timeout=aiohttp.ClientTimeout(total=3)) as response:
+            response.raise_for_status()
+            content = await response.read()
+        if record_kind is not None and self.recorder is not None:
+            self.recorder.record(record_kind, content)
+        return loads(content)
+
+    async def get_tick_size(self) -> float:
+        if self.config.get("tick_size"):
+            return float(self.config["tick_size"])
+        exchange_info = await self.get_json(
+            f"/api/v3/exchangeInfo?symbol={self.symbol.upper()}", KIND_EXCHANGE_INFO
+        )
+        return tick_size_from_exchange_info(exchange_info)
+
+    def spawn(self, coroutine) -> None:
+        task = self.loop.create_task(coroutine)
+        # keep a reference until done, the loop only holds weak ones
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def request_snapshot(self) -> None:
+        self.spawn(self.resync())
+
+    async def resync(self) -> None:
+        depth_cache_manager = self.depth_cache_manager
+        limit = int(self.config["n_depth_pairs"] * 1.5)
+        # same backoff as DepthCacheManager.fetch_snapshot_and_resync, on the loop
+        synced = False
+        try:
+            while not synced:
+                delay = depth_cache_manager.resync_backoff_s()
+                if delay > 0:
+                    log.warning(f"Snapshot {depth_cache_manager.snapshot_failures} in a row "
+                                f"failed, next request in {delay:.1f} s")
+                    await asyncio.sleep(delay)
+                try:
+                    snapshot = await self.get_json(
+                        f"/api/v3/depth?symbol={self.symbol.upper()}&limit={limit}", KIND_SNAPSHOT
+                    )
+                    synced = depth_cache_manager.complete_resync(snapshot)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    log.exception("Snapshot request failed")
+                if not synced:
+                    depth_cache_manager.snapshot_failed()
+            depth_cache_manager.snapshot_failures = 0
+        finally:
+            if not synced:
+                with depth_cache_manager.book_lock:
+                    depth_cache_manager.snapshot_in_flight = False
+
+    async def validate_periodically(self) -> None:
+        interval = self.config.get("validation_interval_s", 10)
+        levels = self.config.get("validation_levels", 10)
+        while True:
+            await asyncio.sleep(interval)
+            if self.depth_cache_manager.state != SYNC_STATE_LIVE:
+                continue
+            try:
+                snapshot = check_depth_snapshot(await self.get_json(
+                    f"/api/v3/depth?symbol={self.symbol.upper()}&limit={levels}"
+                ))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                log.exception("Validation snapshot failed")
+                continue
+            self.depth_cache_manager.pending_validation = (
+                snapshot["lastUpdateId"],
+                parse_levels(snapshot["bids"]),
+                parse_levels(snapshot["asks"]),
+            )
+
+    def on_stream_message(self, raw) -> None:
+        message = loads(raw)
+        stream, data = message["stream"], message["data"]
+        if stream.endswith("@aggTrade"):
+            if self.recorder is not None:
+                self.recorder.record(KIND_AGG_TRADE, data)
+            self.data_handler.agg_trades_cb(decode_agg_trade(data))
+        elif "@kline" in stream:
+            if self.recorder is not None:
+                self.recorder.record(KIND_KLINE, data)
+            self.data_handler.ohlc_cb(decode_kline(data))
+        elif "@depth" in stream:
+            self.depth_cache_manager.on_message(None, data)
+
+    async def run(self, max_reconnects: int = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        reconnects, failures = 0, 0
+        async with aiohttp.ClientSession() as session:
+            self.session = session
+            depth_cache_manager = self.depth_cache_manager
+            depth_cache_manager.orderbook = make_orderbook(self.config, await self.get_tick_size())
+            if self.config.get("validation_interval_s", 10) > 0:
+                self.spawn(self.validate_periodically())
+            while True:
+                try:
+                    async with session.ws_connect(self.stream_url(), heartbeat=30) as ws:
+                        log.info(f"Connected to {self.stream_url()}")
+                        failures = 0
+                        async for msg in ws:
+                            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                                self.on_stream_message(msg.data)
+                            elif msg.type == aiohttp.WSMsgType.ERROR:
+                                raise ws.exception()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    log.exception("Combined stream failed")
+                reconnects += 1
+                failures += 1
+                if max_reconnects is not None and reconnects > max_reconnects:
+                    break
+                # diffs were missed while disconnected
+                with depth_cache_manager.book_lock:
+                    depth_cache_manager.start_resync()
+                await asyncio.sleep(min(2 ** failures, 30))
+            for task in list(self.tasks):
+                task.cancel()
@@ -0,0 +1,264 @@
+# type: ignore
+import glob
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+import pyarrow as pa
+
+from binance_data_saver.metrics import LogHistogram
+
+log = logging.getLogger(__file__)
+
+_STOP = object()
+
+
+class SpilledBatch:
+    """A sealed batch written to an Arrow IPC file, read back memory mapped."""
+
+    def __init__(self, path: str, nbytes: int):
+        self.path = path
+        self.nbytes = nbytes
+        # write-ahead log generation of the batch it replaced, if any
+        self.wal_path = None
+
+    @classmethod
+    def spill(cls, path: str, table: pa.Table) -> "SpilledBatch":
+        with open(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            sink.flush()
+            os.fsync(sink.fileno())
+        return cls(path, os.path.getsize(path))
+
+    def to_table(self) -> pa.Table:
+        with pa.memory_map(self.path) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def remove(self) -> None:
+        # the mapping of a table still in use survives the unlink
+        os.remove(self.path)
+
+
+class _PendingSpill:
+    """
+    Queue slot of a batch being spilled by the spill thread, so the batch
+    keeps its place in the queue; the worker that reaches it waits for the
+    spill (normally long done) and writes whatever it ended up as.
+    """
+
+    def __init__(self, path: str, batch):
+        self.path = path
+        self.batch = batch
+        self.nbytes = batch.nbytes
+        self.done = threading.Event()
+
+    def resolve(self, batch) -> None:
+        self.batch = batch
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        return self.batch
+
+
+class BackgroundWriter:
+    """
+    Writer stage fed by a bounded queue of sealed batches. Each batch must
+    provide to_table() and nbytes; to_table() is called on the worker thread
+    together with write_fn(kind, table), so table building, compression and
+    disk/S3 I/O never run on the websocket callback threads.
+
+    With a memory_budget_bytes the queue is bounded by the bytes of the
+    batches it holds instead of their number: a batch that does not fit is
+    spilled to an Arrow IPC file in spill_dir by a spill thread, never on
+    the submitting one, and the workers drain it from there in order. Spill files left by a killed
+    process are queued again on start, unless requeue_spilled is False
+    because the owner can rebuild them (from its write-ahead log).
+
+    on_done(kind, batch) is called once write_fn wrote a submitted batch.
+    A spilled batch keeps the wal_path attribute of the original.
+    """
+
+    def __init__(self, write_fn: Callable, n_workers: int = 1,
+                 max_queue_size: int = 4, name: str = "parquet-writer",
+                 memory_budget_bytes: int = None, spill_dir: str = None,
+                 on_done: Callable = None, requeue_spilled: bool = True):
+        self.write_fn = write_fn
+        self.on_done = on_done
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill_dir = spill_dir
+        self.queue = queue.Queue(maxsize=0 if memory_budget_bytes else max_queue_size)
+        self.stats_lock = threading.Lock()
+        self.queued_bytes = 0
+        self.n_spilled = 0
+        self.spilled_bytes = 0
+        self.drained_bytes = 0
+        self.spill_seq = itertools.count()
+        self.spill_queue = queue.Queue()
+        self.spiller = None
+        if memory_budget_bytes:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._requeue_spilled(requeue_spilled)
+            self.spiller = threading.Thread(target=self._spill_queued, name=f"{name}-spill",
+                                            daemon=True)
+            self.spiller.start()
+        self.n_flushes = 0
+        self.n_failures = 0
+        self.n_blocked_submits = 0
+        self.max_queue_depth = 0
+        self.total_flush_s = 0.0
+        self.max_flush_s = 0.0
+        self.last_flush_s = 0.0
+        # per batch, table building vs compression and I/O
+        self.build_ms = LogHistogram()
+        self.write_ms = LogHistogram()
+        self.workers = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(int(n_workers), 1))
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _requeue_spilled(self, requeue: bool) -> None:
+        paths = sorted(glob.glob(os.path.join(self.spill_dir, "*.arrow")))
+        if not requeue:
+            for path in paths:
+                os.remove(path)
+            return
+        for path in paths:
+            # {seq}.{kind}.arrow
+            kind = os.path.basename(path).split(".")[1]
+            self.queue.put((kind, SpilledBatch(path, os.path.getsize(path))))
+        if paths:
+            self.spill_seq = itertools.count(int(os.path.basename(paths[-1]).split(".")[0]) + 1)
+            log.warning(f"Draining {len(paths)} batches spilled by a previous run")
+
+    def submit(self, kind: str, batch) -> None:
+        if self.memory_budget_bytes:
+            self._submit_within_budget(kind, batch)
+            return
+        try:
+            self.queue.put_nowait((kind, batch))
+        except queue.Full:
+            # backpressure: the writer is behind, wait for a free slot
+            with self.stats_lock:
+                self.n_blocked_submits += 1
+            log.warning(f"Writer queue full ({self.queue.maxsize}), waiting for a flush")
+            self.queue.put((kind, batch))
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def _submit_within_budget(self, kind: str, batch) -> None:
+        nbytes = batch.nbytes
+        with self.stats_lock:
+            fits = self.queued_bytes + nbytes <= self.memory_budget_bytes
+            if fits:
+                self.queued_bytes += nbytes
+        if not fits:
+            # table building, the IPC write and the fsync run on the spill thread
+            path = os.path.join(self.spill_dir, f"{next(self.spill_seq):08d}.{kind}.arrow")
+            batch = _PendingSpill(path, batch)
+            self.spill_queue.put((kind, batch))
+        self.queue.put((kind, batch))
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def _spill_queued(self) -> None:
+        while True:
+            item = self.spill_queue.get()
+            if item is _STOP:
+                return
+            kind, pending = item
+            batch = pending.batch
+            try:
+                spilled = SpilledBatch.spill(pending.path, batch.to_table())
+            except Exception:
+                # written from memory then, over the budget
+                log.exception(f"Failed to spill {kind} batch to {pending.path}")
+                with self.stats_lock:
+                    self.queued_bytes += batch.nbytes
+                pending.resolve(batch)
+                continue
+            with self.stats_lock:
+                self.n_spilled += 1
+                self.spilled_bytes += spilled.nbytes
+            log.warning(f"Over the {self.memory_budget_bytes} byte budget, "
+                        f"spilled {kind} batch to {pending.path}")
+            spilled.wal_path = getattr(batch, "wal_path", None)
+            pending.resolve(spilled)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            kind, batch = item
+            if isinstance(batch, _PendingSpill):
+                batch = batch.wait()
+            start = time.perf_counter()
+            try:
+                table = batch.to_table()
+                built = time.perf_counter()
+                self.write_fn(kind, table)
+                self.build_ms.record((built - start) * 1000)
+                self.write_ms.record((time.perf_counter() - built) * 1000)
+                if self.on_done is not None:
+                    self.on_done(kind, batch)
+                failed = False
+            except Exception:
+                log.exception(f"Failed to write {kind} batch")
+                failed = True
+            elapsed = time.perf_counter() - start
+            if isinstance(batch, SpilledBatch):
+                if not failed:
+                    batch.remove()
+            elif self.memory_budget_bytes:
+                with self.stats_lock:
+                    self.queued_bytes -= batch.nbytes
+            with self.stats_lock:
+                if not failed:
+                    self.drained_bytes += batch.nbytes
+                self.n_flushes += 1
+                self.n_failures += failed
+                self.total_flush_s += elapsed
+                self.max_flush_s = max(self.max_flush_s, elapsed)
+                self.last_flush_s = elapsed
+            log.info(f"Flushed {kind} batch in {elapsed * 1000:.1f} ms, "
+                     f"queue depth {self.queue.qsize()}")
+            self.queue.task_done()
+
+    def metrics(self) -> Dict:
+        with self.stats_lock:
+            n = self.n_flushes
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "flushes": n,
+                "failures": self.n_failures,
+                "blocked_submits": self.n_blocked_submits,
+                "last_flush_ms": self.last_flush_s * 1000,
+                "avg_flush_ms": self.total_flush_s / n * 1000 if n else 0.0,
+                "max_flush_ms": self.max_flush_s * 1000,
+                "queued_bytes": self.queued_bytes,
+                "spilled_batches": self.n_spilled,
+                "spilled_bytes": self.spilled_bytes,
+                "drained_bytes": self.drained_bytes,
+            }
+
+    def close(self) -> None:
+        """Write everything that is queued and stop the workers."""
+        if self.spiller is not None:
+            self.spill_queue.put(_STOP)
+            self.spiller.join()
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,379 @@
+# type: ignore
+import argparse
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from binance_data_saver.manifest import Manifest, file_info
+from binance_data_saver.reader import discover_files
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.schema import column_mapping, decode_table, decoded_schema
+
+log = logging.getLogger(__file__)
+
+
+def _open(path: str, filesystem=None) -> pq.ParquetFile:
+    return pq.ParquetFile(path, filesystem=filesystem) if filesystem is not None \
+        else pq.ParquetFile(path)
+
+
+def _time_range(parquet_file: pq.ParquetFile) -> Tuple[float, float]:
+    """(min, max) time from the footer, (-inf, inf) without statistics."""
+    metadata = parquet_file.metadata
+    idx = metadata.schema.to_arrow_schema().get_field_index(TIME_COLUMN)
+    stats = [metadata.row_group(i).column(idx).statistics for i in range(metadata.num_row_groups)]
+    if not stats or any(s is None or not s.has_min_max for s in stats):
+        return -np.inf, np.inf
+    return min(s.min for s in stats), max(s.max for s in stats)
+
+
+def max_overlap(ranges: List[Tuple[float, float]]) -> int:
+    """Largest number of [min, max] ranges containing a single time."""
+    events = sorted([(start, 0) for start, _ in ranges] + [(end, 1) for _, end in ranges])
+    depth = deepest = 0
+    for _, is_end in events:
+        depth += -1 if is_end else 1
+        deepest = max(deepest, depth)
+    return deepest
+
+
+class _FileStream:
+    """Record batches of one file in time order; an unsorted file is sorted in memory."""
+
+    def __init__(self, path: str, schema: pa.Schema, batch_rows: int, filesystem=None):
+        self.path = path
+        self.schema = schema
+        parquet_file = _open(path, filesystem)
+        # a compact file merged with files of another mapping is merged decoded
+        self.file_schema = parquet_file.schema_arrow
+        self.decode = column_mapping(self.file_schema) != column_mapping(schema)
+        times = parquet_file.read(columns=[TIME_COLUMN]).column(0).to_numpy()
+        if len(times) < 2 or (np.diff(times) >= 0).all():
+            self.batches = parquet_file.iter_batches(batch_size=batch_rows)
+        else:
+            # a file holds one flush, small enough to sort
+            table = parquet_file.read().take(np.argsort(times, kind="stable"))
+            self.batches = iter(table.to_batches(max_chunksize=batch_rows))
+        self.last_time = None
+
+    def next(self) -> Optional[pa.Table]:
+        for batch in self.batches:
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch])
+            if self.decode:
+                table = decode_table(table, self.file_schema)
+            table = _conform(table, self.schema)
+            self.last_time = table.column(TIME_COLUMN)[-1].as_py()
+            return table
+        return None
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    if table.schema.equals(schema):
+        return table
+    # files written with other options (features, n_depth_pairs) lack some columns
+    names = set(table.column_names)
+    columns = [table.column(field.name).cast(field.type)
+               if field.name in names else pa.nulls(table.num_rows, field.type)
+               for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _row_hashes(table: pa.Table) -> np.ndarray:
+    h = np.zeros(table.num_rows, dtype=np.uint64)
+    for column in table.columns:
+        values = column.to_numpy(zero_copy_only=False)
+        if values.dtype.kind in "mM":
+            values = values.view(np.int64)
+        elif values.dtype.kind not in "biuf":
+            # strings and other objects, the hashes are only compared within this table
+            values = np.fromiter((hash(value) for value in values), dtype=np.int64,
+                                 count=len(values))
+        elif values.dtype.itemsize != 8:
+            values = values.astype(np.float64)
+        h = (h * np.uint64(1099511628211)) ^ values.view(np.uint64)
+    return h
+
+
+def drop_duplicates(table: pa.Table) -> pa.Table:
+    """Drop rows identical to an earlier row with the same time, keeping the row order."""
+    n = table.num_rows
+    if n < 2:
+        return table
+    times = table.column(TIME_COLUMN).to_numpy()
+    hashes = _row_hashes(table)
+    order = np.lexsort((np.arange(n), hashes, times))
+    candidate = (times[order[1:]] == times[order[:-1]]) & (hashes[order[1:]] == hashes[order[:-1]])
+    if not candidate.any():
+        return table
+    first, second = order[:-1][candidate], order[1:][candidate]
+    same = np.ones(len(first), dtype=bool)
+    for column in table.columns:
+        values = column.to_numpy(zero_copy_only=False)
+        a, b = values[first], values[second]
+        equal = a == b
+        if values.dtype.kind == "f":
+            equal |= np.isnan(a) & np.isnan(b)
+        same &= equal
+    keep = np.ones(n, dtype=bool)
+    # a row equal to its predecessor in (time, hash) order goes, chains collapse to the first
+    keep[second[same]] = False
+    return table.filter(keep)
+
+
+def merge_sorted(paths: List[str], schema: pa.Schema, filesystem=None,
+                 batch_rows: int = 4096, max_open_files: int = 64,
+                 tmp_dir: str = None) -> Iterator[pa.Table]:
+    """
+    External k-way merge of files by time, yielding time ordered tables.
+    Files are opened in order of their minimum time and only while they
+    overlap the merge front, reading batch_rows rows at a time. If more
+    than max_open_files files overlap (known from the footers), groups of
+    max_open_files are first merged into sorted runs in tmp_dir, so memory
+    stays around max_open_files * batch_rows rows whatever the data.
+    """
+    ranges = [_time_range(_open(path, filesystem)) for path in paths]
+    if max_overlap(ranges) <= max_open_files:
+        yield from _merge(paths, ranges, schema, filesystem, batch_rows)
+        return
+    range_of = dict(zip(paths, ranges))
+    by_start = sorted(paths, key=lambda path: range_of[path][0])
+    run_dir = tempfile.mkdtemp(prefix="compact-runs-", dir=tmp_dir)
+    try:
+        runs = []
+        for i in range(0, len(by_start), max_open_files):
+            group = by_start[i:i + max_open_files]
+            run = os.path.join(run_dir, f"run-{len(runs):06d}.parquet")
+            with pq.ParquetWriter(run, schema, compression="LZ4") as writer:
+                for table in _merge(group, [range_of[path] for path in group],
+                                    schema, filesystem, batch_rows):
+                    # small row groups, so the next pass streams the run
+                    writer.write_table(table, row_group_size=batch_rows)
+            runs.append(run)
+        log.info(f"Merged {len(paths)} overlapping files into {len(runs)} runs")
+        yield from merge_sorted(runs, schema, None, batch_rows, max_open_files, tmp_dir)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def _merge(paths: List[str], ranges: List[Tuple[float, float]], schema: pa.Schema,
+           filesystem, batch_rows: int) -> Iterator[pa.Table]:
+    queue = [(start, i, path) for i, ((start, _), path) in enumerate(zip(ranges, paths))]
+    heapq.heapify(queue)
+    active: List[_FileStream] = []
+    pending = None
+
+    def load(stream: _FileStream) -> bool:
+        nonlocal pending
+        table = stream.next()
+        if table is None:
+            return False
+        pending = table if pending is None else pa.concat_tables([pending, table])
+        return True
+
+    while queue or active:
+        front = min((stream.last_time for stream in active), default=np.inf)
+        while queue and queue[0][0] <= front:
+            _, _, path = heapq.heappop(queue)
+            stream = _FileStream(path, schema, batch_rows, filesystem)
+            if load(stream):
+                active.append(stream)
+                front = min(front, stream.last_time)
+        # every row below the bound is final, no open or unopened file goes below it
+        bound = min(front, queue[0][0] if queue else np.inf)
+        if pending is not None and pending.num_rows:
+            times = pending.column(TIME_COLUMN).to_numpy()
+            order = np.argsort(times, kind="stable")
+            pending = pending.take(order)
+            n_ready = int(np.searchsorted(times[order], bound, side="left")) \
+                if np.isfinite(bound) else pending.num_rows
+            if n_ready:
+                yield pending.slice(0, n_ready)
+                pending = pending.slice(n_ready)
+        # advance the streams at the bound
+        for stream in [stream for stream in active if stream.last_time <= bound]:
+            if not load(stream):
+                active.remove(stream)
+    if pending is not None and pending.num_rows:
+        yield pending
+
+
+def encoding_options(schema: pa.Schema) -> Dict:
+    """Byte stream split for floats, delta for integers (times, ids), no dictionaries."""
+    encodings = {}
+    for field in schema:
+        if pa.types.is_floating(field.type):
+            encodings[field.name] = "BYTE_STREAM_SPLIT"
+        elif pa.types.is_integer(field.type):
+            encodings[field.name] = "DELTA_BINARY_PACKED"
+    return {"use_dictionary": False, "column_encoding": encodings}
+
+
+class CompactedWriter:
+    """
+    Writes {dest}/{kind}/symbol={SYMBOL}/part-{first time}-{uuid}.parquet
+    files of at most file_rows rows in row groups of row_group_rows. A file
+    is written under a temporary name and renamed once complete, then
+    indexed in the manifest of dest.
+    """
+
+    def __init__(self, dest: str, kind: str, symbol: str, schema: pa.Schema,
+                 row_group_rows: int, file_rows: int, compression: str = "ZSTD",
+                 compression_level: int = None, filesystem=None):
+        self.directory = f"{str(dest).rstrip('/')}/{kind}/symbol={symbol}"
+        self.kind, self.symbol, self.schema = kind, symbol, schema
+        self.row_group_rows, self.file_rows = row_group_rows, file_rows
+        self.options = dict(compression=compression, compression_level=compression_level,
+                            **encoding_options(schema))
+        self.filesystem = filesystem
+        self.manifest = Manifest(dest) if filesystem is None else None
+        if filesystem is None:
+            os.makedirs(self.directory, exist_ok=True)
+        self.buffered: List[pa.Table] = []
+        self.n_buffered = 0
+        self.writer = None
+        self.tmp_path = None
+        self.first_time = None
+        self.n_file_rows = 0
+        self.paths: List[str] = []
+
+    def write(self, table: pa.Table) -> None:
+        self.buffered.append(table)
+        self.n_buffered += table.num_rows
+        while self.n_buffered >= self.row_group_rows:
+            self._write_row_group(self.row_group_rows)
+
+    def _write_row_group(self, n_rows: int) -> None:
+        table = pa.concat_tables(self.buffered).combine_chunks()
+        group, rest = table.slice(0, n_rows), table.slice(n_rows)
+        self.buffered, self.n_buffered = [rest], rest.num_rows
+        if self.writer is None:
+            self.first_time = group.column(TIME_COLUMN)[0].as_py()
+            self.tmp_path = f"{self.directory}/.part-{uuid.uuid4().hex}.inprogress"
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema,
+                                           filesystem=self.filesystem, **self.options)
+        self.writer.write_table(group, row_group_size=n_rows)
+        self.n_file_rows += n_rows
+        if self.n_file_rows >= self.file_rows:
+            self._close_file()
+
+    def _close_file(self) -> None:
+        self.writer.close()
+        path = f"{self.directory}/part-{int(self.first_time)}-{uuid.uuid4().hex[:8]}.parquet"
+        if self.filesystem is None:
+            os.replace(self.tmp_path, path)
+            self.manifest.add(path, file_info(path, self.kind, self.symbol))
+        else:
+            self.filesystem.mv(self.tmp_path, path)
+        self.paths.append(path)
+        log.info(f"Wrote {self.n_file_rows} rows to {path}")
+        self.writer, self.n_file_rows = None, 0
+
+    def close(self) -> List[str]:
+        if self.n_buffered:
+            self._write_row_group(self.n_buffered)
+        if self.writer is not None:
+            self._close_file()
+        return self.paths
+
+
+def compact(source: str, dest: str, symbol: str = None, kinds: List[str] = None,
+            row_group_bytes: int = 128 * 1024 * 1024, file_bytes: int = 1024 * 1024 * 1024,
+            merge_bytes: int = 256 * 1024 * 1024, max_open_files: int = 64,
+            tmp_dir: str = None, dedupe: bool = True, compression: str = "ZSTD",
+            compression_level: int = None) -> Dict[str, List[str]]:
+    """
+    Merge sort the parquet files of source (a local directory or
+    s3://bucket/prefix) by time into large re-encoded files under dest, per
+    symbol and kind. Memory is about merge_bytes for the merge plus one row
+    group being built. Returns the written paths per symbol/kind.
+    """
+    if str(source).rstrip("/") == str(dest).rstrip("/"):
+        raise ValueError("dest must differ from source, the sources are left untouched")
+    source_fs = dest_fs = None
+    if "://" in str(source) or "://" in str(dest):
+        import s3fs
+        s3 = s3fs.S3FileSystem()
+        source_fs = s3 if "://" in str(source) else None
+        dest_fs = s3 if "://" in str(dest) else None
+    source, dest = (str(path).split("://", 1)[-1] for path in (source, dest))
+    groups = defaultdict(list)
+    for path, kind, path_symbol in discover_files(source, symbol, filesystem=source_fs):
+        if path.startswith(dest.rstrip("/") + "/"):
+            continue
+        if kinds is None or kind in kinds:
+            groups[(path_symbol.upper(), kind)].append(path)
+
+    written = {}
+    for (group_symbol, kind), paths in sorted(groups.items()):
+        schemas = [_open(path, source_fs).schema_arrow for path in paths]
+        mappings = {json.dumps(column_mapping(file_schema), sort_keys=True)
+                    for file_schema in schemas}
+        if len(mappings) == 1:
+            # same output schema (and scales) everywhere, stays encoded
+            schema = pa.unify_schemas(schemas).remove_metadata() \
+                .with_metadata(schemas[0].metadata)
+        else:
+            # legacy float64 and compact int64 times / ids unify to float64
+            schema = pa.unify_schemas([decoded_schema(file_schema) for file_schema in schemas],
+                                      promote_options="permissive")
+        row_bytes = max(sum(max(field.type.bit_width, 8) // 8 for field in schema
+                            if pa.types.is_primitive(field.type)), 1)
+        writer = CompactedWriter(
+            dest, kind, group_symbol, schema,
+            row_group_rows=max(row_group_bytes // row_bytes, 1),
+            file_rows=max(file_bytes // row_bytes, 1),
+            compression=compression, compression_level=compression_level,
+            filesystem=dest_fs,
+        )
+        n_in = n_out = 0
+        batch_rows = max(merge_bytes // (max_open_files * row_bytes), 256)
+        for table in merge_sorted(paths, schema, source_fs, batch_rows, max_open_files, tmp_dir):
+            n_in += table.num_rows
+            if dedupe:
+                table = drop_duplicates(table)
+            n_out += table.num_rows
+            writer.write(table)
+        written[f"{group_symbol}/{kind}"] = writer.close()
+        log.info(f"{group_symbol} {kind}: {len(paths)} files, {n_in} rows -> "
+                 f"{len(written[f'{group_symbol}/{kind}'])} files, {n_out} rows "
+                 f"({n_in - n_out} duplicates)")
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Merge sort, deduplicate and re-encode a save directory into large files"
+    )
+    parser.add_argument("source", help="save directory or s3://bucket/prefix")
+    parser.add_argument("dest", help="output directory or s3://bucket/prefix")
+    parser.add_argument("--symbol", help="symbol of files outside symbol= directories")
+    parser.add_argument("--kinds", nargs="+", help="e.g. rows depth_changes, default all")
+    parser.add_argument("--row-group-mb", type=int, default=128)
+    parser.add_argument("--file-mb", type=int, default=1024, help="uncompressed size per file")
+    parser.add_argument("--merge-mb", type=int, default=256, help="memory of the merge")
+    parser.add_argument("--max-open-files", type=int, default=64,
+                        help="more overlapping files are merged in runs first")
+    parser.add_argument("--tmp-dir", help="directory of the intermediate runs")
+    parser.add_argument("--keep-duplicates", action="store_true")
+    parser.add_argument("--compression", default="ZSTD")
+    parser.add_argument("--compression-level", type=int)
+    args = parser.parse_args()
+    compact(args.source, args.dest, args.symbol, args.kinds,
+            row_group_bytes=args.row_group_mb * 1024 * 1024,
+            file_bytes=args.file_mb * 1024 * 1024, merge_bytes=args.merge_mb * 1024 * 1024,
+            max_open_files=args.max_open_files, tmp_dir=args.tmp_dir,
+            dedupe=not args.keep_duplicates, compression=args.compression,
+            compression_level=args.compression_level)
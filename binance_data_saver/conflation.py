@@ -0,0 +1,105 @@
+# type: ignore
+import logging
+import threading
+from typing import Callable
+
+from binance_data_saver.metrics import LogHistogram
+
+log = logging.getLogger(__file__)
+
+CONFLATE_EVERY_CHANGE = "every_change"
+CONFLATE_INTERVAL = "interval"
+CONFLATE_KLINE_ALIGNED = "kline_aligned"
+CONFLATION_MODES = (CONFLATE_EVERY_CHANGE, CONFLATE_INTERVAL, CONFLATE_KLINE_ALIGNED)
+
+
+class DepthConflator:
+    """
+    Thins the top-K updates of the book before they become depth rows; the
+    book itself still applies every diff. push(event_time, depth) is called
+    for every update, emit(event_time, depth) for the ones that are kept:
+
+    - every_change: every update
+    - interval: at most one book per interval_ms (event time). An update
+      at least interval_ms after the last emitted book is emitted; the
+      updates in between are held, each replacing the previous, and the
+      held one is emitted first, at the time the next row was allowed
+      (last emitted + interval_ms), which it was the book of
+    - kline_aligned: one book per tick, on multiples of interval_ms since
+      the epoch (so on the kline seconds): the latest book at or before the
+      tick, emitted at the tick's time once the first update past it arrives
+
+    Only event times are used, so a replay conflates the same way. The
+    number of updates folded into each emitted book is kept in
+    updates_per_row; flush() emits what is still held.
+    """
+
+    def __init__(self, mode: str, interval_ms: int, emit: Callable):
+        assert mode in CONFLATION_MODES, f"depth conflation must be one of {CONFLATION_MODES}"
+        assert mode == CONFLATE_EVERY_CHANGE or interval_ms > 0, \
+            "depth conflation needs a positive interval"
+        if mode == CONFLATE_KLINE_ALIGNED:
+            assert 1000 % interval_ms == 0 or interval_ms % 1000 == 0, \
+                "kline aligned ticks must divide a second or be whole seconds"
+        self.mode = mode
+        self.interval_ms = int(interval_ms)
+        self.emit = emit
+        self.lock = threading.Lock()
+        # latest update not emitted yet and the number of updates it stands for
+        self.pending = None
+        self.n_pending = 0
+        self.last_emitted = None
+        self.n_updates = 0
+        self.n_emitted = 0
+        self.updates_per_row = LogHistogram()
+
+    def push(self, event_time: int, depth) -> None:
+        with self.lock:
+            self.n_updates += 1
+            if self.mode == CONFLATE_EVERY_CHANGE:
+                self._emit(event_time, depth, 1)
+            elif self.mode == CONFLATE_INTERVAL:
+                # at exactly last emitted + interval_ms the new update supersedes it
+                if self.pending is not None and event_time - self.last_emitted > self.interval_ms:
+                    self._emit(self.last_emitted + self.interval_ms, self.pending[1],
+                               self.n_pending)
+                self.n_pending += 1
+                if self.last_emitted is None or event_time - self.last_emitted >= self.interval_ms:
+                    self._emit(event_time, depth, self.n_pending)
+                else:
+                    self.pending = (event_time, depth)
+            else:
+                if self.pending is not None and event_time > self._tick(self.pending[0]):
+                    self._emit(self._tick(self.pending[0]), self.pending[1], self.n_pending)
+                self.pending = (event_time, depth)
+                self.n_pending += 1
+
+    def _tick(self, event_time: int) -> int:
+        """First tick at or after event_time, the book at event_time holds until then."""
+        return -(-event_time // self.interval_ms) * self.interval_ms
+
+    def _emit(self, event_time: int, depth, n_updates: int) -> None:
+        self.pending = None
+        self.n_pending = 0
+        self.last_emitted = event_time
+        self.n_emitted += 1
+        self.updates_per_row.record(n_updates)
+        self.emit(event_time, depth)
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.pending is None:
+                return
+            event_time, depth = self.pending
+            if self.mode == CONFLATE_KLINE_ALIGNED:
+                event_time = self._tick(event_time)
+            elif self.mode == CONFLATE_INTERVAL:
+                event_time = self.last_emitted + self.interval_ms
+            self._emit(event_time, depth, self.n_pending)
+
+    def metrics(self):
+        return {
+            "updates": self.n_updates,
+            "emitted": self.n_emitted,
+            "updates_per_row": self.n_updates / self.n_emitted if self.n_emitted else 0.0,
+        }
@@ -0,0 +1,177 @@
+# type: ignore
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from binance_data_saver.row_buffer import TIME_COLUMN
+
+log = logging.getLogger(__file__)
+
+HOUR_MS = 3_600_000
+
+
+class _PartitionFile:
+    def __init__(self, path: str, kind: str, sink, writer: pq.ParquetWriter):
+        self.path = path
+        self.kind = kind
+        self.sink = sink
+        self.writer = writer
+        self.opened_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.n_rows = 0
+        self.n_row_groups = 0
+        self.min_time = None
+        self.max_time = None
+
+
+class RollingDatasetWriter:
+    """
+    Hive style dataset writer:
+    {base_dir}/{kind}/symbol={SYMBOL}/date={YYYY-MM-DD}/hour={HH}/part-{first time}-{uuid}.parquet
+    One ParquetWriter stays open per (kind, hour) partition and every flushed
+    buffer is appended to it as a row group. A file is closed once it grows
+    past roll_max_bytes or has been open for roll_max_seconds, and older hour
+    partitions are closed when more than max_open_partitions are open.
+    An open file has no footer yet: without the saver's write-ahead log a
+    crash loses every row written to it, up to roll_max_seconds of them.
+    """
+
+    def __init__(self, base_dir: str, symbol: str, compression: str,
+                 filesystem=None, roll_max_bytes: int = 256 * 1024 * 1024,
+                 roll_max_seconds: float = 3600, max_open_partitions: int = 2,
+                 on_file_closed: Callable = None):
+        self.base_dir = str(base_dir).rstrip("/")
+        self.symbol = symbol.upper()
+        self.compression = compression
+        self.filesystem = filesystem
+        self.roll_max_bytes = roll_max_bytes
+        self.roll_max_seconds = roll_max_seconds
+        self.max_open_partitions = max_open_partitions
+        # called with (path, info dict) after a file is complete
+        self.on_file_closed = on_file_closed
+        self.lock = threading.Lock()
+        self.partitions: Dict[tuple, _PartitionFile] = {}
+        # paths not closed yet, including partitions being rolled or evicted
+        self.unclosed_paths = set()
+
+    def partition_dir(self, kind: str, hour: int) -> str:
+        start = datetime.fromtimestamp(hour * HOUR_MS / 1000, tz=timezone.utc)
+        return (f"{self.base_dir}/{kind}/symbol={self.symbol}/"
+                f"date={start:%Y-%m-%d}/hour={start:%H}")
+
+    def _open(self, kind: str, hour: int, first_time: int,
+              schema: pa.Schema) -> _PartitionFile:
+        directory = self.partition_dir(kind, hour)
+        path = f"{directory}/part-{first_time}-{uuid.uuid4().hex[:12]}.parquet"
+        if self.filesystem is None:
+            os.makedirs(directory, exist_ok=True)
+            sink = open(path, "wb")
+        else:
+            sink = self.filesystem.open(path, "wb")
+        writer = pq.ParquetWriter(sink, schema, compression=self.compression)
+        self.unclosed_paths.add(path)
+        log.info(f"Opened {path}")
+        return _PartitionFile(path, kind, sink, writer)
+
+    def _close_file(self, partition: _PartitionFile) -> None:
+        partition.closed = True
+        partition.writer.close()
+        n_bytes = partition.sink.tell()
+        partition.sink.close()
+        # before the callback, so a path missing from open_paths() is always closed
+        with self.lock:
+            self.unclosed_paths.discard(partition.path)
+        log.info(f"Closed {partition.path}: {partition.n_rows} rows, "
+                 f"{partition.n_row_groups} row groups, {n_bytes} bytes")
+        if self.on_file_closed is not None:
+            self.on_file_closed(partition.path, {
+                "kind": partition.kind,
+                "symbol": self.symbol,
+                "rows": partition.n_rows,
+                "row_groups": partition.n_row_groups,
+                "bytes": n_bytes,
+                "min_time": partition.min_time,
+                "max_time": partition.max_time,
+            })
+
+    def open_paths(self) -> set:
+        """Paths of the files not closed yet, on_file_closed is still to come for each."""
+        with self.lock:
+            return set(self.unclosed_paths)
+
+    def write(self, kind: str, table: pa.Table, time_column: str = TIME_COLUMN) -> int:
+        """Append table to its hour partitions, returns the bytes written."""
+        if table.num_rows == 0:
+            return 0
+        times = table.column(time_column).to_numpy().astype(np.int64)
+        hours = times // HOUR_MS
+        n_bytes = 0
+        for hour in np.unique(hours).tolist():
+            if hours[0] == hours[-1]:
+                part, part_times = table, times
+            else:
+                mask = hours == hour
+                part, part_times = table.filter(pa.array(mask)), times[mask]
+            n_bytes += self._write_partition(kind, hour, part, part_times)
+        return n_bytes
+
+    def _write_partition(self, kind: str, hour: int, table: pa.Table,
+                         times: np.ndarray) -> int:
+        key = (kind, hour)
+        while True:
+            to_close = []
+            with self.lock:
+                partition = self.partitions.get(key)
+                if partition is None:
+                    partition = self._open(kind, hour, int(times.min()), table.schema)
+                    self.partitions[key] = partition
+                    # oldest hours other than this one, also when late rows reopen an old hour
+                    others = sorted(k for k in self.partitions if k[0] == kind and k != key)
+                    for old_key in others[:max(len(others) + 1 - self.max_open_partitions, 0)]:
+                        to_close.append(self.partitions.pop(old_key))
+            for old in to_close:
+                with old.lock:
+                    if not old.closed:
+                        self._close_file(old)
+
+            with partition.lock:
+                if partition.closed:
+                    # rolled or evicted by another writer thread meanwhile
+                    continue
+                # one row group per flushed buffer
+                n_bytes = partition.sink.tell()
+                partition.writer.write_table(table, row_group_size=table.num_rows)
+                n_bytes = partition.sink.tell() - n_bytes
+                partition.n_rows += table.num_rows
+                partition.n_row_groups += 1
+                low, high = int(times.min()), int(times.max())
+                partition.min_time = low if partition.min_time is None \
+                    else min(partition.min_time, low)
+                partition.max_time = high if partition.max_time is None \
+                    else max(partition.max_time, high)
+                should_roll = partition.sink.tell() >= self.roll_max_bytes or \
+                    time.monotonic() - partition.opened_at >= self.roll_max_seconds
+                if should_roll:
+                    with self.lock:
+                        if self.partitions.get(key) is partition:
+                            del self.partitions[key]
+                    self._close_file(partition)
+                return n_bytes
+
+    def close(self) -> None:
+        with self.lock:
+            partitions = list(self.partitions.values())
+            self.partitions = {}
+        for partition in partitions:
+            with partition.lock:
+                if not partition.closed:
+                    self._close_file(partition)
@@ -0,0 +1,127 @@
+# type: ignore
+# typed decoding of the binance stream payloads
+# https://binance-docs.github.io/apidocs/spot/en/#websocket-market-streams
+from typing import Dict, NamedTuple, Union
+
+import numpy as np
+
+try:
+    # optional, a good deal faster than the standard library on these payloads
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+class DepthDiff(NamedTuple):
+    event_time: int
+    first_update_id: int
+    final_update_id: int
+    # (n, 2) float64 arrays of (price, quantity)
+    bids: np.ndarray
+    asks: np.ndarray
+
+
+class Kline(NamedTuple):
+    event_time: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    start_time: int
+    end_time: int
+    first_trade_id: int
+    last_trade_id: int
+
+
+class AggTrade(NamedTuple):
+    event_time: int
+    price: float
+    quantity: float
+    is_buyer_maker: int
+    first_trade_id: int
+    last_trade_id: int
+    agg_trade_id: int
+    trade_time: int
+
+
+Payload = Union[str, bytes, dict]
+
+WS_BASE_URL = "wss://stream.binance.com:9443"
+REST_BASE_URL = "https://api.binance.com"
+
+
+def _as_dict(payload: Payload) -> dict:
+    if isinstance(payload, dict):
+        return payload
+    return loads(payload)
+
+
+def parse_levels(levels) -> np.ndarray:
+    """[[price, qty], ...] as strings or numbers -> contiguous (n, 2) float64 array."""
+    # numpy converts the numeric strings in C, no per-level float() calls
+    return np.array(levels, dtype=np.float64).reshape(-1, 2)
+
+
+def check_depth_snapshot(snapshot) -> Dict:
+    """A REST depth snapshot, ValueError for an error body such as {"code": -1003, ...}."""
+    if not isinstance(snapshot, dict) or not all(
+            key in snapshot for key in ("lastUpdateId", "bids", "asks")):
+        raise ValueError(f"Not a depth snapshot: {str(snapshot)[:200]}")
+    return snapshot
+
+
+def tick_size_from_exchange_info(payload: Payload) -> float:
+    """PRICE_FILTER tickSize of the first symbol of an exchangeInfo response."""
+    symbol_info = _as_dict(payload)["symbols"][0]
+    price_filter = [f for f in symbol_info["filters"] if f["filterType"] == "PRICE_FILTER"][0]
+    return float(price_filter["tickSize"])
+
+
+def step_size_from_exchange_info(payload: Payload) -> float:
+    """LOT_SIZE stepSize of the first symbol of an exchangeInfo response."""
+    symbol_info = _as_dict(payload)["symbols"][0]
+    lot_size = [f for f in symbol_info["filters"] if f["filterType"] == "LOT_SIZE"][0]
+    return float(lot_size["stepSize"])
+
+
+def decode_depth_diff(payload: Payload) -> DepthDiff:
+    data = _as_dict(payload)
+    return DepthDiff(
+        data["E"],
+        data["U"],
+        data["u"],
+        parse_levels(data["b"]),
+        parse_levels(data["a"]),
+    )
+
+
+def decode_kline(payload: Payload) -> Kline:
+    data = _as_dict(payload)
+    kline = data["k"]
+    return Kline(
+        int(data["E"]),
+        float(kline["o"]),
+        float(kline["h"]),
+        float(kline["l"]),
+        float(kline["c"]),
+        float(kline["v"]),
+        int(kline["t"]),
+        int(kline["T"]),
+        int(kline["f"]),
+        int(kline["L"]),
+    )
+
+
+def decode_agg_trade(payload: Payload) -> AggTrade:
+    data = _as_dict(payload)
+    return AggTrade(
+        int(data["E"]),
+        float(data["p"]),
+        float(data["q"]),
+        int(data["m"]),
+        int(data["f"]),
+        int(data["l"]),
+        int(data.get("a", 0)),
+        int(data.get("T", 0)),
+    )
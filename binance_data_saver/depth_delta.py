@@ -0,0 +1,290 @@
+# type: ignore
+# delta encoded depth storage: periodic top levels checkpoints plus a long
+# table of every level change, and the reader rebuilding top-k books from them
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from binance_data_saver.orderbook import SortedDictOrderBook
+from binance_data_saver.reader import DataReader
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.wal import LEVELS_CHANGES, LEVELS_CHECKPOINTS
+
+log = logging.getLogger(__file__)
+
+KIND_CHECKPOINTS = "depth_checkpoints"
+KIND_CHANGES = "depth_changes"
+
+SIDE_BID = 0
+SIDE_ASK = 1
+
+CHANGE_COLUMNS = {
+    TIME_COLUMN: np.int64,
+    "update_id": np.int64,
+    "side": np.int8,
+    "price": np.float64,
+    "quantity": np.float64,
+}
+CHECKPOINT_COLUMNS = dict(CHANGE_COLUMNS, level=np.int16)
+
+
+class LongTableBuffer:
+    """Growable columnar buffer of long format rows, appended a block at a time."""
+
+    def __init__(self, columns: Dict[str, type], capacity: int = 1024):
+        self.dtypes = columns
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        self.columns = {name: np.empty(self.capacity, dtype=dtype)
+                        for name, dtype in columns.items()}
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def _reserve(self, n: int) -> None:
+        if self.size + n <= self.capacity:
+            return
+        new_capacity = max(self.capacity * 2, self.size + n)
+        for name, column in self.columns.items():
+            grown = np.empty(new_capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+        self.capacity = new_capacity
+
+    def append_levels(self, event_time: int, update_id: int, side: int,
+                      levels: np.ndarray, with_level: bool = False) -> None:
+        """levels is an (n, 2) array of (price, quantity)."""
+        n = len(levels)
+        if n == 0:
+            return
+        self._reserve(n)
+        start, end = self.size, self.size + n
+        cols = self.columns
+        cols[TIME_COLUMN][start:end] = event_time
+        cols["update_id"][start:end] = update_id
+        cols["side"][start:end] = side
+        cols["price"][start:end] = levels[:, 0]
+        cols["quantity"][start:end] = levels[:, 1]
+        if with_level:
+            cols["level"][start:end] = np.arange(n)
+        self.size = end
+
+    def to_table(self) -> pa.Table:
+        n = self.size
+        return pa.Table.from_arrays(
+            [pa.array(self.columns[name][:n]) for name in self.dtypes],
+            list(self.dtypes),
+        )
+
+
+class DepthDeltaBuffer:
+    """
+    Collects the depth payloads of DepthCacheManager.process_updates as
+    level changes, with a checkpoint of the best checkpoint_levels per side
+    every checkpoint_interval_ms, after every new snapshot and at the start
+    of every flushed batch, so each batch can be decoded on its own.
+    Changes deeper than the last checkpointed level are not kept, they
+    could not be placed in the rebuilt book anyway.
+    """
+
+    def __init__(self, checkpoint_levels: int, checkpoint_interval_ms: int,
+                 capacity: int = 1024):
+        self.checkpoint_levels = checkpoint_levels
+        self.checkpoint_interval_ms = checkpoint_interval_ms
+        self.changes = LongTableBuffer(CHANGE_COLUMNS, capacity)
+        self.checkpoints = LongTableBuffer(CHECKPOINT_COLUMNS, 2 * checkpoint_levels)
+        self.last_checkpoint_time = None
+        self.snapshot_id = None
+        # deepest checkpointed bid and ask prices
+        self.bounds = (-np.inf, np.inf)
+        # optional WriteAheadLog of every append
+        self.wal = None
+
+    def __len__(self) -> int:
+        return len(self.changes) + len(self.checkpoints)
+
+    def append_checkpoint(self, event_time: int, update_id: int, side: int,
+                          levels: np.ndarray) -> None:
+        self.checkpoints.append_levels(event_time, update_id, side, levels, with_level=True)
+        if self.wal is not None:
+            self.wal.log_levels(LEVELS_CHECKPOINTS, event_time, update_id, side, levels)
+
+    def append_change(self, event_time: int, update_id: int, side: int,
+                      levels: np.ndarray) -> None:
+        self.changes.append_levels(event_time, update_id, side, levels)
+        if self.wal is not None and len(levels):
+            self.wal.log_levels(LEVELS_CHANGES, event_time, update_id, side, levels)
+
+    def seal(self) -> "DepthDeltaBuffer":
+        """Hand over the buffered tables and continue in a fresh buffer."""
+        sealed = DepthDeltaBuffer(self.checkpoint_levels, self.checkpoint_interval_ms,
+                                  capacity=0)
+        sealed.changes, sealed.checkpoints = self.changes, self.checkpoints
+        self.changes = LongTableBuffer(CHANGE_COLUMNS, self.changes.capacity)
+        self.checkpoints = LongTableBuffer(CHECKPOINT_COLUMNS, 2 * self.checkpoint_levels)
+        # next batch starts with a checkpoint of its own
+        self.last_checkpoint_time = None
+        return sealed
+
+    def add(self, data: Dict) -> None:
+        event_time, update_id = int(data["E"]), int(data["update_id"])
+        if (self.last_checkpoint_time is None or data["snapshot_id"] != self.snapshot_id
+                or event_time - self.last_checkpoint_time >= self.checkpoint_interval_ms):
+            # the diff is already applied to the book, so it is part of the checkpoint
+            bids, asks = data["book"].levels(self.checkpoint_levels)
+            self.append_checkpoint(event_time, update_id, SIDE_BID, bids)
+            self.append_checkpoint(event_time, update_id, SIDE_ASK, asks)
+            self.last_checkpoint_time = event_time
+            self.snapshot_id = data["snapshot_id"]
+            # a side shorter than checkpoint_levels is complete, keep all its changes
+            self.bounds = (
+                bids[-1, 0] if len(bids) == self.checkpoint_levels else -np.inf,
+                asks[-1, 0] if len(asks) == self.checkpoint_levels else np.inf,
+            )
+            return
+        bids, asks = data["bids"], data["asks"]
+        self.append_change(event_time, update_id, SIDE_BID, bids[bids[:, 0] >= self.bounds[0]])
+        self.append_change(event_time, update_id, SIDE_ASK, asks[asks[:, 0] <= self.bounds[1]])
+
+
+class DepthReconstructor:
+    """
+    Rebuilds top-k books from checkpoints and level changes. The book at
+    time t is the last checkpoint at or before t with every later change up
+    to t applied, in update id order. It is exact as long as the k-th
+    level stays within the price range of the last checkpoint.
+    """
+
+    def __init__(self, checkpoints: pa.Table, changes: pa.Table, n_levels: int):
+        self.n_levels = n_levels
+        checkpoint_cols = self._sorted_columns(checkpoints)
+        change_cols = self._sorted_columns(changes)
+        # one event stream per checkpoint: its levels first, then the changes after it
+        times = np.concatenate([checkpoint_cols[TIME_COLUMN], change_cols[TIME_COLUMN]])
+        update_ids = np.concatenate([checkpoint_cols["update_id"], change_cols["update_id"]])
+        is_checkpoint = np.concatenate([
+            np.ones(len(checkpoint_cols["price"]), dtype=bool),
+            np.zeros(len(change_cols["price"]), dtype=bool),
+        ])
+        # checkpoint rows sort before changes of the same update id
+        order = np.lexsort((~is_checkpoint, update_ids))
+        self.times = times[order]
+        self.update_ids = update_ids[order]
+        self.is_checkpoint = is_checkpoint[order]
+        self.sides = np.concatenate([checkpoint_cols["side"], change_cols["side"]])[order]
+        self.prices = np.concatenate([checkpoint_cols["price"], change_cols["price"]])[order]
+        self.quantities = np.concatenate(
+            [checkpoint_cols["quantity"], change_cols["quantity"]]
+        )[order]
+        # start of every checkpoint in the event stream
+        starts = np.flatnonzero(self.is_checkpoint & np.r_[True, ~self.is_checkpoint[:-1]
+                                                           | (np.diff(self.update_ids) != 0)])
+        self.checkpoint_starts = starts
+        self.checkpoint_times = self.times[starts]
+        # a checkpoint's changes end where the next checkpoint starts
+        self.checkpoint_ends = np.r_[starts[1:], len(self.times)]
+
+    @staticmethod
+    def _sorted_columns(table: pa.Table) -> Dict[str, np.ndarray]:
+        return {name: table.column(name).to_numpy() for name in
+                (TIME_COLUMN, "update_id", "side", "price", "quantity")}
+
+    @classmethod
+    def from_dir(cls, directory: str, symbol: str, n_levels: int, start_time: int = None,
+                 end_time: int = None, s3_endpoint_url: str = None) -> "DepthReconstructor":
+        """
+        Books of symbol in [start_time, end_time] (everything by default),
+        reading only the files the manifest selects, from the last
+        checkpoint at or before start_time on.
+        """
+        reader = DataReader(directory, s3_endpoint_url)
+        first = None
+        if start_time is not None:
+            # a checkpoints file starts with a checkpoint, so the last one at or
+            # before start_time is in the files from the latest such start on
+            first = max((entry["min_time"] for entry in
+                         reader.files(symbol, None, start_time, KIND_CHECKPOINTS)
+                         if entry["min_time"] is not None), default=None)
+            if first is None:
+                raise ValueError(f"No {symbol} checkpoint at or before {start_time}")
+        checkpoints = reader.read(symbol, first, end_time, kind=KIND_CHECKPOINTS)
+        if checkpoints is None:
+            raise FileNotFoundError(f"No {KIND_CHECKPOINTS} files of {symbol} in {directory}")
+        if start_time is not None:
+            times = checkpoints.column(TIME_COLUMN).to_numpy()
+            first = int(times[times <= start_time].max())
+            checkpoints = checkpoints.filter(pc.field(TIME_COLUMN) >= first)
+        changes = reader.read(symbol, first, end_time, kind=KIND_CHANGES)
+        if changes is None:
+            changes = pa.table({name: np.empty(0, dtype=dtype)
+                                for name, dtype in CHANGE_COLUMNS.items()})
+        return cls(checkpoints, changes, n_levels)
+
+    def book_at(self, event_time: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best n_levels (price, quantity) per side as of event_time."""
+        i = np.searchsorted(self.checkpoint_times, event_time, side="right") - 1
+        if i < 0:
+            raise ValueError(f"No checkpoint at or before {event_time}")
+        start, end = self.checkpoint_starts[i], self.checkpoint_ends[i]
+        segment = slice(start, end)
+        # update ids and event times rise together within a checkpoint segment
+        end = start + np.searchsorted(self.times[segment], event_time, side="right")
+        sides, prices = self.sides[start:end], self.prices[start:end]
+        quantities = self.quantities[start:end]
+        # last event per (side, price) wins, bids keyed by -price to keep them apart
+        keys = np.where(sides == SIDE_BID, -prices, prices)
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        live = last[quantities[last] > 0]
+        return (self._side_top(prices, quantities, live[sides[live] == SIDE_BID], True),
+                self._side_top(prices, quantities, live[sides[live] == SIDE_ASK], False))
+
+    def _side_top(self, prices: np.ndarray, quantities: np.ndarray,
+                  idx: np.ndarray, is_bid: bool) -> np.ndarray:
+        order = np.argsort(-prices[idx] if is_bid else prices[idx], kind="stable")
+        idx = idx[order[:self.n_levels]]
+        return np.column_stack([prices[idx], quantities[idx]])
+
+    def books_between(self, start_time: int, end_time: int,
+                      step_ms: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Books every step_ms in [start_time, end_time], or after every stored
+        event if step_ms is None. Returns times and (n, n_levels, 2) bid and
+        ask arrays, missing levels are zero filled like the wide layout.
+        """
+        if step_ms is None:
+            mask = (self.times >= start_time) & (self.times <= end_time)
+            times = np.unique(self.times[mask])
+        else:
+            times = np.arange(start_time, end_time + 1, step_ms, dtype=np.int64)
+        bids = np.zeros((len(times), self.n_levels, 2))
+        asks = np.zeros((len(times), self.n_levels, 2))
+        segments = np.searchsorted(self.checkpoint_times, times, side="right") - 1
+        if len(times) and segments[0] < 0:
+            raise ValueError(f"No checkpoint at or before {times[0]}")
+        # one forward pass per checkpoint segment: the events up to each
+        # requested time are applied to a book kept from the previous one
+        segment = book = None
+        for i, (event_time, segment_i) in enumerate(zip(times.tolist(), segments.tolist())):
+            if segment_i != segment:
+                segment = segment_i
+                book = SortedDictOrderBook({"n_depth_pairs": self.n_levels})
+                applied, end = self.checkpoint_starts[segment], self.checkpoint_ends[segment]
+            upto = applied + np.searchsorted(self.times[applied:end], event_time, side="right")
+            if upto > applied:
+                is_bid = self.sides[applied:upto] == SIDE_BID
+                levels = np.column_stack([self.prices[applied:upto],
+                                          self.quantities[applied:upto]])
+                book.apply_diff(levels[is_bid], levels[~is_bid])
+                applied = upto
+            top_bids, top_asks = book.top_k()
+            bids[i, :len(top_bids)] = top_bids
+            asks[i, :len(top_asks)] = top_asks
+        return times, bids, asks
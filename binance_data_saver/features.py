@@ -0,0 +1,205 @@
+# type: ignore
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pyarrow as pa
+
+from binance_data_saver.row_buffer import TIME_COLUMN, ColumnarRowBuffer
+
+log = logging.getLogger(__file__)
+
+KIND_BARS = "bars"
+
+# columns carried from one flush to the next for the bars still open
+_CARRIED = ("time", "price", "quantity", "sign", "mid", "microprice")
+
+
+class BarsBatch:
+    """Sealed bars table, submitted to the BackgroundWriter like a row buffer."""
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.nbytes = table.nbytes
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def to_table(self) -> pa.Table:
+        return self.table
+
+
+class FeatureStage:
+    """
+    Microstructure features computed on a sealed row buffer with vectorized
+    NumPy, so downstream jobs do not have to rescan the raw columns. The
+    row buffer gets extra columns (mid, spread, microprice, top-N
+    imbalance, order flow imbalance and signed trade volume), depth values
+    forward filled over rows without a depth update. Fixed interval bars
+    (OHLC, volume, VWAP, signed volume) are returned as a side table.
+
+    Flushes are processed in order and the state of the last depth row and
+    the trades of the bars still open is carried to the next flush, so bars
+    are complete and OFI continuous across flushes. Rows of a flush older
+    than the bars already emitted (only possible without align_streams)
+    start a second bar for the same interval.
+    """
+
+    def __init__(self, config: Dict):
+        self.n_imbalance_levels = config.get("feature_imbalance_levels", 5)
+        self.bar_intervals_ms: List[int] = sorted(config.get("bar_intervals_ms", [100, 1000]))
+        # best bid price / qty, best ask price / qty, top-N bid qty, top-N ask qty
+        self.last_depth = None
+        self.carried = {name: np.empty(0, dtype=np.int64 if name == "time" else np.float64)
+                        for name in _CARRIED}
+        # interval -> start time of the first bar not emitted yet
+        self.emitted_until: Dict[int, int] = {}
+
+    def process(self, row_buffer: ColumnarRowBuffer, final: bool = False) -> BarsBatch:
+        """Attach the feature columns to row_buffer, returns the bars completed by it."""
+        n = len(row_buffer)
+        if n == 0 and not (final and len(self.carried["time"])):
+            return None
+        order = np.argsort(row_buffer.times[:n], kind="stable") \
+            if not row_buffer.is_sorted else slice(None)
+        times = row_buffer.times[:n][order]
+        cols = {name: row_buffer.columns[name][:n][order]
+                for name in ("price_trade", "quantity_trade", "is_market_maker")}
+
+        # delta depth storage: no depth in the rows, bars get no mid / microprice
+        features = self._depth_features(row_buffer, order) if row_buffer.n_depth_pairs > 0 \
+            else {}
+        quantity = cols["quantity_trade"]
+        # buyer is maker: the seller took liquidity; -1 marks merged trades of both sides
+        sign = np.select([cols["is_market_maker"] == 1, cols["is_market_maker"] == 0],
+                         [-1.0, 1.0], 0.0)
+        sign[quantity <= 0] = 0.0
+        features["signed_volume"] = sign * quantity
+        row_buffer.extra_columns = features
+        if not isinstance(order, slice) and not row_buffer.config.get("sort_by_time", True):
+            # to_table keeps the arrival order, put the features back in it
+            inverse = np.empty_like(order)
+            inverse[order] = np.arange(n)
+            row_buffer.extra_columns = {name: values[inverse] for name, values in features.items()}
+
+        if not self.bar_intervals_ms:
+            return None
+        rows = {
+            "time": times,
+            "price": cols["price_trade"],
+            "quantity": quantity,
+            "sign": sign,
+            "mid": features.get("mid", np.full(n, np.nan)),
+            "microprice": features.get("microprice", np.full(n, np.nan)),
+        }
+        rows = {name: np.concatenate([self.carried[name], rows[name]]) for name in _CARRIED}
+        is_new = np.arange(len(rows["time"])) >= len(self.carried["time"])
+        if (np.diff(rows["time"]) < 0).any():
+            order = np.argsort(rows["time"], kind="stable")
+            rows = {name: values[order] for name, values in rows.items()}
+            is_new = is_new[order]
+        bars = [self._bars(rows, is_new, interval, final) for interval in self.bar_intervals_ms]
+        bars = [table for table in bars if table is not None]
+        # keep the rows of the widest bar still open
+        open_start = (rows["time"][-1] // self.bar_intervals_ms[-1]) * self.bar_intervals_ms[-1] \
+            if len(rows["time"]) and not final else np.inf
+        keep = rows["time"] >= open_start
+        self.carried = {name: values[keep] for name, values in rows.items()}
+        if not bars:
+            return None
+        return BarsBatch(pa.concat_tables(bars))
+
+    def _depth_features(self, row_buffer: ColumnarRowBuffer, order) -> Dict[str, np.ndarray]:
+        n = len(row_buffer)
+        k = min(self.n_imbalance_levels, row_buffer.n_depth_pairs)
+        bids, asks = row_buffer.bids[:, :n], row_buffer.asks[:, :n]
+        # reorder the 6 rows needed, not the whole depth block
+        state = np.stack([
+            bids[0], bids[1], asks[0], asks[1],
+            bids[1:2 * k:2].sum(axis=0), asks[1:2 * k:2].sum(axis=0),
+        ])[:, order]
+        # rows without a depth update take the last depth row, also from the previous flush
+        has_depth = (state[0] > 0) & (state[2] > 0)
+        idx = np.where(has_depth, np.arange(n), -1)
+        np.maximum.accumulate(idx, out=idx)
+        if self.last_depth is not None:
+            state = np.concatenate([self.last_depth[:, None], state], axis=1)
+            idx += 1
+            filled = state[:, idx]
+        else:
+            filled = np.where(idx >= 0, state[:, np.maximum(idx, 0)], np.nan)
+            state = np.concatenate([np.full((6, 1), np.nan), state], axis=1)
+            idx += 1
+        bid, bid_qty, ask, ask_qty, top_bid_qty, top_ask_qty = filled
+
+        # order flow imbalance (Cont, Kukanov, Stoikov) of each depth row against the previous one
+        depth_rows = np.flatnonzero(has_depth) + 1
+        prev = np.concatenate([[0], depth_rows[:-1]])
+        b, bq, a, aq = state[0, depth_rows], state[1, depth_rows], \
+            state[2, depth_rows], state[3, depth_rows]
+        pb, pbq, pa_, paq = state[0, prev], state[1, prev], state[2, prev], state[3, prev]
+        with np.errstate(invalid="ignore"):
+            e = np.where(b >= pb, bq, 0.0) - np.where(b <= pb, pbq, 0.0) \
+                - np.where(a <= pa_, aq, 0.0) + np.where(a >= pa_, paq, 0.0)
+        ofi = np.zeros(n)
+        ofi[depth_rows - 1] = np.nan_to_num(e)
+        if len(depth_rows):
+            self.last_depth = state[:, depth_rows[-1]].copy()
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "mid": (bid + ask) / 2,
+                "spread": ask - bid,
+                "microprice": (bid * ask_qty + ask * bid_qty) / (bid_qty + ask_qty),
+                f"imbalance_{k}": (top_bid_qty - top_ask_qty) / (top_bid_qty + top_ask_qty),
+                "ofi": ofi,
+            }
+
+    def _bars(self, rows: Dict[str, np.ndarray], is_new: np.ndarray, interval: int,
+              final: bool) -> pa.Table:
+        times = rows["time"]
+        if len(times) == 0:
+            return None
+        bar_ids = times // interval
+        # carried rows of bars already emitted are skipped, the last bar may still be open
+        first = self.emitted_until.get(interval, -np.inf)
+        last = bar_ids[-1] + 1 if final else bar_ids[-1]
+        selected = (is_new | (bar_ids >= first)) & (bar_ids < last)
+        if not selected.any():
+            return None
+        self.emitted_until[interval] = max(first, last)
+        bar_ids = bar_ids[selected]
+        price, quantity, sign = rows["price"][selected], rows["quantity"][selected], \
+            rows["sign"][selected]
+        starts = np.flatnonzero(np.diff(bar_ids, prepend=bar_ids[0] - 1))
+        ends = np.append(starts[1:], len(bar_ids)) - 1
+
+        traded = quantity > 0
+        trade_price = np.where(traded, price, np.nan)
+        volume = np.add.reduceat(quantity, starts)
+        notional = np.add.reduceat(quantity * price, starts)
+        signed = np.add.reduceat(sign * quantity, starts)
+        # first and last trade of each bar
+        trade_rows = np.flatnonzero(traded)
+        first_trade = np.searchsorted(trade_rows, starts)
+        last_trade = np.searchsorted(trade_rows, ends, side="right") - 1
+        has_trades = first_trade <= last_trade
+        padded = np.append(trade_price[trade_rows], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns = {
+                TIME_COLUMN: bar_ids[starts] * interval,
+                "interval_ms": np.full(len(starts), interval),
+                "open": np.where(has_trades, padded[first_trade], np.nan),
+                "high": np.fmax.reduceat(trade_price, starts),
+                "low": np.fmin.reduceat(trade_price, starts),
+                "close": np.where(has_trades, padded[np.maximum(last_trade, 0)], np.nan),
+                "volume": volume,
+                "vwap": notional / volume,
+                "signed_volume": signed,
+                "buy_volume": np.add.reduceat(np.where(sign > 0, quantity, 0.0), starts),
+                "sell_volume": np.add.reduceat(np.where(sign < 0, quantity, 0.0), starts),
+                "n_trade_rows": np.add.reduceat(traded.astype(np.int64), starts),
+                "mid_close": rows["mid"][selected][ends],
+                "microprice_close": rows["microprice"][selected][ends],
+            }
+        return pa.table(columns)
@@ -1,19 +1,36 @@
 # type: ignore
+import asyncio
 import os
-from typing import Dict
+import signal
+import sys
+import time
+from typing import Dict, Optional
 
 import yaml
 import logging
 from binance import ThreadedWebsocketManager
 
 from binance_data_saver.manage_ws_depth import DepthCacheManager
+from binance_data_saver.metrics import register_collector, start_metrics
 from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.recorder import KIND_AGG_TRADE, KIND_KLINE, RawMessageRecorder
 
 WORK_DIR = os.path.dirname(os.path.realpath(__file__))
 
 logging.basicConfig(level = logging.INFO)
 log = logging.getLogger(__file__)
 
+def new_recorder(config: Dict, symbol: str) -> Optional[RawMessageRecorder]:
+    if not config.get("record_raw_messages", False):
+        return None
+    record_dir = os.path.join(WORK_DIR, config["record_dir"])
+    os.makedirs(record_dir, exist_ok=True)
+    record_path = os.path.join(
+        record_dir, f"raw_{symbol.lower()}_{time.strftime('%Y%m%dT%H%M%S')}.zst"
+    )
+    log.info(f"Recording raw messages to {record_path}")
+    return RawMessageRecorder(record_path)
+
 class CryptoTokenDataCollector:
     def __init__(self, symbol: str, api_key: str, api_secret: str, config: Dict):
         self.symbol = symbol.lower()
@@ -30,21 +47,56 @@ class CryptoTokenDataCollector:
         self.depth_cache_manager = DepthCacheManager(
             config=self.config, should_plot=config["should_plot_depth"]
         )
+        self.recorder = new_recorder(config, self.symbol)
+        self.depth_cache_manager.recorder = self.recorder
 
     def start_data_collection(self, data_handler: ParquetSaver) -> None:
+        register_collector(self.symbol, data_handler, self.depth_cache_manager)
+        start_metrics(self.config)
+        # SIGTERM unwinds like Ctrl-C, through the finally below
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            if self.config.get("ingestion_mode", "threaded") == "asyncio":
+                self.start_async_data_collection(data_handler)
+            else:
+                self.start_threaded_data_collection(data_handler)
+        finally:
+            log.info("Stopping, writing out the buffered rows")
+            data_handler.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            self.depth_cache_manager.close()
+
+    def start_threaded_data_collection(self, data_handler: ParquetSaver) -> None:
+        ohlc_cb, agg_trades_cb = data_handler.ohlc_cb, data_handler.agg_trades_cb
+        if self.recorder is not None:
+            ohlc_cb = self.recorder.wrap(KIND_KLINE, ohlc_cb)
+            agg_trades_cb = self.recorder.wrap(KIND_AGG_TRADE, agg_trades_cb)
         self.twm.start()
         self.twm.start_kline_socket(
-            callback=data_handler.ohlc_cb,
+            callback=ohlc_cb,
             symbol=self.symbol,
             interval=self.twm_kline_interval,
         )
         self.twm.start_aggtrade_socket(
-            callback=data_handler.agg_trades_cb, symbol=self.symbol
+            callback=agg_trades_cb, symbol=self.symbol
         )
-        self.depth_cache_manager.run_forever(
-            data_handler.depth_cb, self.symbol, self.config["depth_update_rate"]
+        try:
+            self.depth_cache_manager.run_forever(
+                data_handler.depth_cb, self.symbol, self.config["depth_update_rate"]
+            )
+            self.twm.join()
+        finally:
+            self.twm.stop()
+
+    def start_async_data_collection(self, data_handler: ParquetSaver) -> None:
+        # aiohttp comes with the asyncio extra, the threaded mode runs without it
+        from binance_data_saver.async_engine import AsyncIngestionEngine
+        engine = AsyncIngestionEngine(
+            self.symbol, self.config, data_handler,
+            depth_cache_manager=self.depth_cache_manager, recorder=self.recorder,
         )
-        self.twm.join()
+        asyncio.run(engine.run())
 
 def load_config():
     config: Dict = {}
@@ -57,6 +109,12 @@ if __name__ == "__main__":
     config = load_config()
     assert len(config) != 0, "Problem loading the config file"
 
+    if config.get("tokens"):
+        # multi-symbol mode, symbols sharded over worker processes
+        from binance_data_saver.supervisor import ShardSupervisor
+        ShardSupervisor(config["tokens"], config).run()
+        raise SystemExit(0)
+
     api_key = None # os.environ["BINANCE_API_KEY"]
     api_secret = None # os.environ["BINANCE_API_SECRET"]
 
@@ -1,28 +1,39 @@
 # class to manage websocket depth data according to
 # https://binance-docs.github.io/apidocs/spot/en/#how-to-manage-a-local-order-book-correctly
 #  type: ignore
+import logging
 import os
+import random
 import threading
 import time
-import warnings
-from datetime import datetime
-from json import loads
-from typing import Dict, List
+from collections import deque
+from typing import Dict
 
-import matplotlib.pyplot as plt
 import numpy as np
 import requests
-import seaborn as sns
 import websocket
 from websocket import WebSocketApp
 import yaml
-from sortedcontainers import SortedDict
 
-# Filter out the specific pandas FutureWarning about use_inf_as_na
-warnings.filterwarnings("ignore", message="use_inf_as_na option is deprecated", category=FutureWarning)
+from binance_data_saver.decoding import (
+    REST_BASE_URL,
+    WS_BASE_URL,
+    DepthDiff,
+    check_depth_snapshot,
+    decode_depth_diff,
+    loads,
+    parse_levels,
+    tick_size_from_exchange_info,
+)
+from binance_data_saver.metrics import LogHistogram
+from binance_data_saver.orderbook import make_orderbook
+from binance_data_saver.recorder import KIND_DEPTH, KIND_EXCHANGE_INFO, KIND_SNAPSHOT
 
-sns.set_theme()
 DEBUG = False
+log = logging.getLogger(__file__)
+
+SYNC_STATE_RESYNCING = "resyncing"
+SYNC_STATE_LIVE = "live"
 
 
 class DepthCacheManager:
@@ -34,12 +45,20 @@ class DepthCacheManager:
         # create websocket connection
         self.config = config
         self.should_plot = should_plot
-
-    def _flatten(self, list_of_lists: List):
-        return [item for sublist in list_of_lists for item in sublist]
-
-    def _get_time_string(self) -> str:
-        return datetime.utcnow().strftime("%F %T.%f")[:-3]
+        # optional RawMessageRecorder for depth diffs and REST responses
+        self.recorder = None
+        # pooled connection for snapshots and exchangeInfo
+        self.session = requests.Session()
+        # False fetches resync snapshots on the websocket thread (used by replay)
+        self.resync_in_background = True
+        self.book_lock = threading.Lock()
+        # exported by binance_data_saver.metrics
+        self.lag_ms = LogHistogram()
+        self.process_updates_us = LogHistogram()
+        # with should_plot, top-K snapshots go to a shared memory ring read by
+        # the visualizer process (created once the token is known)
+        self.plot_ring = None
+        self.visualizer = None
 
     def initialize_socket_and_params(self, token: str, update_rate_ms: int) -> None:
         self.ws = self.initialize_socket(token, update_rate_ms)
@@ -47,7 +66,7 @@ class DepthCacheManager:
 
     def initialize_socket(self, token, update_rate_ms):
         return WebSocketApp(
-            url=f"wss://stream.binance.com:9443/ws/{token}@depth@{update_rate_ms}ms",
+            url=f"{self.config.get('ws_base_url', WS_BASE_URL)}/ws/{token}@depth@{update_rate_ms}ms",
             on_message=self.on_message,
             on_error=self.on_error,
         )
@@ -55,140 +74,83 @@ class DepthCacheManager:
     def initialize_params(self, token):
         """initialize params"""
         self.token = token
-        self.orderbook = {}
+        if self.should_plot and self.plot_ring is None:
+            self.start_visualizer()
+        self.orderbook = None
+        self.last_update_id = None
+        # lastUpdateId of the snapshot the book was last loaded from
+        self.snapshot_id = None
+        # diffs applied since the last snapshot
         self.updates = 0
-        self.ax, self.fig = None, None
-        self.asks_plot, self.bids_plot = None, None
-        if self.should_plot:
-            self.init_plot()
-        self.xlims = (None, None)
+        self.state = SYNC_STATE_RESYNCING
+        self.snapshot_in_flight = False
+        self.resync_started_at = time.perf_counter()
+        self.pending_diffs = deque(maxlen=self.config.get("resync_buffer_size", 1000))
+        self.pending_validation = None
+        self.failed_validations = 0
+        # failed or too old snapshots in a row, backs the next request off
+        self.snapshot_failures = 0
+        self.sync_stats = {
+            "gaps": 0,
+            "resyncs": 0,
+            "failed_snapshots": 0,
+            "stale_diffs": 0,
+            "dropped_diffs": 0,
+            "validations": 0,
+            "failed_validations": 0,
+            "last_resync_ms": 0.0,
+            "max_resync_ms": 0.0,
+        }
+        self.last_event_time = 0
         self.bounds = [None, None]
 
-    def clear_plot(self):
-        if len(self.ax.lines) > 0:
-            # print("n_lines: ", len(self.ax.lines))
-            while len(self.ax.lines) > 0:
-                self.ax.lines[len(self.ax.lines) - 1].remove()
-        # # print("returning")
-
-    def init_plot(self):
-        plt.ion()
-        # to run GUI event loop
-        # here we are creating sub plots
-
-        self.fig, self.ax = plt.subplots()
-        # Set the y-axis to start at the middle of the chart
-        bids_x = np.linspace(1100, 1200, 5)
-        bids_y = np.random.randint(1, 50, 5)
-
-        asks_x = np.linspace(1201, 1400, 5)
-        asks_y = np.random.randint(1, 50, 5)
-
-        sns.ecdfplot(
-            x=bids_x,
-            weights=bids_y,
-            stat="count",
-            color="red",
-            complementary=True,
-            ax=self.ax,
-        )
-        sns.ecdfplot(x=asks_x, weights=asks_y, stat="count", color="blue", ax=self.ax)
-        # Add a legend and show the plot
-        self.ax.ticklabel_format(useOffset=False, style="plain")
-
-    def get_plot_bids_n_asks(self) -> (List, List, List, List):
-        arr_1 = self.orderbook["bids"]
-        arr_2 = self.orderbook["asks"]
-        arr1, arr2 = list(arr_1.items()), list(arr_2.items())
-        bids_x, bids_y = [], []
-        asks_x, asks_y = [], []
-
-        for bid_v, bid_q in arr1[: min(len(arr1), self.config["n_depth_pairs"])]:
-            # Skip infinite values
-            if np.isinf(bid_v) or np.isinf(bid_q):
-                continue
-            bids_x.append(bid_v)
-            bids_y.append(bid_q)
+    def start_visualizer(self) -> None:
+        # imported here, the collector itself never needs it
+        from binance_data_saver.visualizer import DepthSnapshotRing, start_visualizer
 
-        for ask_v, ask_q in arr2[: min(len(arr2), self.config["n_depth_pairs"])]:
-            # Skip infinite values
-            if np.isinf(ask_v) or np.isinf(ask_q):
-                continue
-            asks_x.append(ask_v)
-            asks_y.append(ask_q)
-
-        return bids_x, bids_y, asks_x, asks_y
+        self.plot_ring = DepthSnapshotRing(f"depth_{self.token.lower()}",
+                                           self.config["n_depth_pairs"], create=True)
+        self.visualizer = start_visualizer(self.plot_ring, self.config.get("plot_fps", 10),
+                                           self.token.upper())
 
-    def plot_orderbook(self) -> None:
-        if not self.should_plot:
+    def publish_orderbook(self) -> None:
+        """Copy the top levels to the visualizer's ring, it draws at its own frame rate."""
+        if self.plot_ring is None:
             return
-        bids_x, bids_y, asks_x, asks_y = self.get_plot_bids_n_asks()
-
-        self.clear_plot()
-
-        # Make sure we have data to plot
-        if not bids_x or not asks_x:
-            return
-
-        # Update assert to check if we have any data, not requiring exact counts
-        assert len(bids_x) == len(bids_y) and len(asks_x) == len(asks_y), "invalid len"
-
-        sns.ecdfplot(
-            x=bids_x,
-            weights=bids_y,
-            stat="count",
-            color="red",
-            complementary=True,
-            ax=self.ax,
-        )
-        sns.ecdfplot(x=asks_x, weights=asks_y, stat="count", color="blue", ax=self.ax)
-
-        self.ax.relim(True)
-        # Update the plot
-        # ax.autoscale_view()
-        # drawing updated values
-        self.fig.canvas.draw()
-        # This will run the GUI event
-        # loop until all UI events
-        # currently waiting have been processed
-        self.fig.canvas.flush_events()
-        time.sleep(0.01)
-
-    # def save_bids_n_asks(self, bids, asks, lastUpdateId, fname):
-    #     bids = self._flatten([[key, value] for key, value in bids.items()])
-    #     asks = self._flatten([[-key, value] for key, value in asks.items()])
-    #     csv_write_list = [lastUpdateId, *bids, *asks]
-    #     self._write_row(csv_write_list, fname)
-
-    def get_snapshots(self):
+        top_bids, top_asks = self.orderbook.top_k(self.config["n_depth_pairs"])
+        self.plot_ring.publish(self.last_event_time, top_bids, top_asks)
+
+    def close(self) -> None:
+        if self.visualizer is not None:
+            self.visualizer.terminate()
+            self.visualizer.join()
+            self.visualizer = None
+        if self.plot_ring is not None:
+            self.plot_ring.close()
+            self.plot_ring = None
+
+    def validate_periodically(self) -> None:
+        """
+        Fetch a small snapshot every validation_interval_s and queue it for
+        validate_orderbook, which runs on the websocket thread once the live
+        book has caught up with the snapshot's lastUpdateId.
+        """
+        interval = self.config.get("validation_interval_s", 10)
+        levels = self.config.get("validation_levels", 10)
         while True:
-            snapshot = self.get_snapshot()
-
-            snapshot["bids"] = [(float(x[0]), float(x[1])) for x in snapshot["bids"]]
-            snapshot["asks"] = [(float(x[0]), float(x[1])) for x in snapshot["asks"]]
-
-            bids = {b[0]: b[1] for b in snapshot["bids"]}
-            asks = {b[0]: b[1] for b in snapshot["asks"]}
-
-            snapshot["bids"] = SortedDict(lambda x: -x)
-            snapshot["bids"].update(bids)
-            snapshot["asks"] = SortedDict(asks)
-            # print("snapsho bids: ", snapshot["bids"].items())
-            # print("snapshot asks: ", snapshot["asks"].items())
-
-            # bids_tuple_arr = snapshot["bids"].items()
-            # for i in (1, len(bids_tuple_arr) - 1):
-            #     assert float(bids_tuple_arr[i][0]) < float(bids_tuple_arr[i - 1][0])
-
-            # asks_tuple_arr = snapshot["asks"].items()
-            # for i in (1, len(asks_tuple_arr) - 1):
-            #     assert float(asks_tuple_arr[i][0]) > float(asks_tuple_arr[i - 1][0])
-
-            self.bounds = [
-                snapshot["bids"].items()[len(snapshot["asks"]) - 1][0],
-                snapshot["asks"].items()[len(snapshot["asks"]) - 1][0],
-            ]
-            time.sleep(1)
+            time.sleep(interval)
+            if self.state != SYNC_STATE_LIVE:
+                continue
+            try:
+                # only compared against the live book, not worth recording
+                snapshot = self.get_snapshot(record=False, limit=levels)
+                self.pending_validation = (
+                    snapshot["lastUpdateId"],
+                    parse_levels(snapshot["bids"]),
+                    parse_levels(snapshot["asks"]),
+                )
+            except Exception:
+                log.exception("Validation snapshot failed")
 
     # keep connection alive
     def run_forever(self, update_callback, token, update_rate_ms) -> None:
@@ -200,104 +162,262 @@ class DepthCacheManager:
         self.initialize_socket_and_params(token, update_rate_ms)
         self.update_callback = update_callback
 
-        t2 = threading.Thread(target=self.get_snapshots)
-        t2.start()
+        if self.config.get("validation_interval_s", 10) > 0:
+            t2 = threading.Thread(target=self.validate_periodically, daemon=True)
+            t2.start()
 
         self.ws.run_forever()
         # # print("AFTER RUNniNG FOREVER")
 
-    def init_from_snapshot(self) -> None:
-        self.orderbook = self.get_snapshot()
-        self.orderbook["bids"] = [
-            (float(x[0]), float(x[1])) for x in self.orderbook["bids"]
-        ]
-        self.orderbook["asks"] = [
-            (float(x[0]), float(x[1])) for x in self.orderbook["asks"]
-        ]
-
-        bids = {b[0]: b[1] for b in self.orderbook["bids"]}
-        asks = {b[0]: b[1] for b in self.orderbook["asks"]}
-
-        self.orderbook["bids"] = SortedDict(lambda x: -x)
-        self.orderbook["bids"].update(bids)
-        self.orderbook["asks"] = SortedDict(asks)
-        self.bounds = [
-            self.orderbook["bids"].items()[len(self.orderbook["asks"]) - 1][0],
-            self.orderbook["asks"].items()[len(self.orderbook["asks"]) - 1][0],
-        ]
-        self.plot_orderbook()
-
     def on_message(self, ws, message) -> None:
-        data = loads(message)
-        if len(self.orderbook) == 0:
-            self.init_from_snapshot()
-        lastUpdateId = self.orderbook["lastUpdateId"]
-
-        if self.updates == 0:
-            if data["U"] <= lastUpdateId + 1 and data["u"] >= lastUpdateId + 1:
-                self.process_updates(data)
-                self.orderbook["lastUpdateId"] = data["u"]
+        if self.recorder is not None:
+            self.recorder.record(KIND_DEPTH, message)
+        diff = decode_depth_diff(message)
+        self.lag_ms.record(time.time() * 1000 - diff.event_time)
+        with self.book_lock:
+            if self.state == SYNC_STATE_LIVE:
+                if self.apply_in_sequence(diff):
+                    if self.check_pending_validation():
+                        return
+                else:
+                    self.sync_stats["gaps"] += 1
+                    log.warning(f"Depth gap: expected U <= {self.last_update_id + 1}, "
+                                f"got U={diff.first_update_id}, resyncing")
+                    self.start_resync()
+                    self.buffer_diff(diff)
             else:
-                pass
-        elif data["U"] == lastUpdateId + 1:
-            self.process_updates(data)
-            self.orderbook["lastUpdateId"] = data["u"]
+                self.buffer_diff(diff)
+            request_snapshot = not self.snapshot_in_flight
+            self.snapshot_in_flight = True
+        if request_snapshot:
+            self.request_snapshot()
+
+    def buffer_diff(self, diff: DepthDiff) -> None:
+        if len(self.pending_diffs) == self.pending_diffs.maxlen:
+            self.sync_stats["dropped_diffs"] += 1
+        self.pending_diffs.append(diff)
+
+    def apply_in_sequence(self, diff: DepthDiff) -> bool:
+        """Apply diff if it continues the book, False on a gap."""
+        if diff.final_update_id <= self.last_update_id:
+            self.sync_stats["stale_diffs"] += 1
+            return True
+        if self.updates == 0:
+            # first diff after a snapshot: U <= lastUpdateId + 1 <= u
+            in_sequence = diff.first_update_id <= self.last_update_id + 1
         else:
-            pass
-
-    def validate_orderbook(self) -> None:
-        pass
-
-    def process_updates(self, data: Dict) -> None:
-        for update in data["b"]:
-            self.manage_orderbook("bids", update)
-        for update in data["a"]:
-            self.manage_orderbook("asks", update)
-
-        # data['orderbook'] = self.orderbook
-        # print(self.orderbook['bids'])
+            in_sequence = diff.first_update_id == self.last_update_id + 1
+        if not in_sequence:
+            return False
+        self.process_updates(diff)
+        self.last_update_id = diff.final_update_id
+        self.updates += 1
+        return True
+
+    def start_resync(self) -> None:
+        self.state = SYNC_STATE_RESYNCING
+        self.resync_started_at = time.perf_counter()
+        self.pending_diffs.clear()
+        self.pending_validation = None
+
+    def request_snapshot(self) -> None:
+        if self.resync_in_background:
+            threading.Thread(target=self.fetch_snapshot_and_resync, daemon=True).start()
+        else:
+            self.fetch_snapshot_and_resync()
+
+    def resync_backoff_s(self) -> float:
+        """Delay before the next snapshot request, exponential in the failures in a row."""
+        if self.snapshot_failures == 0:
+            return 0.0
+        delay = min(self.config.get("resync_backoff_s", 0.5) * 2 ** (self.snapshot_failures - 1),
+                    self.config.get("resync_max_backoff_s", 30))
+        # jitter, so symbols resyncing together do not retry in lockstep
+        return delay * random.uniform(0.5, 1.0)
+
+    def fetch_snapshot_and_resync(self) -> None:
+        """
+        Request snapshots until one can be loaded, while snapshot_in_flight
+        keeps other requests out. A failed or too old snapshot backs the next
+        request off, a bad spell must not hammer the REST API (Binance bans
+        the IP). Without resync_in_background (replay) a failed request is
+        retried on the next diff instead, without waiting.
+        """
+        synced = False
+        try:
+            while not synced:
+                delay = self.resync_backoff_s()
+                if delay > 0 and self.resync_in_background:
+                    log.warning(f"Snapshot {self.snapshot_failures} in a row failed, "
+                                f"next request in {delay:.1f} s")
+                    time.sleep(delay)
+                try:
+                    if self.orderbook is None:
+                        self.orderbook = make_orderbook(self.config, self.get_tick_size())
+                    synced = self.complete_resync(self.get_snapshot())
+                except Exception:
+                    log.exception("Snapshot request failed")
+                    self.snapshot_failed()
+                    if not self.resync_in_background:
+                        return
+                    continue
+                if not synced:
+                    self.snapshot_failed()
+            self.snapshot_failures = 0
+        finally:
+            if not synced:
+                with self.book_lock:
+                    self.snapshot_in_flight = False
+
+    def snapshot_failed(self) -> None:
+        self.snapshot_failures += 1
+        self.sync_stats["failed_snapshots"] += 1
+
+    def complete_resync(self, snapshot: Dict) -> bool:
+        """
+        Load the snapshot and replay the buffered diffs on top of it,
+        returns False if the snapshot is too old for the buffered diffs.
+        """
+        snapshot = check_depth_snapshot(snapshot)
+        bids, asks = parse_levels(snapshot["bids"]), parse_levels(snapshot["asks"])
+        with self.book_lock:
+            last_update_id = snapshot["lastUpdateId"]
+            while self.pending_diffs and self.pending_diffs[0].final_update_id <= last_update_id:
+                self.pending_diffs.popleft()
+            if self.pending_diffs and self.pending_diffs[0].first_update_id > last_update_id + 1:
+                log.warning(f"Snapshot {last_update_id} is older than the buffered diffs, "
+                            "requesting a new one")
+                return False
+            self.snapshot_in_flight = False
+            self.orderbook.load_snapshot(bids, asks)
+            self.snapshot_id = last_update_id
+            self.last_update_id = last_update_id
+            self.updates = 0
+            # deepest snapshot price per side, None for an empty side
+            self.bounds = [bids[-1, 0] if len(bids) else None,
+                           asks[-1, 0] if len(asks) else None]
+            pending = list(self.pending_diffs)
+            self.pending_diffs.clear()
+            self.state = SYNC_STATE_LIVE
+            for i, diff in enumerate(pending):
+                if not self.apply_in_sequence(diff):
+                    # the buffer overflowed or the stream skipped, start over
+                    self.sync_stats["gaps"] += 1
+                    self.start_resync()
+                    self.pending_diffs.extend(pending[i:])
+                    self.snapshot_in_flight = True
+                    break
+            else:
+                elapsed_ms = (time.perf_counter() - self.resync_started_at) * 1000
+                self.sync_stats["resyncs"] += 1
+                self.sync_stats["last_resync_ms"] = elapsed_ms
+                self.sync_stats["max_resync_ms"] = max(self.sync_stats["max_resync_ms"], elapsed_ms)
+                log.info(f"Book synced at {self.last_update_id} in {elapsed_ms:.0f} ms, "
+                         f"replayed {len(pending)} diffs, {self.sync_stats}")
+        if self.state != SYNC_STATE_LIVE:
+            return False
+        self.publish_orderbook()
+        return True
+
+    def check_pending_validation(self) -> bool:
+        """Validate against a queued snapshot if the book caught up, False starts a resync."""
+        pending = self.pending_validation
+        if pending is None or self.last_update_id < pending[0]:
+            return True
+        self.pending_validation = None
+        if self.validate_orderbook(pending[1], pending[2]):
+            return True
+        self.start_resync()
+        return False
+
+    def validate_orderbook(self, snapshot_bids, snapshot_asks) -> bool:
+        """
+        Cheap comparison of the top validation_levels prices of a recent
+        snapshot with the live book. The book may be a diff ahead of the
+        snapshot, so only a crossed book or repeated large mismatches fail.
+        """
+        self.sync_stats["validations"] += 1
+        n_levels = self.config.get("validation_levels", 10)
+        top_bids, top_asks = self.orderbook.top_k()
+        if len(top_bids) and len(top_asks) and top_bids[0, 0] >= top_asks[0, 0]:
+            log.error(f"Crossed book: bid {top_bids[0, 0]} >= ask {top_asks[0, 0]}")
+            self.sync_stats["failed_validations"] += 1
+            return False
+        overlaps = []
+        for book_side, snapshot_side in ((top_bids, snapshot_bids), (top_asks, snapshot_asks)):
+            snapshot_prices = snapshot_side[:n_levels, 0]
+            if len(snapshot_prices):
+                overlaps.append(np.isin(snapshot_prices, book_side[:n_levels, 0]).mean())
+        threshold = self.config.get("validation_min_overlap", 0.5)
+        if not overlaps or min(overlaps) >= threshold:
+            self.failed_validations = 0
+            return True
+        self.failed_validations += 1
+        self.sync_stats["failed_validations"] += 1
+        log.warning(f"Book differs from snapshot, price overlap {min(overlaps):.2f} "
+                    f"({self.failed_validations} in a row)")
+        return self.failed_validations < self.config.get("validation_failures_to_resync", 3)
+
+    def process_updates(self, diff: DepthDiff) -> None:
+        start = time.perf_counter_ns()
+        changed = self.orderbook.apply_diff(diff.bids, diff.asks)
+
+        top_bids, top_asks = self.orderbook.top_k(self.config["n_depth_pairs"])
         self.update_callback(
             {
-                "E": data["E"],
-                "top_bids": list(self.orderbook["bids"].items())[
-                    : self.config["n_depth_pairs"]
-                ],
-                "top_asks": list(self.orderbook["asks"].items())[
-                    : self.config["n_depth_pairs"]
-                ],
+                "E": diff.event_time,
+                "top_bids": top_bids,
+                "top_asks": top_asks,
+                "changed": changed,
+                # for delta depth storage
+                "update_id": diff.final_update_id,
+                "bids": diff.bids,
+                "asks": diff.asks,
+                "snapshot_id": self.snapshot_id,
+                "book": self.orderbook,
             }
         )
-        if self.should_plot:
-            self.plot_orderbook()
-
-    def manage_orderbook(self, side: str, update: str) -> None:
-        price, qty = float(update[0]), float(update[1])
-        if price in self.orderbook[side]:
-            if float(qty) == 0:
-                del self.orderbook[side][price]
-            else:
-                self.orderbook[side][price] = qty
-        else:
-            if float(qty) != 0:
-                self.orderbook[side][price] = qty
+        self.last_event_time = diff.event_time
+        if changed and self.plot_ring is not None:
+            self.publish_orderbook()
+        self.process_updates_us.record((time.perf_counter_ns() - start) / 1000)
 
     def on_error(self, ws: WebSocketApp, error: Exception) -> None:
         raise error
 
-    def get_snapshot(self) -> Dict[str, str]:
-        r = requests.get(
-            f"https://api.binance.com/api/v3/depth?symbol={self.token.upper()}"
-            + f"&limit={int(self.config['n_depth_pairs']*1.5)}",
+    def get_tick_size(self) -> float:
+        """PRICE_FILTER tickSize of the token, unless set in the config"""
+        if self.config.get("tick_size"):
+            return float(self.config["tick_size"])
+        r = self.session.get(
+            f"{self.config.get('rest_base_url', REST_BASE_URL)}/api/v3/exchangeInfo"
+            + f"?symbol={self.token.upper()}",
+            timeout=3,
+        )
+        if self.recorder is not None:
+            self.recorder.record(KIND_EXCHANGE_INFO, r.content)
+        return tick_size_from_exchange_info(r.content)
+
+    def get_snapshot(self, record=True, limit=None) -> Dict[str, str]:
+        if limit is None:
+            limit = int(self.config['n_depth_pairs'] * 1.5)
+        r = self.session.get(
+            f"{self.config.get('rest_base_url', REST_BASE_URL)}/api/v3/depth"
+            + f"?symbol={self.token.upper()}"
+            + f"&limit={limit}",
             # seconds
             timeout=3,
         )
-        ret_data = loads(r.content.decode())
+        # a 429 / 418 error body is not a snapshot, and must not be recorded as one
+        r.raise_for_status()
+        ret_data = check_depth_snapshot(loads(r.content))
+        if record and self.recorder is not None:
+            self.recorder.record(KIND_SNAPSHOT, r.content)
         return ret_data
 
 
 if __name__ == "__main__":
     # create webscocket client
-    # TODO -> validate the data using the snapshots
     # TODO -> option to save the data, instead of plotting
     client = None
     token = "ethusdt"
@@ -311,3 +431,6 @@ if __name__ == "__main__":
         client.run_forever(lambda x: x, "ethusdt", update_rate)
     except KeyboardInterrupt:
         pass
+    finally:
+        if client is not None:
+            client.close()
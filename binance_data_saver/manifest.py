@@ -0,0 +1,103 @@
+# type: ignore
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List
+
+import pyarrow.parquet as pq
+
+from binance_data_saver.row_buffer import TIME_COLUMN
+
+log = logging.getLogger(__file__)
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class Manifest:
+    """
+    Append only JSON lines index of the complete parquet files under a save
+    directory: path, kind, symbol, rows, row groups, bytes and the min / max
+    event time of each file. Local paths are stored relative to the
+    manifest so the directory can be moved, remote ones as full URIs.
+    Each entry is one O_APPEND write, so shard processes may share it.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = str(directory)
+        self.path = os.path.join(self.directory, MANIFEST_NAME)
+        self.lock = threading.Lock()
+
+    def add(self, path: str, info: Dict) -> None:
+        path = str(path)
+        if "://" not in path:
+            path = os.path.relpath(os.path.abspath(path), self.directory)
+        line = json.dumps(dict(info, path=path)) + "\n"
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+
+    def entries(self) -> Iterator[Dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a writer died mid line
+                    log.warning(f"Skipping a broken line of {self.path}")
+                    continue
+                if "://" not in entry["path"]:
+                    entry["path"] = os.path.join(self.directory, entry["path"])
+                yield entry
+
+    def select(self, symbol: str = None, kind: str = None, start_time: int = None,
+               end_time: int = None) -> List[Dict]:
+        """
+        Entries whose [min_time, max_time] overlaps [start_time, end_time],
+        by min_time. A missing bound (empty file, no statistics) is unbounded.
+        """
+        selected = []
+        for entry in self.entries():
+            if symbol is not None and entry["symbol"] != symbol.upper():
+                continue
+            if kind is not None and entry["kind"] != kind:
+                continue
+            if start_time is not None and entry["max_time"] is not None \
+                    and entry["max_time"] < start_time:
+                continue
+            if end_time is not None and entry["min_time"] is not None \
+                    and entry["min_time"] > end_time:
+                continue
+            selected.append(entry)
+        return sorted(selected, key=lambda entry: (entry["min_time"] is not None,
+                                                   entry["min_time"] or 0))
+
+
+def file_info(path: str, kind: str, symbol: str, filesystem=None) -> Dict:
+    """Manifest entry of an existing file, from its footer statistics only."""
+    parquet_file = pq.ParquetFile(path, filesystem=filesystem) if filesystem is not None \
+        else pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    time_idx = metadata.schema.to_arrow_schema().get_field_index(TIME_COLUMN)
+    mins, maxs = [], []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(time_idx).statistics
+        if stats is not None and stats.has_min_max:
+            mins.append(int(stats.min))
+            maxs.append(int(stats.max))
+    return {
+        "kind": kind,
+        "symbol": symbol.upper(),
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "bytes": os.path.getsize(path) if filesystem is None else filesystem.size(path),
+        "min_time": min(mins, default=None),
+        "max_time": max(maxs, default=None),
+    }
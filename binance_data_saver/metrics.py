@@ -0,0 +1,303 @@
+# type: ignore
+# low overhead instrumentation: log-linear histograms owned by the components,
+# exported in Prometheus text format and as a periodic log line
+import functools
+import logging
+from math import frexp
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+log = logging.getLogger(__file__)
+
+# sub-buckets per power of two, quantiles within 1 / 16 of the true value
+SUB_BUCKETS = 16
+MAX_EXPONENT = 40
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+LAST_BUCKET = MAX_EXPONENT * SUB_BUCKETS
+
+
+class LogHistogram:
+    """
+    HDR style histogram: every power of two range is split into SUB_BUCKETS
+    linear buckets, so recording is a frexp and a list increment and the
+    relative error of any quantile stays below 1 / SUB_BUCKETS. Values
+    below 1 share the first bucket, negative values are counted as 0.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (LAST_BUCKET + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _index(value: float) -> int:
+        if value < 1:
+            return 0
+        mantissa, exponent = frexp(value)
+        idx = (exponent - 1) * SUB_BUCKETS + int(mantissa * 2 * SUB_BUCKETS) - SUB_BUCKETS + 1
+        return idx if idx < LAST_BUCKET else LAST_BUCKET
+
+    @staticmethod
+    def _upper_bound(idx: int) -> float:
+        if idx == 0:
+            return 1.0
+        exponent, sub = divmod(idx - 1, SUB_BUCKETS)
+        return 2.0 ** exponent * (1 + (sub + 1) / SUB_BUCKETS)
+
+    def record(self, value: float) -> None:
+        if value < 0:
+            value = 0.0
+        idx = self._index(value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def quantiles(self, qs=QUANTILES) -> Dict[float, float]:
+        with self.lock:
+            counts, count, max_value = list(self.counts), self.count, self.max
+        result = {}
+        if count == 0:
+            return {q: 0.0 for q in qs}
+        cumulative, idx = 0, 0
+        for q in sorted(qs):
+            rank = q * count
+            while cumulative + counts[idx] < rank:
+                cumulative += counts[idx]
+                idx += 1
+            result[q] = min(self._upper_bound(idx), max_value)
+        return result
+
+
+def timed(name: str) -> Callable:
+    """Record the run time of a callback method in self.callback_us[name], in microseconds."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, data):
+            start = time.perf_counter_ns()
+            try:
+                return fn(self, data)
+            finally:
+                self.callback_us[name].record((time.perf_counter_ns() - start) / 1000)
+        return wrapper
+    return decorator
+
+
+class MetricsRegistry:
+    """
+    Names and labels of metrics that live in the components. Histograms are
+    rendered as Prometheus summaries, gauges and counters are read through
+    callables at render time, so nothing is copied on the hot paths.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help, [(labels, histogram or callable)])
+        self.metrics: Dict[str, Tuple[str, str, List]] = {}
+
+    def _add(self, kind: str, name: str, help_text: str, source, labels: Dict) -> None:
+        with self.lock:
+            entry = self.metrics.setdefault(name, (kind, help_text, []))
+            entry[2].append((labels, source))
+
+    def add_histogram(self, name: str, help_text: str, histogram: LogHistogram,
+                      **labels) -> None:
+        self._add("summary", name, help_text, histogram, labels)
+
+    def add_gauge(self, name: str, help_text: str, fn: Callable, **labels) -> None:
+        self._add("gauge", name, help_text, fn, labels)
+
+    def add_counter(self, name: str, help_text: str, fn: Callable, **labels) -> None:
+        self._add("counter", name, help_text, fn, labels)
+
+    @staticmethod
+    def _labels(labels: Dict, **extra) -> str:
+        labels = dict(labels, **extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        with self.lock:
+            metrics = [(name, kind, help_text, list(series))
+                       for name, (kind, help_text, series) in self.metrics.items()]
+        lines = []
+        for name, kind, help_text, series in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, source in series:
+                if kind != "summary":
+                    lines.append(f"{name}{self._labels(labels)} {float(source())}")
+                    continue
+                for q, value in source.quantiles().items():
+                    lines.append(f"{name}{self._labels(labels, quantile=q)} {value}")
+                lines.append(f"{name}_sum{self._labels(labels)} {source.total}")
+                lines.append(f"{name}_count{self._labels(labels)} {source.count}")
+        return "\n".join(lines) + "\n"
+
+    def log_line(self) -> str:
+        """p50 / p99 / max of every histogram and the value of every gauge and counter."""
+        with self.lock:
+            metrics = [(name, kind, list(series))
+                       for name, (kind, _, series) in self.metrics.items()]
+        parts = []
+        for name, kind, series in metrics:
+            for labels, source in series:
+                label = ",".join(str(value) for value in labels.values())
+                if kind != "summary":
+                    parts.append(f"{name}[{label}]={float(source()):g}")
+                    continue
+                if source.count == 0:
+                    continue
+                q = source.quantiles((0.5, 0.99))
+                parts.append(f"{name}[{label}] p50={q[0.5]:.3g} p99={q[0.99]:.3g} "
+                             f"max={source.max:.3g} n={source.count}")
+        return " | ".join(parts)
+
+    def log_periodically(self, interval_s: float) -> threading.Thread:
+        def run():
+            while True:
+                time.sleep(interval_s)
+                log.info(f"metrics {self.log_line()}")
+        thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+# one registry per process
+REGISTRY = MetricsRegistry()
+
+
+def register_collector(symbol: str, data_handler, depth_cache_manager,
+                       registry: MetricsRegistry = REGISTRY) -> None:
+    """Export the instruments of one symbol's saver and depth cache manager."""
+    symbol = symbol.upper()
+    for stream, histogram in data_handler.lag_ms.items():
+        registry.add_histogram("binance_receive_lag_ms", "local receive time minus event time E",
+                               histogram, symbol=symbol, stream=stream)
+    registry.add_histogram("binance_receive_lag_ms", "local receive time minus event time E",
+                           depth_cache_manager.lag_ms, symbol=symbol, stream="depth")
+    for callback, histogram in data_handler.callback_us.items():
+        registry.add_histogram("binance_callback_us", "callback execution time",
+                               histogram, symbol=symbol, callback=callback)
+    registry.add_histogram("binance_callback_us", "callback execution time",
+                           depth_cache_manager.process_updates_us,
+                           symbol=symbol, callback="process_updates")
+    registry.add_gauge("binance_row_buffer_fill_ratio", "rows buffered / rows per flush",
+                       lambda: len(data_handler.time_to_row_data) / (data_handler.save_every + 1),
+                       symbol=symbol)
+    if data_handler.trade_tape is not None:
+        registry.add_gauge("binance_trade_tape_trades", "aggTrades buffered in the trade tape",
+                           lambda: len(data_handler.trade_tape), symbol=symbol)
+    if data_handler.depth_conflator is not None:
+        conflator = data_handler.depth_conflator
+        registry.add_histogram("binance_depth_updates_per_row",
+                               "book updates conflated into each depth row",
+                               conflator.updates_per_row, symbol=symbol)
+        registry.add_counter("binance_depth_rows_emitted_total", "depth rows after conflation",
+                             lambda: conflator.n_emitted, symbol=symbol)
+    writer = data_handler.writer
+    registry.add_gauge("binance_writer_queue_depth", "sealed batches waiting for a writer",
+                       writer.queue.qsize, symbol=symbol)
+    registry.add_histogram("binance_flush_build_ms", "arrow table build time per batch",
+                           writer.build_ms, symbol=symbol)
+    registry.add_histogram("binance_flush_write_ms", "compression and write time per batch",
+                           writer.write_ms, symbol=symbol)
+    registry.add_counter("binance_bytes_written_total", "parquet bytes written",
+                         lambda: data_handler.bytes_written, symbol=symbol)
+    registry.add_counter("binance_flush_failures_total", "batches that failed to write",
+                         lambda: writer.n_failures, symbol=symbol)
+    registry.add_gauge("binance_buffered_bytes", "bytes of the row buffer being filled",
+                       lambda: data_handler.time_to_row_data.nbytes, symbol=symbol)
+    registry.add_gauge("binance_writer_queued_bytes", "in memory bytes waiting for a writer",
+                       lambda: writer.queued_bytes, symbol=symbol)
+    registry.add_counter("binance_spilled_batches_total", "batches spilled to disk over budget",
+                         lambda: writer.n_spilled, symbol=symbol)
+    registry.add_counter("binance_spilled_bytes_total", "bytes spilled to disk over budget",
+                         lambda: writer.spilled_bytes, symbol=symbol)
+    registry.add_counter("binance_drained_bytes_total", "batch bytes written out by the writer",
+                         lambda: writer.drained_bytes, symbol=symbol)
+    if data_handler.aligner is not None:
+        aligner = data_handler.aligner
+        registry.add_gauge("binance_aligner_pending_events", "events waiting for the watermark",
+                           lambda: aligner.n_pending, symbol=symbol)
+        registry.add_gauge("binance_aligner_watermark_delay_ms",
+                           "local time minus the event time watermark",
+                           lambda: time.time() * 1000 - aligner.watermark
+                           if aligner.watermark is not None else 0, symbol=symbol)
+        registry.add_counter("binance_aligner_late_events_total",
+                             "events that arrived below an emitted watermark",
+                             lambda: aligner.n_late, symbol=symbol)
+    if data_handler.wal is not None:
+        registry.add_histogram("binance_wal_fsync_ms", "write-ahead log fsync time",
+                               data_handler.wal.fsync_ms, symbol=symbol)
+        registry.add_counter("binance_wal_bytes_total", "bytes appended to the write-ahead log",
+                             lambda: data_handler.wal.n_bytes, symbol=symbol)
+    if data_handler.uploader is not None:
+        uploader = data_handler.uploader
+        registry.add_gauge("binance_upload_backlog_files", "staged files waiting for an upload",
+                           lambda: uploader.backlog_files, symbol=symbol)
+        registry.add_gauge("binance_upload_backlog_bytes", "bytes of the staged files",
+                           lambda: uploader.backlog_bytes, symbol=symbol)
+        registry.add_counter("binance_uploaded_bytes_total", "bytes uploaded and verified",
+                             lambda: uploader.uploaded_bytes, symbol=symbol)
+        registry.add_histogram("binance_upload_ms", "multipart upload time per file",
+                               uploader.upload_ms, symbol=symbol)
+        registry.add_counter("binance_upload_retries_total", "failed upload attempts retried",
+                             lambda: uploader.n_retries, symbol=symbol)
+        registry.add_counter("binance_upload_failures_total",
+                             "files left staged after their last attempt",
+                             lambda: uploader.n_failures, symbol=symbol)
+    for stat in ("gaps", "stale_diffs", "dropped_diffs", "resyncs", "failed_validations",
+                 "failed_snapshots"):
+        # sync_stats only exists once the stream is initialized
+        registry.add_counter(f"binance_depth_{stat}_total", f"depth {stat.replace('_', ' ')}",
+                             lambda stat=stat: getattr(depth_cache_manager, "sync_stats", {})
+                             .get(stat, 0), symbol=symbol)
+    for stat in ("last_resync_ms", "max_resync_ms"):
+        registry.add_gauge(f"binance_depth_{stat}", f"depth {stat[:-3].replace('_', ' ')} time",
+                           lambda stat=stat: getattr(depth_cache_manager, "sync_stats", {})
+                           .get(stat, 0.0), symbol=symbol)
+
+
+def start_metrics(config: Dict, registry: MetricsRegistry = REGISTRY,
+                  port_offset: int = 0) -> None:
+    """Metrics endpoint on metrics_port (+ port_offset) and the periodic log line."""
+    if config.get("metrics_port"):
+        port = config["metrics_port"] + port_offset
+        try:
+            registry.serve(port, config.get("metrics_host", "127.0.0.1"))
+        except OSError:
+            log.exception(f"Could not serve metrics on port {port}")
+    if config.get("metrics_log_interval_s", 60) > 0:
+        registry.log_periodically(config.get("metrics_log_interval_s", 60))
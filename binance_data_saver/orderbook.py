@@ -0,0 +1,284 @@
+# type: ignore
+import abc
+import logging
+from decimal import Decimal
+from typing import Dict, Tuple
+
+import numpy as np
+from sortedcontainers import SortedDict
+
+log = logging.getLogger(__file__)
+
+# levels scanned per step when searching the ladder for the next live level
+SCAN_CHUNK = 256
+
+
+def tick_decimals(tick_size: float) -> int:
+    exponent = Decimal(str(tick_size)).normalize().as_tuple().exponent
+    return max(-exponent, 0)
+
+
+class OrderBook(abc.ABC):
+    """
+    Common part of the book engines: keeps a cached top-k view per side that
+    is only recomputed when a diff touches a price at or better than the
+    current k-th level. Cached arrays are replaced, never modified in place,
+    so consumers may hold on to them.
+    """
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.k = config.get("n_depth_pairs", 50)
+        self.tops = [None, None]
+        self.top_changed = True
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _apply(self, bids: np.ndarray, asks: np.ndarray) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _compute_top(self, side: int, k: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def _is_behind(self, side: int, prices: np.ndarray, kth_price: float) -> np.ndarray:
+        return prices < kth_price if side == 0 else prices > kth_price
+
+    def load_snapshot(self, bids: np.ndarray, asks: np.ndarray) -> None:
+        self.clear()
+        self._apply(bids, asks)
+        self.tops = [self._compute_top(0, self.k), self._compute_top(1, self.k)]
+        self.top_changed = True
+
+    def apply_diff(self, bids: np.ndarray, asks: np.ndarray) -> bool:
+        """Apply a diff, returns whether the top-k view changed."""
+        self._apply(bids, asks)
+        bids_changed = self._refresh_top(0, bids[:, 0])
+        asks_changed = self._refresh_top(1, asks[:, 0])
+        self.top_changed = bids_changed or asks_changed
+        return self.top_changed
+
+    def _refresh_top(self, side: int, prices: np.ndarray) -> bool:
+        top = self.tops[side]
+        if top is not None:
+            if prices.size == 0:
+                return False
+            if len(top) == self.k and self._is_behind(side, prices, top[-1, 0]).all():
+                return False
+        new_top = self._compute_top(side, self.k)
+        if top is not None and np.array_equal(new_top, top):
+            return False
+        self.tops[side] = new_top
+        return True
+
+    def top_k(self, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k levels per side as (n, 2) arrays of (price, qty)."""
+        if k is not None and k != self.k:
+            self.k = k
+            self.tops = [None, None]
+        if self.tops[0] is None or self.tops[1] is None:
+            self.tops = [self._compute_top(0, self.k), self._compute_top(1, self.k)]
+        return self.tops[0], self.tops[1]
+
+    def levels(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best n levels per side, bypassing the cached top-k view."""
+        return self._compute_top(0, n), self._compute_top(1, n)
+
+
+class SortedDictOrderBook(OrderBook):
+    """
+    Float keyed book on top of SortedDict, the original implementation.
+    """
+
+    def __init__(self, config: Dict, tick_size: float = None):
+        super().__init__(config)
+        self.clear()
+
+    def clear(self) -> None:
+        self.bids = SortedDict(lambda x: -x)
+        self.asks = SortedDict()
+
+    def _apply(self, bids: np.ndarray, asks: np.ndarray) -> None:
+        for side, levels in ((self.bids, bids), (self.asks, asks)):
+            for price, qty in levels.tolist():
+                if qty == 0:
+                    side.pop(price, None)
+                else:
+                    side[price] = qty
+
+    def _compute_top(self, side: int, k: int) -> np.ndarray:
+        # slicing the items view only touches the first k entries
+        book = self.bids if side == 0 else self.asks
+        return np.array(book.items()[:k], dtype=np.float64).reshape(-1, 2)
+
+
+class _TickLadder:
+    """
+    Quantities of one book side indexed by integer tick, qty[i] belongs to
+    tick base + i and 0 means no level. The ladder re-anchors when prices
+    leave it and never grows past max_ticks, levels further than that from
+    the best price are dropped.
+    """
+
+    def __init__(self, is_bid: bool, max_ticks: int):
+        self.is_bid = is_bid
+        self.max_ticks = max_ticks
+        self.n_dropped_levels = 0
+        self.clear()
+
+    def clear(self) -> None:
+        self.qty = np.zeros(0, dtype=np.float64)
+        self.base = 0
+        self.best = -1
+
+    def _reserve(self, lo: int, hi: int) -> None:
+        live = np.flatnonzero(self.qty)
+        if live.size:
+            lo = min(lo, self.base + live[0])
+            hi = max(hi, self.base + live[-1])
+        margin = max((hi - lo) // 4, 1024)
+        new_lo, new_hi = lo - margin, hi + margin
+        if new_hi - new_lo + 1 > self.max_ticks:
+            anchor = self.base + self.best if self.best >= 0 else (hi if self.is_bid else lo)
+            new_lo = anchor - self.max_ticks // 2
+            new_hi = new_lo + self.max_ticks - 1
+        new_qty = np.zeros(new_hi - new_lo + 1, dtype=np.float64)
+        if live.size:
+            ticks = self.base + live
+            keep = (ticks >= new_lo) & (ticks <= new_hi)
+            self.n_dropped_levels += int(live.size - keep.sum())
+            new_qty[ticks[keep] - new_lo] = self.qty[live[keep]]
+        if self.best >= 0:
+            best_tick = self.base + self.best
+            self.best = best_tick - new_lo if new_lo <= best_tick <= new_hi else -1
+        self.qty = new_qty
+        self.base = new_lo
+        if self.best < 0 and live.size:
+            self.best = self._scan(self.qty.size - 1 if self.is_bid else 0)
+
+    def update(self, ticks: np.ndarray, qtys: np.ndarray) -> None:
+        if ticks.size == 0:
+            return
+        lo, hi = int(ticks.min()), int(ticks.max())
+        if lo < self.base or hi >= self.base + self.qty.size:
+            self._reserve(lo, hi)
+            inside = (ticks >= self.base) & (ticks < self.base + self.qty.size)
+            if not inside.all():
+                self.n_dropped_levels += int((~inside & (qtys > 0)).sum())
+                ticks, qtys = ticks[inside], qtys[inside]
+        idx = ticks - self.base
+        self.qty[idx] = qtys
+        live = idx[qtys > 0]
+        if live.size:
+            cand = live.max() if self.is_bid else live.min()
+            if self.best < 0 or (cand > self.best if self.is_bid else cand < self.best):
+                self.best = int(cand)
+        if self.best >= 0 and self.qty[self.best] == 0:
+            self.best = self._scan(self.best)
+
+    def _scan(self, start: int) -> int:
+        """Index of the first live level at or behind start, -1 if none."""
+        qty = self.qty
+        if self.is_bid:
+            i = start
+            while i >= 0:
+                lo = max(i - SCAN_CHUNK + 1, 0)
+                nz = np.flatnonzero(qty[lo:i + 1])
+                if nz.size:
+                    return lo + int(nz[-1])
+                i = lo - 1
+        else:
+            i = start
+            while i < qty.size:
+                hi = min(i + SCAN_CHUNK, qty.size)
+                nz = np.flatnonzero(qty[i:hi])
+                if nz.size:
+                    return i + int(nz[0])
+                i = hi
+        return -1
+
+    def top(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(ticks, qtys) of the best k levels, best first."""
+        if self.best < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        qty = self.qty
+        found = []
+        n_found = 0
+        i = self.best
+        while n_found < k and 0 <= i < qty.size:
+            if self.is_bid:
+                lo = max(i - SCAN_CHUNK + 1, 0)
+                nz = lo + np.flatnonzero(qty[lo:i + 1])[::-1]
+                i = lo - 1
+            else:
+                hi = min(i + SCAN_CHUNK, qty.size)
+                nz = i + np.flatnonzero(qty[i:hi])
+                i = hi
+            found.append(nz)
+            n_found += nz.size
+        idx = np.concatenate(found)[:k]
+        return idx + self.base, qty[idx]
+
+
+class TickLadderOrderBook(OrderBook):
+    """
+    Book that stores prices as integer ticks of the symbol's tick size in
+    one NumPy quantity ladder per side, so a whole diff message is applied
+    as a single vectorized assignment.
+    """
+
+    def __init__(self, config: Dict, tick_size: float):
+        assert tick_size and tick_size > 0, "TickLadderOrderBook needs a tick size"
+        super().__init__(config)
+        self.tick_size = float(tick_size)
+        self.decimals = tick_decimals(tick_size)
+        max_ticks = int(config.get("max_ladder_ticks", 200_000))
+        self.bids = _TickLadder(is_bid=True, max_ticks=max_ticks)
+        self.asks = _TickLadder(is_bid=False, max_ticks=max_ticks)
+
+    def clear(self) -> None:
+        self.bids.clear()
+        self.asks.clear()
+
+    def to_ticks(self, prices: np.ndarray) -> np.ndarray:
+        return np.rint(prices / self.tick_size).astype(np.int64)
+
+    def to_prices(self, ticks: np.ndarray) -> np.ndarray:
+        return np.round(ticks * self.tick_size, self.decimals)
+
+    def _apply(self, bids: np.ndarray, asks: np.ndarray) -> None:
+        self.bids.update(self.to_ticks(bids[:, 0]), bids[:, 1])
+        self.asks.update(self.to_ticks(asks[:, 0]), asks[:, 1])
+
+    def _is_behind(self, side: int, prices: np.ndarray, kth_price: float) -> np.ndarray:
+        # compare in ticks, float prices may differ in the last bit
+        ticks = self.to_ticks(prices)
+        kth_tick = int(self.to_ticks(np.float64(kth_price)))
+        return ticks < kth_tick if side == 0 else ticks > kth_tick
+
+    @property
+    def n_dropped_levels(self) -> int:
+        return self.bids.n_dropped_levels + self.asks.n_dropped_levels
+
+    def _compute_top(self, side: int, k: int) -> np.ndarray:
+        ticks, qtys = (self.bids if side == 0 else self.asks).top(k)
+        top = np.empty((ticks.size, 2), dtype=np.float64)
+        top[:, 0] = self.to_prices(ticks)
+        top[:, 1] = qtys
+        return top
+
+
+ORDERBOOK_ENGINES = {
+    "sorted_dict": SortedDictOrderBook,
+    "tick_ladder": TickLadderOrderBook,
+}
+
+
+def make_orderbook(config: Dict, tick_size: float = None):
+    engine = config.get("orderbook_engine", "sorted_dict")
+    assert engine in ORDERBOOK_ENGINES, \
+        f"invalid orderbook_engine {engine}, must be one of {list(ORDERBOOK_ENGINES)}"
+    return ORDERBOOK_ENGINES[engine](config, tick_size)
@@ -1,17 +1,47 @@
 # type: ignore
 import logging
 import os
+import re
 import threading
+import time
 from pathlib import Path
 from typing import List
 
-import numpy as np
-import pyarrow as pa
 import pyarrow.parquet as pq
+import requests
 import s3fs
-from pydantic import BaseModel, ConfigDict, Field, confloat, conint, model_validator
-from sortedcontainers import SortedDict
-from binance_data_saver.data_objects import DepthEntry, StandardRow
+from binance_data_saver.aligner import EventTimeAligner
+from binance_data_saver.background_writer import BackgroundWriter
+from binance_data_saver.conflation import CONFLATE_EVERY_CHANGE, DepthConflator
+from binance_data_saver.dataset_writer import RollingDatasetWriter
+from binance_data_saver.decoding import (
+    REST_BASE_URL,
+    AggTrade,
+    Kline,
+    decode_agg_trade,
+    decode_kline,
+    step_size_from_exchange_info,
+    tick_size_from_exchange_info,
+)
+from binance_data_saver.depth_delta import KIND_CHANGES, KIND_CHECKPOINTS, DepthDeltaBuffer
+from binance_data_saver.features import KIND_BARS, FeatureStage
+from binance_data_saver.manifest import Manifest, file_info
+from binance_data_saver.metrics import LogHistogram, timed
+from binance_data_saver.reader import discover_files
+from binance_data_saver.row_buffer import ColumnarRowBuffer
+from binance_data_saver.schema import CompactSchema
+from binance_data_saver.trade_tape import KIND_TRADES, TradeTapeBuffer
+from binance_data_saver.uploader import S3Uploader
+from binance_data_saver.wal import (
+    LEVELS_CHECKPOINTS,
+    OP_AGG_TRADE,
+    OP_DEPTH,
+    OP_LEVELS,
+    OP_OHLC,
+    OP_TRADE,
+    WriteAheadLog,
+    read_wal,
+)
 
 
 # from binance_data_saver.utils.misc_utils import get_time_delta
@@ -24,133 +54,454 @@ def get_row_labels():
 
 class ParquetSaver:
 
-    def __init__(self, config):
+    def __init__(self, config, symbol=None):
         # current file root:
         self.root_dir = Path(os.path.dirname(os.path.realpath(__file__)))
         self.abs_save_dir = self.root_dir / Path(config['save_dir'])
-        if not os.path.exists(self.abs_save_dir):
-            os.makedirs(self.abs_save_dir)
+        self.symbol = (symbol or config['token']).upper()
+        # multi-symbol collectors keep the files of every symbol apart
+        self.files_subdir = f"symbol={self.symbol}" if symbol is not None else ""
+        self.files_dir = self.abs_save_dir / self.files_subdir
+        if not os.path.exists(self.files_dir):
+            os.makedirs(self.files_dir)
         
-        if config['s3_bucket'] != '':
-            self.s3_fs = s3fs.S3FileSystem()
-
         self.lock = threading.Lock()
         self.config = config
-        self.time_to_row_data = SortedDict()
+        # index of the written files for binance_data_saver.reader
+        self.manifest = Manifest(self.abs_save_dir)
+        # with an S3 bucket, save_dir only stages files until they are uploaded
+        self.uploader = None
+        if config['s3_bucket'] != '':
+            self.s3_fs = s3fs.S3FileSystem(endpoint_url=config.get('s3_endpoint_url') or None)
+        # exported by binance_data_saver.metrics
+        self.lag_ms = {"kline": LogHistogram(), "aggTrade": LogHistogram()}
+        self.callback_us = {name: LogHistogram() for name in ("ohlc_cb", "agg_trades_cb", "depth_cb")}
+        self.bytes_written = 0
         self.save_every = config['n_events_per_write']
-        self.iteration = 0
-        self.colnames = None
+        self.skip_unchanged_depth = config.get('skip_unchanged_depth', False)
+        # full: top n_depth_pairs in every row, delta: checkpoints + level changes
+        self.depth_delta = None
+        if config.get('depth_storage', 'full') == 'delta':
+            self.depth_delta = DepthDeltaBuffer(
+                config.get('depth_checkpoint_levels', 0) or 2 * config['n_depth_pairs'],
+                config.get('depth_checkpoint_interval_s', 60) * 1000,
+            )
+            self.depth_changes_per_write = config.get('depth_changes_per_write', 500000)
+        # prices / quantities as scaled ints, applied on the writer threads
+        self.compact_schema = self.new_compact_schema() \
+            if config.get('output_schema', 'legacy') == 'compact' else None
+        self.time_to_row_data = self.new_row_buffer()
+        # every aggTrade as received, the trade columns of the rows are derived from it
+        self.trade_tape = self.new_trade_tape() if config.get('trade_tape', False) else None
+        self.iteration = self.get_last_iteration()
+        if config['s3_bucket'] != '':
+            self.uploader = self.new_uploader()
+        self.colnames = self.time_to_row_data.colnames
+        self.dataset_writer = None
+        if config.get('output_layout', 'files') == 'dataset':
+            self.dataset_writer = self.new_dataset_writer()
+        self.writer = BackgroundWriter(
+            self.write_table,
+            n_workers=config.get('n_flush_workers', 1),
+            max_queue_size=config.get('flush_queue_size', 4),
+            memory_budget_bytes=self.get_queue_budget(),
+            spill_dir=str(self.root_dir / config.get('spill_dir', 'spill') / self.symbol),
+            on_done=self.on_batch_done,
+            # with a WAL, spilled batches are rebuilt from it after a crash
+            requeue_spilled=not config.get('wal_enabled', False),
+        )
+        # WAL generation -> batches of it not yet durable
+        self.wal_refs = {}
+        # WAL generation -> dataset files that must close before it can go
+        self.wal_awaiting_close = {}
+        # per row features and bars, computed when a buffer is sealed
+        self.features = FeatureStage(config) if config.get('features', False) else None
+        # taken before the buffer lock is released, so buffers reach the stage in seal order
+        self.features_lock = threading.Lock()
+        self.wal = None
+        if config.get('wal_enabled', False):
+            self.wal = WriteAheadLog(
+                str(self.root_dir / config.get('wal_dir', 'wal') / self.symbol),
+                config.get('wal_fsync_interval_ms', 200),
+            )
+            if self.depth_delta is not None:
+                self.depth_delta.wal = self.wal
+            self.replay_wal()
+        # latest (top_bids, top_asks) applied, joined to trade rows with asof_depth
+        self.asof_depth = config.get('asof_depth', False) and self.depth_delta is None
+        self.last_depth = None
+        # top-K updates of the book -> depth rows, every update or thinned in time
+        self.depth_conflator = None
+        conflation = config.get('depth_conflation', CONFLATE_EVERY_CHANGE)
+        if self.depth_delta is None:
+            self.depth_conflator = DepthConflator(
+                conflation, config.get('depth_conflation_ms', 100), self.emit_depth)
+        elif conflation != CONFLATE_EVERY_CHANGE:
+            log.warning("depth_conflation is ignored with delta depth storage, "
+                        "it needs every level change")
+        self.aligner = None
+        if config.get('align_streams', False):
+            # delta depth reads the live book, so it cannot be deferred
+            streams = ["kline", "aggTrade"] + (["depth"] if self.depth_delta is None else [])
+            self.aligner = EventTimeAligner(
+                streams,
+                self.apply_events,
+                lateness_ms=config.get('align_lateness_ms', 500),
+                interval_ms=config.get('align_interval_ms', 50),
+                idle_ms=config.get('align_idle_ms', 5000),
+                name=f"aligner-{self.symbol}",
+            )
+
+    def new_compact_schema(self) -> CompactSchema:
+        tick_size, step_size = self.config.get('tick_size'), self.config.get('step_size')
+        if not tick_size or not step_size:
+            r = requests.get(
+                f"{self.config.get('rest_base_url', REST_BASE_URL)}/api/v3/exchangeInfo"
+                + f"?symbol={self.symbol}",
+                timeout=3,
+            )
+            r.raise_for_status()
+            tick_size = tick_size or tick_size_from_exchange_info(r.content)
+            step_size = step_size or step_size_from_exchange_info(r.content)
+        log.info(f"Compact output schema for {self.symbol}: tick size {tick_size}, "
+                 f"step size {step_size}")
+        return CompactSchema(tick_size, step_size, self.config.get('quantity_encoding', 'scaled'))
+
+    def new_uploader(self) -> S3Uploader:
+        uploader = S3Uploader(
+            self.abs_save_dir,
+            self.config['s3_bucket'],
+            self.s3_fs,
+            n_workers=self.config.get('upload_workers', 4),
+            part_size=self.config.get('s3_part_size_mb', 16) * 1024 * 1024,
+            part_concurrency=self.config.get('s3_part_concurrency', 4),
+            max_attempts=self.config.get('upload_max_attempts', 0),
+            max_backoff_s=self.config.get('upload_max_backoff_s', 60),
+            verify_etag=self.config.get('s3_verify_etag', True),
+            on_uploaded=self.on_file_uploaded,
+            name=f"s3-uploader-{self.symbol}",
+        )
+        # files a previous run closed but did not upload
+        n_staged = 0
+        for path, kind, symbol in discover_files(self.abs_save_dir, self.symbol):
+            if symbol != self.symbol:
+                continue
+            try:
+                info = file_info(path, kind, symbol)
+            except Exception:
+                # a dataset file the previous run never closed
+                log.warning(f"Not uploading {path}, it has no parquet footer")
+                continue
+            uploader.submit(path, info)
+            n_staged += 1
+        if n_staged:
+            log.warning(f"Uploading {n_staged} files staged by a previous run")
+        return uploader
+
+    def get_queue_budget(self):
+        """Share of memory_budget_bytes left for sealed batches waiting for the writer."""
+        budget = self.config.get('memory_budget_bytes', 0)
+        if not budget:
+            return None
+        # the buffer being filled and the one just sealed are always in memory
+        active_bytes = 2 * self.time_to_row_data.nbytes
+        if self.trade_tape is not None:
+            active_bytes += 2 * self.trade_tape.nbytes
+        if active_bytes >= budget:
+            log.warning(f"memory_budget_bytes {budget} is below the {active_bytes} bytes of "
+                        "two row buffers, lower n_events_per_write; every batch will spill")
+        return max(budget - active_bytes, 1)
+
+    def get_last_iteration(self) -> int:
+        # continue numbering after existing local files instead of overwriting them
+        names = os.listdir(self.files_dir)
+        if self.config['s3_bucket'] != '':
+            # uploaded files are gone from the staging directory
+            names += [os.path.basename(entry["path"]) for entry in self.manifest.entries()
+                      if entry["symbol"] == self.symbol and "://" in entry["path"]]
+        iterations = [int(m.group(1)) for m in
+                      (re.fullmatch(r"[a-z_]+_(\d+)\.parquet", f) for f in names)
+                      if m is not None]
+        return max(iterations, default=0)
+
+    def new_dataset_writer(self) -> RollingDatasetWriter:
+        if not self.config.get('wal_enabled', False):
+            log.warning("The dataset layout keeps files open for up to roll_max_seconds "
+                        f"({self.config.get('roll_max_seconds', 3600)} s) and a crash loses "
+                        "their rows, enable wal_enabled to keep them")
+        return RollingDatasetWriter(
+            self.abs_save_dir,
+            self.symbol,
+            self.config['compression_type'],
+            roll_max_bytes=self.config.get('roll_max_bytes', 256 * 1024 * 1024),
+            roll_max_seconds=self.config.get('roll_max_seconds', 3600),
+            on_file_closed=self.on_file_closed,
+        )
+
+    def on_file_closed(self, path, info):
+        released = []
+        with self.lock:
+            for wal_path, open_paths in list(self.wal_awaiting_close.items()):
+                open_paths.discard(path)
+                if not open_paths:
+                    del self.wal_awaiting_close[wal_path]
+                    released.append(wal_path)
+        for wal_path in released:
+            self.release_wal(wal_path)
+        if self.uploader is not None:
+            # indexed once it is in the bucket
+            self.uploader.submit(path, info)
+            return
+        self.manifest.add(path, info)
+
+    def on_file_uploaded(self, path, remote_path, info):
+        self.manifest.add(f"s3://{remote_path}", info)
+
+    def replay_wal(self):
+        """Rebuild the buffers a previous process lost from its WAL generations and write them."""
+        current = self.wal.path(self.wal.generation)
+        for path in self.wal.pending_files():
+            if path == current:
+                continue
+            row_buffer = self.new_row_buffer()
+            trade_tape = self.new_trade_tape() if self.trade_tape is not None else None
+            depth_delta = DepthDeltaBuffer(self.depth_delta.checkpoint_levels, 0) \
+                if self.depth_delta is not None else None
+            n_records = 0
+            for op, values in read_wal(path):
+                n_records += 1
+                if op == OP_OHLC:
+                    row_buffer.set_ohlc(*values)
+                elif op == OP_AGG_TRADE:
+                    row_buffer.add_agg_trade(*values)
+                elif op == OP_TRADE:
+                    if trade_tape is not None:
+                        trade_tape.append(values)
+                    else:
+                        row_buffer.add_agg_trade(*values[:6])
+                elif op == OP_DEPTH:
+                    row_buffer.set_depth(*values)
+                elif op == OP_LEVELS and depth_delta is not None:
+                    target, *levels = values
+                    if target == LEVELS_CHECKPOINTS:
+                        depth_delta.append_checkpoint(*levels)
+                    else:
+                        depth_delta.append_change(*levels)
+            if trade_tape is not None:
+                row_buffer.set_agg_trades(trade_tape.merged())
+            log.warning(f"Replayed {n_records} records ({len(row_buffer)} rows) from {path}")
+            bars = self.features.process(row_buffer) if self.features is not None else None
+            self.submit_batches(row_buffer, depth_delta, path, bars, trade_tape)
+
+    def submit_batches(self, row_buffer, depth_delta, wal_path=None, bars=None, trade_tape=None):
+        batches = []
+        if len(row_buffer) > 0:
+            batches.append(("rows", row_buffer))
+        if trade_tape is not None and len(trade_tape) > 0:
+            batches.append((KIND_TRADES, trade_tape))
+        if bars is not None:
+            batches.append((KIND_BARS, bars))
+        if depth_delta is not None and len(depth_delta) > 0:
+            batches.append((KIND_CHECKPOINTS, depth_delta.checkpoints))
+            batches.append((KIND_CHANGES, depth_delta.changes))
+        if wal_path is not None:
+            if not batches:
+                self.release_wal(wal_path)
+                return
+            with self.lock:
+                self.wal_refs[wal_path] = len(batches)
+            for _, batch in batches:
+                batch.wal_path = wal_path
+        for kind, batch in batches:
+            self.writer.submit(kind, batch)
+
+    def on_batch_done(self, kind, batch):
+        # runs on the writer threads once a batch is written
+        wal_path = getattr(batch, 'wal_path', None)
+        if wal_path is None:
+            return
+        with self.lock:
+            self.wal_refs[wal_path] -= 1
+            if self.wal_refs[wal_path] > 0:
+                return
+            del self.wal_refs[wal_path]
+            # a dataset file only becomes readable once it is closed; taken under
+            # the lock that on_file_closed needs, so no close is missed in between
+            open_paths = self.dataset_writer.open_paths() \
+                if self.dataset_writer is not None else set()
+            if open_paths:
+                self.wal_awaiting_close[wal_path] = open_paths
+                return
+        self.release_wal(wal_path)
+
+    def release_wal(self, wal_path):
+        try:
+            os.remove(wal_path)
+        except FileNotFoundError:
+            pass
+
+    def new_row_buffer(self) -> ColumnarRowBuffer:
+        # flushing happens once the buffer holds more than save_every rows
+        return ColumnarRowBuffer(self.config, self.save_every + 1,
+                                 with_depth=self.depth_delta is None)
+
+    def new_trade_tape(self) -> TradeTapeBuffer:
+        # counted with the rows against save_every, so it never grows
+        return TradeTapeBuffer(self.save_every + 1)
 
     def reset_time_to_row_data(self):
-        self.time_to_row_data = SortedDict()
+        self.time_to_row_data = self.new_row_buffer()
 
+    @timed("ohlc_cb")
     def ohlc_cb(self, data):
-        # logging.info("ohlc", data)
-        # # #logging.info("len time_to_row_data", len(self.time_to_row_data))
-        event_time = int(data['E'])
-        data_ohlc = data['k']
-        if event_time in self.time_to_row_data:
-            row: StandardRow = self.time_to_row_data[event_time]
-        else:
-            row = StandardRow(config=self.config)
-        row.o = float(data_ohlc['o'])
-        row.h = float(data_ohlc['h'])
-        row.l = float(data_ohlc['l'])
-        row.c = float(data_ohlc['c'])
-        row.v = float(data_ohlc['v'])
-        row.ohlc_time_start = int(data_ohlc['t'])
-        row.ohlc_time_end = int(data_ohlc['T'])
-        row.first_trade_id_ohlc = int(data_ohlc['f'])
-        row.last_trade_id_ohlc = int(data_ohlc['L'])
-        self.time_to_row_data[event_time] = row
-        self.check_if_should_parquet_export()
+        # accepts decoded Kline structs or the raw kline message
+        kline = data if isinstance(data, Kline) else decode_kline(data)
+        self.lag_ms["kline"].record(time.time() * 1000 - kline.event_time)
+        if self.aligner is not None:
+            self.aligner.push("kline", kline.event_time, kline)
+            return
+        self.apply_kline(kline)
 
+    @timed("depth_cb")
     def depth_cb(self, data):
-        # logging.info("depth", data)
-        event_time = int(data['E'])
-        # logging.info("E", event_time)
-        #logging.info("Time delta depth", get_time_delta(event_time))
-        bids = data['top_bids']
-        asks = data['top_asks']
-        if event_time in self.time_to_row_data:
-            row = self.time_to_row_data[event_time]
-        else:
-            row = StandardRow(config=self.config)
-        row.top_k_bids = [DepthEntry(price=float(x[0]), quantity=float(x[1])) \
-                            for x in bids]
-        row.top_k_asks = [DepthEntry(price=float(x[0]), quantity=float(x[1])) \
-                            for x in asks]
-        self.time_to_row_data[event_time] = row
-        self.check_if_should_parquet_export()
+        if self.depth_delta is not None:
+            with self.lock:
+                self.depth_delta.add(data)
+            if len(self.depth_delta.changes) > self.depth_changes_per_write:
+                self.save_to_parquet()
+            return
+        if self.skip_unchanged_depth and not data.get('changed', True):
+            return
+        # the top-k arrays are replaced, never modified, by the book, so they can be held
+        self.depth_conflator.push(int(data['E']), (data['top_bids'], data['top_asks']))
+
+    def emit_depth(self, event_time, depth):
+        if self.aligner is not None:
+            self.aligner.push("depth", event_time, depth)
+            return
+        self.apply_depth(event_time, *depth)
 
+    @timed("agg_trades_cb")
     def agg_trades_cb(self, data):
-        # logging.info("trades", data)
-        event_time = int(data['E'])
-        #logging.info("E", event_time)
-        # logging.info(f"Time delta trades {int(data['m'])}")
-        if event_time in self.time_to_row_data:
-            row: StandardRow= self.time_to_row_data[event_time]
-            if self.trade_exists_in_row(row):
-                average_price = (row.quantity_trade * row.price_trade + \
-                                    float(data['q']) * float(data['p'])) / \
-                                    (row.quantity_trade + float(data['q']))
-                data['q'] = row.quantity_trade + float(data['q'])
-                data['p'] = average_price
-                data['is_market_maker'] = -1
-                # event_time += 1
-        else:
-            row: StandardRow = StandardRow(config=self.config)
-        row.price_trade = float(data['p'])
-        row.quantity_trade = float(data['q'])
-        row.is_market_maker = int(data['m'])
-        row.last_trade_id_aggtrade = int(data['l'])
-        row.first_trade_id_aggtrade = int(data['f'])
-        self.time_to_row_data[event_time] = row
+        trade = data if isinstance(data, AggTrade) else decode_agg_trade(data)
+        self.lag_ms["aggTrade"].record(time.time() * 1000 - trade.event_time)
+        if self.aligner is not None:
+            self.aligner.push("aggTrade", trade.event_time, trade)
+            return
+        self.apply_agg_trade(trade)
+
+    def apply_kline(self, kline):
+        with self.lock:
+            self.time_to_row_data.set_ohlc(*kline)
+            if self.wal is not None:
+                self.wal.log_ohlc(*kline)
+        self.check_if_should_parquet_export()
+
+    def apply_depth(self, event_time, top_bids, top_asks):
+        self.last_depth = (top_bids, top_asks)
+        with self.lock:
+            self.time_to_row_data.set_depth(event_time, top_bids, top_asks)
+            if self.wal is not None:
+                self.wal.log_depth(event_time, top_bids, top_asks)
+        self.check_if_should_parquet_export()
+
+    def apply_agg_trade(self, trade):
+        with self.lock:
+            if self.trade_tape is not None:
+                self.trade_tape.append(trade)
+                if self.wal is not None:
+                    self.wal.log_trade(trade)
+            else:
+                values = trade[:6]
+                self.time_to_row_data.add_agg_trade(*values)
+                if self.wal is not None:
+                    self.wal.log_agg_trade(*values)
+            if self.asof_depth and self.last_depth is not None:
+                self.time_to_row_data.set_depth(trade.event_time, *self.last_depth)
+                if self.wal is not None:
+                    self.wal.log_depth(trade.event_time, *self.last_depth)
         self.check_if_should_parquet_export()
-    
-
-    def aggregate_trade_row_and_new_aggTrade_event(self, row, data):
-        self.time_to_row_data
-        return row
-
-    def trade_exists_in_row(self, row: StandardRow) -> bool:
-        return row.quantity_trade > 0
-    # def trades_cb(self, data):
-    #     pass
-
-    def get_colnames(self, time_to_row_items):
-        if self.colnames is not None:
-            return self.colnames
-        else:
-            self.colnames = ['Time_millis_times_10'] + \
-                            time_to_row_items[0][1].get_names()
-            return self.colnames
-
-    def save_to_parquet(self):
-        self.iteration += 1
+
+    def apply_events(self, events):
+        # runs on the aligner thread, the only writer of the row buffer while aligning
+        for event_time, stream, event in events:
+            if stream == "depth":
+                self.apply_depth(event_time, *event)
+            elif stream == "aggTrade":
+                self.apply_agg_trade(event)
+            else:
+                self.apply_kline(event)
+
+    def save_to_parquet(self, final=False):
+        """Seal the current buffer and hand it to the background writer."""
         self.lock.acquire()
-        items = self.time_to_row_data.items()
+        row_buffer = self.time_to_row_data
         self.reset_time_to_row_data()
+        trade_tape = self.trade_tape
+        if trade_tape is not None:
+            self.trade_tape = self.new_trade_tape()
+        depth_delta = self.depth_delta.seal() if self.depth_delta is not None else None
+        wal_path = self.wal.rotate() if self.wal is not None else None
+        bars = None
+        if self.features is not None:
+            self.features_lock.acquire()
         self.lock.release()
-        # log.info(f"items: {items}")
-        # log.info(f"first as array {items[0][1].as_array()}")
-        arr = [[item[0], *item[1].as_array()] for item in items]
         try:
-            print('colnames', self.get_colnames(items))
-            pa_table = pa.Table.from_arrays(np.array(arr).T, self.get_colnames(items))
-        except Exception as e:
-            import ipdb; ipdb.set_trace()
-        log.info(f"Saving to {self.abs_save_dir}/data_{self.iteration}.parquet")
+            if trade_tape is not None:
+                row_buffer.set_agg_trades(trade_tape.merged())
+            if self.features is not None:
+                bars = self.features.process(row_buffer, final)
+        finally:
+            if self.features is not None:
+                self.features_lock.release()
+        self.submit_batches(row_buffer, depth_delta, wal_path, bars, trade_tape)
 
-        if self.config['s3_bucket'] != '':
-            pq.write_table(pa_table, f"{s3_bucket}/data/data_{self.iteration}.parquet", \
-                        compression=self.config['compression_type'], filesystem=self.s3_fs)
-            print("wrote to s3")
-        else:
-            pq.write_table(pa_table, f"{self.abs_save_dir}/data_{self.iteration}.parquet", \
-                        compression=self.config['compression_type'])
-            print("wrote to local")
+    def write_table(self, kind, pa_table):
+        # runs on the writer threads
+        if self.compact_schema is not None:
+            pa_table = self.compact_schema.encode(pa_table)
+        if self.dataset_writer is not None:
+            n_bytes = self.dataset_writer.write(kind, pa_table)
+            with self.lock:
+                self.bytes_written += n_bytes
+            return
+        with self.lock:
+            self.iteration += 1
+            iteration = self.iteration
+        # rows keep the original data_N names, side tables are named after their kind
+        file_name = f"{'data' if kind == 'rows' else kind}_{iteration}.parquet"
+        log.info(f"Saving to {self.files_dir}/{file_name}")
+
+        # written locally also with an S3 bucket, the uploader takes it from there
+        path = f"{self.files_dir}/{file_name}"
+        pq.write_table(pa_table, path, \
+                    compression=self.config['compression_type'])
+        info = file_info(path, kind, self.symbol)
+        with self.lock:
+            self.bytes_written += info["bytes"]
+        self.on_file_closed(path, info)
 
     def check_if_should_parquet_export(self):
-        if len(self.time_to_row_data) > self.save_every:
+        n_events = len(self.time_to_row_data)
+        if self.trade_tape is not None:
+            # trades only become rows when the buffer is sealed
+            n_events += len(self.trade_tape)
+        if n_events > self.save_every:
             self.save_to_parquet()
+
+    def close(self):
+        """Flush whatever is buffered and wait for the writer to finish."""
+        if self.depth_conflator is not None:
+            self.depth_conflator.flush()
+        if self.aligner is not None:
+            self.aligner.close()
+        self.save_to_parquet(final=True)
+        self.writer.close()
+        if self.dataset_writer is not None:
+            self.dataset_writer.close()
+        if self.wal is not None:
+            self.wal.close()
+        log.info(f"Writer stopped: {self.writer.metrics()}")
+        if self.uploader is not None:
+            self.uploader.close(self.config.get('upload_close_timeout_s', 30))
+            log.info(f"Uploader stopped: {self.uploader.metrics()}")
@@ -0,0 +1,187 @@
+# type: ignore
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterator, List, Tuple
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from binance_data_saver.manifest import MANIFEST_NAME, Manifest, file_info
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.schema import column_mapping, decode_table
+
+log = logging.getLogger(__file__)
+
+DEPTH_COLUMN = re.compile(r"(bid|ask)_(price|quantity)_(\d+)")
+
+
+def project_columns(schema: pa.Schema, columns: List[str] = None,
+                    n_levels: int = None) -> List[str]:
+    """Requested columns, or all of them, keeping only the best n_levels depth levels."""
+    names = columns if columns is not None else schema.names
+    if n_levels is None:
+        return list(names)
+    projected = []
+    for name in names:
+        match = DEPTH_COLUMN.fullmatch(name)
+        if match is None or int(match.group(3)) < n_levels:
+            projected.append(name)
+    return projected
+
+
+class DataReader:
+    """
+    Time range reads of a save directory. Files are pruned with the
+    manifest written by ParquetSaver, row groups with their time statistics
+    (pyarrow.dataset pushes the filter down), and only the projected
+    columns are decoded. Local files are memory mapped, s3:// ones read
+    from s3_endpoint_url when set (as the saver's s3_endpoint_url), and a
+    manifest may mix both. Prices and quantities of the compact output
+    schema are returned as float64 unless decode is False, files with
+    different mappings (scales, legacy float64) decoded separately.
+    """
+
+    def __init__(self, directory: str, s3_endpoint_url: str = None):
+        self.directory = str(directory)
+        self.s3_endpoint_url = s3_endpoint_url
+        self.manifest = Manifest(self.directory)
+
+    def files(self, symbol: str, start_time: int = None, end_time: int = None,
+              kind: str = "rows") -> List[Dict]:
+        return self.manifest.select(symbol, kind, start_time, end_time)
+
+    def _filesystem(self, scheme: str, path: str) -> fs.FileSystem:
+        if not scheme:
+            return fs.LocalFileSystem(use_mmap=True)
+        if self.s3_endpoint_url:
+            return fs.S3FileSystem(endpoint_override=self.s3_endpoint_url)
+        return fs.FileSystem.from_uri(path)[0]
+
+    def _datasets(self, entries: List[Dict]) -> List[ds.Dataset]:
+        """
+        One dataset per filesystem and column mapping of the files, a
+        dataset has a single filesystem and takes its schema (and so the
+        scales of the compact columns) from one file.
+        """
+        by_scheme: Dict[str, List[str]] = {}
+        for entry in entries:
+            scheme = entry["path"].split("://", 1)[0] if "://" in entry["path"] else ""
+            by_scheme.setdefault(scheme, []).append(entry["path"])
+        datasets = []
+        for scheme, paths in by_scheme.items():
+            filesystem = self._filesystem(scheme, paths[0])
+            if scheme:
+                paths = [path.split("://", 1)[1] for path in paths]
+            parquet = ds.ParquetFileFormat()
+            by_mapping: Dict[str, Tuple[pa.Schema, List]] = {}
+            for fragment in ds.dataset(paths, format=parquet,
+                                       filesystem=filesystem).get_fragments():
+                schema = fragment.physical_schema
+                key = json.dumps(column_mapping(schema), sort_keys=True)
+                by_mapping.setdefault(key, (schema, []))[1].append(fragment)
+            for schema, fragments in by_mapping.values():
+                datasets.append(ds.FileSystemDataset(fragments, schema, parquet, filesystem))
+        return datasets
+
+    def _scanner_args(self, dataset: ds.Dataset, start_time: int, end_time: int,
+                      columns: List[str], n_levels: int) -> Dict:
+        time_field = ds.field(TIME_COLUMN)
+        predicate = None
+        if start_time is not None:
+            predicate = time_field >= start_time
+        if end_time is not None:
+            upper = time_field <= end_time
+            predicate = upper if predicate is None else predicate & upper
+        return {
+            "columns": project_columns(dataset.schema, columns, n_levels),
+            "filter": predicate,
+        }
+
+    def read(self, symbol: str, start_time: int = None, end_time: int = None,
+             columns: List[str] = None, n_levels: int = None,
+             kind: str = "rows", decode: bool = True) -> pa.Table:
+        """Rows of symbol with start_time <= time <= end_time as one table."""
+        entries = self.files(symbol, start_time, end_time, kind)
+        if not entries:
+            return None
+        datasets = self._datasets(entries)
+        if not decode and len(datasets) > 1:
+            raise ValueError("Files with different column mappings can only be read decoded")
+        tables = []
+        for dataset in datasets:
+            table = dataset.to_table(
+                **self._scanner_args(dataset, start_time, end_time, columns, n_levels)
+            )
+            tables.append(decode_table(table, dataset.schema) if decode else table)
+        # legacy float64 and compact int64 times / ids promote to float64
+        table = pa.concat_tables(tables, promote_options="permissive") \
+            if len(tables) > 1 else tables[0]
+        if TIME_COLUMN in table.column_names:
+            table = table.sort_by(TIME_COLUMN)
+        return table
+
+    def iter_batches(self, symbol: str, start_time: int = None, end_time: int = None,
+                     columns: List[str] = None, n_levels: int = None, kind: str = "rows",
+                     batch_size: int = 65536, decode: bool = True) -> Iterator[pa.RecordBatch]:
+        """Same selection as read, streamed file by file in time order."""
+        for entry in self.files(symbol, start_time, end_time, kind):
+            dataset, = self._datasets([entry])
+            for batch in dataset.to_batches(
+                batch_size=batch_size,
+                **self._scanner_args(dataset, start_time, end_time, columns, n_levels),
+            ):
+                yield decode_table(batch, dataset.schema) if decode else batch
+
+
+def discover_files(directory: str, symbol: str = None,
+                   filesystem=None) -> Iterator[Tuple[str, str, str]]:
+    """
+    (path, kind, symbol) of every parquet file under directory, local or on
+    the given (s3fs) filesystem. The symbol comes from a symbol= directory,
+    else the argument; the kind from a kind directory or the file name prefix.
+    """
+    directory = str(directory).rstrip("/")
+    if filesystem is None:
+        paths = glob.glob(os.path.join(directory, "**", "*.parquet"), recursive=True)
+    else:
+        paths = filesystem.glob(f"{directory}/**/*.parquet")
+    for path in sorted(paths):
+        relative = path[len(directory):].lstrip("/").split("/")
+        match = re.search(r"symbol=([^/]+)", path)
+        path_symbol = match.group(1) if match else symbol
+        if path_symbol is None:
+            log.warning(f"No symbol for {path}, skipping it")
+            continue
+        name_match = re.fullmatch(r"([a-z_]+)_\d+\.parquet", relative[-1])
+        if name_match is not None:
+            kind = "rows" if name_match.group(1) == "data" else name_match.group(1)
+        else:
+            kind = relative[0]
+        yield path, kind, path_symbol
+
+
+def rebuild_manifest(directory: str, symbol: str = None) -> int:
+    """Index parquet files written before the manifest existed, from their footers only."""
+    manifest = Manifest(directory)
+    known = {entry["path"] for entry in manifest.entries()}
+    n_added = 0
+    for path, kind, path_symbol in discover_files(directory, symbol):
+        if path in known:
+            continue
+        manifest.add(path, file_info(path, kind, path_symbol))
+        n_added += 1
+    return n_added
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=f"Index a save directory in {MANIFEST_NAME}")
+    parser.add_argument("directory")
+    parser.add_argument("--symbol", help="symbol of files outside symbol= directories")
+    args = parser.parse_args()
+    print(f"Added {rebuild_manifest(args.directory, args.symbol)} files")
@@ -0,0 +1,88 @@
+# type: ignore
+import json
+import logging
+import struct
+import threading
+import time
+from typing import Callable, Iterator, Tuple
+
+import pyarrow as pa
+
+log = logging.getLogger(__file__)
+
+KIND_DEPTH = 1
+KIND_KLINE = 2
+KIND_AGG_TRADE = 3
+KIND_SNAPSHOT = 4
+KIND_EXCHANGE_INFO = 5
+
+KIND_NAMES = {
+    KIND_DEPTH: "depth",
+    KIND_KLINE: "kline",
+    KIND_AGG_TRADE: "aggTrade",
+    KIND_SNAPSHOT: "snapshot",
+    KIND_EXCHANGE_INFO: "exchangeInfo",
+}
+
+# payload length, record kind, local receive time in ns
+HEADER = struct.Struct("<IBq")
+
+
+class RawMessageRecorder:
+    """
+    Appends raw websocket payloads and REST responses to a compressed,
+    length-prefixed log. Every record is HEADER followed by the payload.
+    """
+
+    def __init__(self, path: str, compression: str = "zstd"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stream = pa.CompressedOutputStream(path, compression)
+        self.n_records = 0
+
+    def record(self, kind: int, payload, recv_time_ns: int = None) -> None:
+        if recv_time_ns is None:
+            recv_time_ns = time.time_ns()
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        header = HEADER.pack(len(payload), kind, recv_time_ns)
+        with self.lock:
+            self.stream.write(header)
+            self.stream.write(payload)
+            self.n_records += 1
+
+    def wrap(self, kind: int, callback: Callable) -> Callable:
+        """Record the already decoded messages of python-binance sockets."""
+        def recording_callback(data):
+            self.record(kind, data)
+            return callback(data)
+        return recording_callback
+
+    def close(self) -> None:
+        with self.lock:
+            self.stream.close()
+        log.info(f"Recorded {self.n_records} messages to {self.path}")
+
+
+def read_records(path: str, kinds=None,
+                 compression: str = "zstd") -> Iterator[Tuple[int, int, bytes]]:
+    """Yield (kind, recv_time_ns, payload) records, optionally only of kinds."""
+    with pa.CompressedInputStream(pa.OSFile(path), compression) as stream:
+        while True:
+            try:
+                header = stream.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, kind, recv_time_ns = HEADER.unpack(header)
+                payload = stream.read(length)
+            except (OSError, pa.ArrowException):
+                # the writer was killed mid frame
+                log.warning(f"Recording {path} is truncated, stopping replay there")
+                return
+            if len(payload) < length:
+                log.warning(f"Recording {path} ends in a partial record")
+                return
+            if kinds is None or kind in kinds:
+                yield kind, recv_time_ns, payload
@@ -0,0 +1,117 @@
+# type: ignore
+import argparse
+import logging
+import time
+from typing import Dict
+
+from binance_data_saver.decoding import (
+    decode_agg_trade,
+    decode_kline,
+    loads,
+    step_size_from_exchange_info,
+    tick_size_from_exchange_info,
+)
+from binance_data_saver.main import load_config
+from binance_data_saver.manage_ws_depth import DepthCacheManager
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.recorder import (
+    KIND_AGG_TRADE,
+    KIND_DEPTH,
+    KIND_EXCHANGE_INFO,
+    KIND_KLINE,
+    KIND_NAMES,
+    KIND_SNAPSHOT,
+    read_records,
+)
+
+logging.basicConfig(level = logging.INFO)
+log = logging.getLogger(__file__)
+
+
+class ReplayDepthCacheManager(DepthCacheManager):
+    """
+    DepthCacheManager whose REST calls are answered from a recording, the
+    n-th snapshot request gets the n-th recorded snapshot.
+    """
+
+    def __init__(self, config: Dict, record_path: str):
+        super().__init__(config, should_plot=False)
+        # resync on the replay thread so snapshots are used in recorded order
+        self.resync_in_background = False
+        self.snapshots = read_records(record_path, kinds={KIND_SNAPSHOT})
+        self.exchange_infos = read_records(record_path, kinds={KIND_EXCHANGE_INFO})
+
+    def get_tick_size(self) -> float:
+        if self.config.get("tick_size"):
+            return float(self.config["tick_size"])
+        _, _, payload = next(self.exchange_infos)
+        return tick_size_from_exchange_info(payload)
+
+    def get_snapshot(self, record=True, limit=None) -> Dict[str, str]:
+        try:
+            _, _, payload = next(self.snapshots)
+        except StopIteration:
+            raise RuntimeError("The recording has no snapshot left for this request")
+        return loads(payload)
+
+
+def replay(record_path: str, config: Dict, data_handler: ParquetSaver) -> Dict:
+    """
+    Feed a recording through DepthCacheManager.on_message and the
+    ParquetSaver callbacks as fast as possible, without any network.
+    """
+    depth_cache_manager = ReplayDepthCacheManager(config, record_path)
+    depth_cache_manager.initialize_params(config["token"].lower())
+    depth_cache_manager.update_callback = data_handler.depth_cb
+    handlers = {
+        KIND_DEPTH: lambda payload: depth_cache_manager.on_message(None, payload),
+        KIND_KLINE: lambda payload: data_handler.ohlc_cb(decode_kline(payload)),
+        KIND_AGG_TRADE: lambda payload: data_handler.agg_trades_cb(decode_agg_trade(payload)),
+    }
+    counts = {KIND_NAMES[kind]: 0 for kind in handlers}
+    start = time.perf_counter()
+    for kind, _, payload in read_records(record_path, kinds=set(handlers)):
+        handlers[kind](payload)
+        counts[KIND_NAMES[kind]] += 1
+    data_handler.close()
+    elapsed = time.perf_counter() - start
+    n_messages = sum(counts.values())
+    log.info(f"Replayed {n_messages} messages in {elapsed:.2f} s "
+             f"({n_messages / max(elapsed, 1e-9):.0f} msg/s): {counts}")
+    return counts
+
+
+def replay_config(config: Dict) -> Dict:
+    """
+    config for a replay next to a running collector: the WAL and spill
+    directories are per symbol under the package directory whatever
+    save_dir is, so a replay must not touch them (ParquetSaver would replay
+    and delete the collector's segments); the recording is the log.
+    """
+    return dict(config, s3_bucket="", wal_enabled=False, memory_budget_bytes=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild a dataset from a raw recording")
+    parser.add_argument("recording", help="log written with record_raw_messages enabled")
+    parser.add_argument("--token", help="recorded symbol, overrides token of config.yaml")
+    parser.add_argument("--save-dir", help="overrides save_dir of config.yaml")
+    parser.add_argument("--n-depth-pairs", type=int, help="overrides n_depth_pairs")
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.token:
+        config["token"] = args.token
+    if args.save_dir:
+        config["save_dir"] = args.save_dir
+    if args.n_depth_pairs:
+        config["n_depth_pairs"] = args.n_depth_pairs
+    # replay always writes locally
+    config = replay_config(config)
+    if config.get("output_schema", "legacy") == "compact" and \
+            not (config.get("tick_size") and config.get("step_size")):
+        # scales of the recorded symbol, without a request
+        _, _, payload = next(read_records(args.recording, kinds={KIND_EXCHANGE_INFO}))
+        config["tick_size"] = config.get("tick_size") or tick_size_from_exchange_info(payload)
+        config["step_size"] = config.get("step_size") or step_size_from_exchange_info(payload)
+    replay(args.recording, config, ParquetSaver(config))
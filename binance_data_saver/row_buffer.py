@@ -0,0 +1,187 @@
+# type: ignore
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pyarrow as pa
+
+from binance_data_saver.data_objects import StandardRow
+
+log = logging.getLogger(__file__)
+
+TIME_COLUMN = "Time_millis_times_10"
+
+
+class ColumnarRowBuffer:
+    """
+    Column oriented replacement for the SortedDict of StandardRow objects.
+    Every scalar field of StandardRow gets its own preallocated array and
+    each depth side is a (2 * n_depth_pairs, capacity) block where
+    row 2i holds the price and row 2i + 1 the quantity of level i,
+    so the columns can be handed to Arrow without per-row Python objects.
+    With with_depth=False the depth columns are left out entirely (the
+    delta depth storage keeps the book in tables of its own).
+    """
+
+    def __init__(self, config: Dict, capacity: int, with_depth: bool = True):
+        self.config = config
+        self.n_depth_pairs = config["n_depth_pairs"] if with_depth else 0
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        self.time_to_idx: Dict[int, int] = {}
+        self.is_sorted = True
+        self.last_time = None
+        # compact output schema: int columns are not converted to float64 (see schema.py)
+        self.native_types = config.get("output_schema", "legacy") == "compact"
+
+        self.scalar_names: List[str] = []
+        self.scalar_dtypes = {}
+        self.scalar_defaults = {}
+        for name, field in StandardRow.model_fields.items():
+            if name == "config" or "top_k" in name:
+                continue
+            self.scalar_names.append(name)
+            self.scalar_dtypes[name] = np.int64 if field.annotation is int \
+                else np.float64
+            self.scalar_defaults[name] = field.default
+        self.colnames = [TIME_COLUMN] + \
+            StandardRow(config=config).get_names()
+        if not with_depth:
+            self.colnames = self.colnames[:1 + len(self.scalar_names)]
+
+        self.times = np.zeros(self.capacity, dtype=np.int64)
+        self.columns = {name: self._new_column(name, self.capacity) \
+                        for name in self.scalar_names}
+        self.bids = np.zeros((2 * self.n_depth_pairs, self.capacity), dtype=np.float64)
+        self.asks = np.zeros((2 * self.n_depth_pairs, self.capacity), dtype=np.float64)
+        # name -> array of size rows in time order, appended by to_table (see features.py)
+        self.extra_columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        """Allocated bytes, the arrays are preallocated to capacity."""
+        return self.times.nbytes + self.bids.nbytes + self.asks.nbytes + \
+            sum(column.nbytes for column in self.columns.values()) + \
+            sum(column.nbytes for column in self.extra_columns.values())
+
+    def _new_column(self, name: str, capacity: int) -> np.ndarray:
+        return np.full(capacity, self.scalar_defaults[name],
+                       dtype=self.scalar_dtypes[name])
+
+    def _grow(self) -> None:
+        # only reached if the owner does not flush at capacity
+        new_capacity = self.capacity * 2
+        log.warning(f"Growing row buffer from {self.capacity} to {new_capacity} rows")
+        self.times = np.concatenate([self.times, np.zeros(self.capacity, dtype=np.int64)])
+        for name in self.scalar_names:
+            self.columns[name] = np.concatenate(
+                [self.columns[name], self._new_column(name, self.capacity)]
+            )
+        self.bids = np.concatenate([self.bids, np.zeros_like(self.bids)], axis=1)
+        self.asks = np.concatenate([self.asks, np.zeros_like(self.asks)], axis=1)
+        self.capacity = new_capacity
+
+    def row_for(self, event_time: int) -> int:
+        """Index of the row for event_time, appending a default row if needed."""
+        idx = self.time_to_idx.get(event_time)
+        if idx is not None:
+            return idx
+        if self.size == self.capacity:
+            self._grow()
+        idx = self.size
+        self.times[idx] = event_time
+        if self.last_time is not None and event_time < self.last_time:
+            self.is_sorted = False
+        self.last_time = event_time
+        self.time_to_idx[event_time] = idx
+        self.size += 1
+        return idx
+
+    def set_ohlc(self, event_time: int, o: float, h: float, l: float, c: float,
+                 v: float, time_start: int, time_end: int,
+                 first_trade_id: int, last_trade_id: int) -> None:
+        idx = self.row_for(event_time)
+        cols = self.columns
+        cols["o"][idx] = o
+        cols["h"][idx] = h
+        cols["l"][idx] = l
+        cols["c"][idx] = c
+        cols["v"][idx] = v
+        cols["ohlc_time_start"][idx] = time_start
+        cols["ohlc_time_end"][idx] = time_end
+        cols["first_trade_id_ohlc"][idx] = first_trade_id
+        cols["last_trade_id_ohlc"][idx] = last_trade_id
+
+    def add_agg_trade(self, event_time: int, price: float, quantity: float,
+                      is_market_maker: int, first_trade_id: int,
+                      last_trade_id: int) -> None:
+        """
+        Trades sharing an event time are merged into one volume weighted
+        row, with is_market_maker set to -1 since the sides may differ.
+        """
+        idx = self.row_for(event_time)
+        cols = self.columns
+        prev_qty = cols["quantity_trade"][idx]
+        if prev_qty > 0:
+            total_qty = prev_qty + quantity
+            cols["price_trade"][idx] = (prev_qty * cols["price_trade"][idx] + \
+                                        quantity * price) / total_qty
+            cols["quantity_trade"][idx] = total_qty
+            if cols["is_market_maker"][idx] != is_market_maker:
+                cols["is_market_maker"][idx] = -1
+        else:
+            cols["price_trade"][idx] = price
+            cols["quantity_trade"][idx] = quantity
+            cols["is_market_maker"][idx] = is_market_maker
+            cols["first_trade_id_aggtrade"][idx] = first_trade_id
+        cols["last_trade_id_aggtrade"][idx] = last_trade_id
+
+    def set_agg_trades(self, trades: Dict[str, np.ndarray]) -> None:
+        """
+        Trade columns already merged per event time (TradeTapeBuffer.merged),
+        trades["time"] holds the event times and the other keys are columns.
+        """
+        times = trades["time"].tolist()
+        idx = np.fromiter((self.row_for(event_time) for event_time in times),
+                          dtype=np.int64, count=len(times))
+        for name, values in trades.items():
+            if name != "time":
+                self.columns[name][idx] = values
+
+    def set_depth(self, event_time: int, top_bids, top_asks) -> None:
+        """top_bids / top_asks are (price, quantity) pairs, best level first."""
+        idx = self.row_for(event_time)
+        self._write_side(self.bids, idx, top_bids)
+        self._write_side(self.asks, idx, top_asks)
+
+    def _write_side(self, block: np.ndarray, idx: int, levels) -> None:
+        levels = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+        n = min(len(levels), self.n_depth_pairs)
+        block[0:2 * n:2, idx] = levels[:n, 0]
+        block[1:2 * n:2, idx] = levels[:n, 1]
+        block[2 * n:, idx] = 0
+
+    def to_table(self) -> pa.Table:
+        """
+        Arrow table with the legacy all-float64 schema of StandardRow.as_array,
+        int columns stay int64 with native_types.
+        """
+        n = self.size
+        order = None
+        if self.config.get("sort_by_time", True) and not self.is_sorted:
+            order = np.argsort(self.times[:n], kind="stable")
+
+        def take(arr: np.ndarray) -> np.ndarray:
+            arr = arr[:n] if order is None else arr[:n][order]
+            return arr if arr.dtype == np.float64 or self.native_types else arr.astype(np.float64)
+
+        arrays = [take(self.times)]
+        arrays += [take(self.columns[name]) for name in self.scalar_names]
+        for block in (self.bids, self.asks):
+            arrays += [take(block[i]) for i in range(block.shape[0])]
+        arrays += list(self.extra_columns.values())
+        return pa.Table.from_arrays([pa.array(a) for a in arrays],
+                                    self.colnames + list(self.extra_columns))
@@ -0,0 +1,123 @@
+# type: ignore
+# compact output schema: prices as int64 ticks, quantities as int64 steps (or
+# float32), ids and times as native int64, decoded with the file metadata
+import json
+import logging
+import re
+from typing import Dict
+
+import numpy as np
+import pyarrow as pa
+
+from binance_data_saver.orderbook import tick_decimals
+from binance_data_saver.row_buffer import TIME_COLUMN
+
+log = logging.getLogger(__file__)
+
+SCHEMA_METADATA_KEY = b"binance_data_saver.schema"
+
+# columns on the tick / lot grid, found by name in the rows, trades and depth tables;
+# price_trade is a volume weighted price of merged trades and stays float64
+PRICE_COLUMN = re.compile(r"[ohlc]|price|(bid|ask)_price_\d+")
+QUANTITY_COLUMN = re.compile(r"v|quantity|quantity_trade|(bid|ask)_quantity_\d+")
+INT_COLUMN = re.compile(
+    rf"{TIME_COLUMN}|ohlc_time_(start|end)|(first|last)_trade_id(_ohlc|_aggtrade)?|agg_trade_id"
+    r"|trade_time|update_id"
+)
+INT8_COLUMN = re.compile(r"is_market_maker|is_buyer_maker|side")
+
+
+class CompactSchema:
+    """
+    Maps the float64 columns of the saver's tables to compact types,
+    classified by column name: prices become int64 multiples of tick_size,
+    quantities int64 multiples of step_size (or float32 with
+    quantity_encoding="float32"), ids and times int64 and sides int8.
+    Other columns (features, price_trade) are kept as they are. The
+    mapping and the scales go into the schema metadata of every table, so
+    decode_table() restores the exact decimal values from any file.
+    """
+
+    def __init__(self, tick_size: float, step_size: float, quantity_encoding: str = "scaled"):
+        assert tick_size > 0 and (step_size > 0 or quantity_encoding == "float32"), \
+            "the compact schema needs the tick size and step size of the symbol"
+        self.tick_size = float(tick_size)
+        self.step_size = float(step_size) if step_size else None
+        self.quantity_encoding = quantity_encoding
+
+    def column_encoding(self, name: str) -> Dict:
+        if PRICE_COLUMN.fullmatch(name):
+            return {"encoding": "scaled", "scale": self.tick_size,
+                    "decimals": tick_decimals(self.tick_size)}
+        if QUANTITY_COLUMN.fullmatch(name):
+            if self.quantity_encoding == "float32":
+                return {"encoding": "float32"}
+            return {"encoding": "scaled", "scale": self.step_size,
+                    "decimals": tick_decimals(self.step_size)}
+        if INT_COLUMN.fullmatch(name):
+            return {"encoding": "int64"}
+        if INT8_COLUMN.fullmatch(name):
+            return {"encoding": "int8"}
+        return None
+
+    def encode(self, table: pa.Table) -> pa.Table:
+        arrays, fields, mapping = [], [], {}
+        for field, column in zip(table.schema, table.columns):
+            encoding = self.column_encoding(field.name)
+            if encoding is None or not (pa.types.is_floating(field.type)
+                                        or pa.types.is_integer(field.type)):
+                arrays.append(column)
+                fields.append(field)
+                continue
+            values = column.to_numpy()
+            if encoding["encoding"] == "scaled":
+                values = np.rint(values / encoding["scale"]).astype(np.int64)
+            elif encoding["encoding"] == "float32":
+                values = values.astype(np.float32)
+            else:
+                values = values.astype(encoding["encoding"])
+            arrays.append(pa.array(values))
+            fields.append(pa.field(field.name, arrays[-1].type))
+            mapping[field.name] = encoding
+        metadata = dict(table.schema.metadata or {})
+        metadata[SCHEMA_METADATA_KEY] = json.dumps({"version": 1, "columns": mapping})
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields, metadata=metadata))
+
+
+def column_mapping(schema: pa.Schema) -> Dict[str, Dict]:
+    """Per column encoding of a compact file, empty for the legacy float64 schema."""
+    metadata = schema.metadata or {}
+    if SCHEMA_METADATA_KEY not in metadata:
+        return {}
+    return json.loads(metadata[SCHEMA_METADATA_KEY])["columns"]
+
+
+def decoded_schema(schema: pa.Schema) -> pa.Schema:
+    """Schema of decode_table's result."""
+    mapping = column_mapping(schema)
+    return pa.schema([
+        pa.field(field.name, pa.float64())
+        if mapping.get(field.name, {}).get("encoding") == "scaled" else field
+        for field in schema
+    ])
+
+
+def decode_table(table, schema: pa.Schema = None):
+    """
+    Table (or record batch) with the scaled columns back in float64, exact
+    to the decimals of their scale; schema defaults to the table's own.
+    """
+    mapping = column_mapping(schema if schema is not None else table.schema)
+    scaled = {name: encoding for name, encoding in mapping.items()
+              if encoding["encoding"] == "scaled" and name in table.schema.names}
+    if not scaled:
+        return table
+    columns = list(table.columns)
+    for name, encoding in scaled.items():
+        idx = table.schema.get_field_index(name)
+        columns[idx] = pa.array(np.round(columns[idx].to_numpy() * encoding["scale"],
+                                         encoding["decimals"]))
+    # without the mapping, the result is not decoded twice
+    if isinstance(table, pa.RecordBatch):
+        return pa.RecordBatch.from_arrays(columns, names=table.schema.names)
+    return pa.Table.from_arrays(columns, names=table.schema.names)
@@ -0,0 +1,153 @@
+# type: ignore
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Dict, List
+
+from binance_data_saver.manage_ws_depth import DepthCacheManager
+from binance_data_saver.metrics import register_collector, start_metrics
+from binance_data_saver.parquet_saver import ParquetSaver
+
+log = logging.getLogger(__file__)
+
+
+def shard_symbols(symbols: List[str], n_shards: int) -> List[List[str]]:
+    """Round robin, so the busiest symbols listed first end up on different shards."""
+    n_shards = max(1, min(n_shards, len(symbols)))
+    return [symbols[i::n_shards] for i in range(n_shards)]
+
+
+def _exit_on_sigterm(signum, frame):
+    # unwinds through the finally blocks, which flush the savers
+    sys.exit(0)
+
+
+async def _run_engines(engines: List) -> None:
+    await asyncio.gather(*(engine.run() for engine in engines))
+
+
+def run_shard(symbols: List[str], config: Dict, shard_index: int = 0) -> None:
+    """
+    Worker process entry point: one asyncio loop running an
+    AsyncIngestionEngine per symbol, each with its own book and writer.
+    The shard serves its metrics on metrics_port + shard_index.
+    """
+    # imported here, main imports the binance client at module level and
+    # aiohttp comes with the asyncio extra, which only the shards need
+    from binance_data_saver.async_engine import AsyncIngestionEngine
+    from binance_data_saver.main import new_recorder
+
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    savers, recorders, engines = [], [], []
+    try:
+        for symbol in symbols:
+            saver = ParquetSaver(config, symbol=symbol)
+            savers.append(saver)
+            recorder = new_recorder(config, symbol)
+            if recorder is not None:
+                recorders.append(recorder)
+            engine = AsyncIngestionEngine(
+                symbol, config, saver,
+                depth_cache_manager=DepthCacheManager(config, should_plot=False),
+                recorder=recorder,
+            )
+            register_collector(symbol, saver, engine.depth_cache_manager)
+            engines.append(engine)
+        start_metrics(config, port_offset=shard_index)
+        log.info(f"Shard {os.getpid()} collecting {', '.join(symbols)}")
+        asyncio.run(_run_engines(engines))
+    finally:
+        for saver in savers:
+            saver.close()
+        for recorder in recorders:
+            recorder.close()
+
+
+class ShardSupervisor:
+    """
+    Splits the symbols over n_shards worker processes, so ingestion scales
+    with cores instead of sharing one interpreter lock, and restarts any
+    shard that dies with a backoff of min(2 ** restarts, 60) seconds.
+    """
+
+    def __init__(self, symbols: List[str], config: Dict, n_shards: int = None):
+        if n_shards is None:
+            n_shards = config.get("n_shards", 0) or os.cpu_count() or 1
+        self.config = config
+        self.shards = shard_symbols([s.lower() for s in symbols], n_shards)
+        # spawn, the parent may hold locks and sessions a fork would copy
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: List = [None] * len(self.shards)
+        self.restarts = [0] * len(self.shards)
+        self.restart_at = [0.0] * len(self.shards)
+        self.stopping = False
+
+    def start_shard(self, i: int) -> None:
+        process = self.context.Process(
+            target=run_shard, args=(self.shards[i], self.config, i),
+            name=f"shard-{i}", daemon=False,
+        )
+        process.start()
+        self.processes[i] = process
+        log.info(f"Started shard {i} (pid {process.pid}): {', '.join(self.shards[i])}")
+
+    def stop(self, signum=None, frame=None) -> None:
+        self.stopping = True
+
+    def run(self, poll_interval: float = 1.0) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for i in range(len(self.shards)):
+            self.start_shard(i)
+        try:
+            while not self.stopping:
+                time.sleep(poll_interval)
+                self.poll()
+        finally:
+            self.shutdown()
+
+    def poll(self) -> None:
+        """Schedules a restart of dead shards and starts those whose backoff has passed."""
+        for i, process in enumerate(self.processes):
+            if process.is_alive():
+                if time.monotonic() - self.restart_at[i] > 300:
+                    # healthy for a while, forget earlier crashes
+                    self.restarts[i] = 0
+                continue
+            if process.exitcode is not None:
+                delay = min(2 ** self.restarts[i], 60)
+                log.error(f"Shard {i} exited with {process.exitcode}, "
+                          f"restarting in {delay}s")
+                process.join()
+                self.processes[i] = _Restarting(time.monotonic() + delay)
+            elif time.monotonic() >= process.due:
+                self.restarts[i] += 1
+                self.restart_at[i] = time.monotonic()
+                self.start_shard(i)
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        running = [p for p in self.processes if isinstance(p, multiprocessing.process.BaseProcess)]
+        for process in running:
+            if process.is_alive():
+                process.terminate()
+        for process in running:
+            process.join(timeout)
+            if process.is_alive():
+                log.error(f"{process.name} did not flush within {timeout}s, killing it")
+                process.kill()
+
+
+class _Restarting:
+    """Placeholder of a dead shard until its backoff has passed."""
+
+    exitcode = None
+
+    def __init__(self, due: float):
+        self.due = due
+
+    def is_alive(self) -> bool:
+        return False
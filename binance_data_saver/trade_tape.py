@@ -0,0 +1,116 @@
+# type: ignore
+import logging
+from typing import Dict
+
+import numpy as np
+import pyarrow as pa
+
+from binance_data_saver.row_buffer import TIME_COLUMN
+
+log = logging.getLogger(__file__)
+
+KIND_TRADES = "trades"
+
+# in decoding.AggTrade order: event time E, then the aggTrade fields p, q, m, f, l, a, T
+TAPE_DTYPE = np.dtype([
+    (TIME_COLUMN, np.int64),
+    ("price", np.float64),
+    ("quantity", np.float64),
+    ("is_buyer_maker", np.int8),
+    ("first_trade_id", np.int64),
+    ("last_trade_id", np.int64),
+    ("agg_trade_id", np.int64),
+    ("trade_time", np.int64),
+])
+
+
+class TradeTapeBuffer:
+    """
+    Preallocated buffer of every aggTrade as received, written to a trades
+    table of its own. append() is a single record assignment into a
+    structured array (one C level copy of the AggTrade tuple, no lookup of
+    the row the trade belongs to); the columns are strided views of it.
+    The volume weighted trade columns of the rows are derived from the
+    tape by merged() when the buffer is sealed.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        self.records = np.empty(self.capacity, dtype=TAPE_DTYPE)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.records.nbytes
+
+    def _grow(self) -> None:
+        # only reached if the owner does not flush at capacity
+        new_capacity = self.capacity * 2
+        log.warning(f"Growing trade tape from {self.capacity} to {new_capacity} trades")
+        grown = np.empty(new_capacity, dtype=TAPE_DTYPE)
+        grown[:self.size] = self.records[:self.size]
+        self.records = grown
+        self.capacity = new_capacity
+
+    def append(self, trade) -> None:
+        """trade is a decoding.AggTrade, or a tuple in its field order."""
+        idx = self.size
+        if idx == self.capacity:
+            self._grow()
+        self.records[idx] = trade
+        self.size = idx + 1
+
+    def merged(self) -> Dict[str, np.ndarray]:
+        """
+        One entry per event time, merged exactly as ColumnarRowBuffer.add_agg_trade
+        merges them (volume weighted price, summed quantity, the side or -1
+        when the sides differ, the first trade id of the first trade with a
+        quantity and the last trade id of the last one). The same running
+        update is applied to all event times at once, one step per trade of
+        the busiest event time, so the floats come out bit for bit the same.
+        """
+        records = self.records[:self.size]
+        if len(records) > 1 and (np.diff(records[TIME_COLUMN]) < 0).any():
+            records = records[np.argsort(records[TIME_COLUMN], kind="stable")]
+        times = records[TIME_COLUMN]
+        if len(times) == 0:
+            return {"time": times}
+        starts = np.flatnonzero(np.diff(times, prepend=times[0] - 1))
+        counts = np.diff(np.append(starts, len(times)))
+        price, quantity = records["price"], records["quantity"]
+        side, first_trade_id = records["is_buyer_maker"].astype(np.int64), records["first_trade_id"]
+        merged_price, merged_quantity = price[starts], quantity[starts]
+        merged_side, merged_first_id = side[starts], first_trade_id[starts]
+        for k in range(1, counts.max()):
+            groups = np.flatnonzero(counts > k)
+            idx = starts[groups] + k
+            previous = merged_quantity[groups]
+            merging = previous > 0
+            total = previous + quantity[idx]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                vwap = (previous * merged_price[groups] + quantity[idx] * price[idx]) / total
+            merged_price[groups] = np.where(merging, vwap, price[idx])
+            merged_quantity[groups] = np.where(merging, total, quantity[idx])
+            group_side = merged_side[groups]
+            merged_side[groups] = np.where(
+                merging, np.where(group_side != side[idx], -1, group_side), side[idx])
+            merged_first_id[groups] = np.where(merging, merged_first_id[groups],
+                                               first_trade_id[idx])
+        return {
+            "time": times[starts],
+            "price_trade": merged_price,
+            "quantity_trade": merged_quantity,
+            "is_market_maker": merged_side,
+            "first_trade_id_aggtrade": merged_first_id,
+            "last_trade_id_aggtrade": records["last_trade_id"][starts + counts - 1],
+        }
+
+    def to_table(self) -> pa.Table:
+        records = self.records[:self.size]
+        return pa.Table.from_arrays(
+            [pa.array(np.ascontiguousarray(records[name])) for name in TAPE_DTYPE.names],
+            list(TAPE_DTYPE.names),
+        )
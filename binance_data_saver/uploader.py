@@ -0,0 +1,181 @@
+# type: ignore
+import hashlib
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+from binance_data_saver.metrics import LogHistogram
+
+log = logging.getLogger(__file__)
+
+_STOP = object()
+
+
+def expected_etag(path: str, part_size: int) -> str:
+    """ETag S3 gives the file uploaded by put_file with chunksize=part_size."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size < 2 * part_size:
+            return hashlib.md5(f.read()).hexdigest()
+        digests = []
+        while True:
+            part = f.read(part_size)
+            if not part:
+                break
+            digests.append(hashlib.md5(part).digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+class S3Uploader:
+    """
+    Moves complete parquet files from a local staging directory to S3, off
+    the ingest path: writers only submit(path) the files they closed, a pool
+    of worker threads uploads them (multipart, part_concurrency parts in
+    flight per file) to the same relative path under remote_dir. A failed
+    upload is retried with exponential backoff and jitter, max_attempts
+    times (forever with 0). Once the size and ETag of the object match the
+    local file, on_uploaded(path, remote_path, info) is called and only
+    then is the file removed, so an upload whose callback raises is retried
+    as a whole. Files still staged when the uploader is closed (or that ran
+    out of attempts) are found again by the owner on the next start.
+    """
+
+    def __init__(self, staging_dir: str, remote_dir: str, filesystem, n_workers: int = 4,
+                 part_size: int = 16 * 1024 * 1024, part_concurrency: int = 4,
+                 max_attempts: int = 0, backoff_s: float = 1.0, max_backoff_s: float = 60.0,
+                 verify_etag: bool = True, on_uploaded: Callable = None,
+                 name: str = "s3-uploader"):
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.remote_dir = remote_dir.split("://", 1)[-1].rstrip("/")
+        self.filesystem = filesystem
+        self.part_size = part_size
+        self.part_concurrency = part_concurrency
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.verify_etag = verify_etag
+        self.on_uploaded = on_uploaded
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.backlog_files = 0
+        self.backlog_bytes = 0
+        self.n_uploaded = 0
+        self.uploaded_bytes = 0
+        self.upload_s = 0.0
+        self.n_retries = 0
+        self.n_failures = 0
+        self.upload_ms = LogHistogram()
+        self.workers = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(int(n_workers), 1))
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def remote_path(self, path: str) -> str:
+        relative = os.path.relpath(os.path.abspath(path), self.staging_dir)
+        return f"{self.remote_dir}/{relative.replace(os.sep, '/')}"
+
+    def submit(self, path: str, info: Dict = None) -> None:
+        size = os.path.getsize(path)
+        with self.stats_lock:
+            self.backlog_files += 1
+            self.backlog_bytes += size
+        self.queue.put((path, info, size))
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            path, info, size = item
+            # past the close timeout, what is left stays staged
+            uploaded = not self.stopped.is_set() and self._upload_with_retries(path, info)
+            with self.stats_lock:
+                self.backlog_files -= 1
+                self.backlog_bytes -= size
+                self.n_failures += not uploaded
+            self.queue.task_done()
+
+    def _upload_with_retries(self, path: str, info: Dict) -> bool:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._upload(path, info)
+                return True
+            except Exception as e:
+                if not os.path.exists(path):
+                    log.error(f"Giving up on {path}, it is gone ({e!r})")
+                    return False
+                if self.stopped.is_set() or attempt == self.max_attempts:
+                    log.error(f"Giving up on {path} after {attempt} attempts ({e!r}), "
+                              "it stays staged until the next start")
+                    return False
+                delay = min(self.backoff_s * 2 ** (attempt - 1), self.max_backoff_s)
+                # jitter, so the workers do not retry in lockstep
+                delay *= random.uniform(0.5, 1.0)
+                log.warning(f"Upload of {path} failed ({e!r}), attempt {attempt}, "
+                            f"retrying in {delay:.1f} s")
+                with self.stats_lock:
+                    self.n_retries += 1
+                if self.stopped.wait(delay):
+                    log.error(f"Uploader stopped, {path} stays staged until the next start")
+                    return False
+
+    def _upload(self, path: str, info: Dict) -> None:
+        remote = self.remote_path(path)
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        self.filesystem.put_file(path, remote, chunksize=self.part_size,
+                                 max_concurrency=self.part_concurrency)
+        elapsed = time.perf_counter() - start
+        self.filesystem.invalidate_cache(remote)
+        remote_info = self.filesystem.info(remote)
+        if remote_info["size"] != size:
+            raise IOError(f"{remote} has {remote_info['size']} bytes, {path} has {size}")
+        if self.verify_etag:
+            etag = remote_info.get("ETag", "").strip('"')
+            if etag != expected_etag(path, self.part_size):
+                raise IOError(f"ETag {etag} of {remote} does not match {path}")
+        if self.on_uploaded is not None:
+            self.on_uploaded(path, remote, info)
+        os.remove(path)
+        self.upload_ms.record(elapsed * 1000)
+        with self.stats_lock:
+            self.n_uploaded += 1
+            self.uploaded_bytes += size
+            self.upload_s += elapsed
+        log.info(f"Uploaded {path} to {remote} in {elapsed * 1000:.1f} ms "
+                 f"({size / max(elapsed, 1e-9) / 1e6:.1f} MB/s)")
+
+    def metrics(self) -> Dict:
+        with self.stats_lock:
+            return {
+                "backlog_files": self.backlog_files,
+                "backlog_bytes": self.backlog_bytes,
+                "uploaded_files": self.n_uploaded,
+                "uploaded_bytes": self.uploaded_bytes,
+                # per worker, while uploading
+                "mb_per_s": self.uploaded_bytes / self.upload_s / 1e6 if self.upload_s else 0.0,
+                "retries": self.n_retries,
+                "failures": self.n_failures,
+            }
+
+    def close(self, timeout_s: float = None) -> None:
+        """Upload what is queued, giving up after timeout_s; the rest stays staged."""
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+        for worker in self.workers:
+            worker.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if any(worker.is_alive() for worker in self.workers):
+            self.stopped.set()
+            log.warning(f"Stopped uploading with {self.backlog_files} files "
+                        f"({self.backlog_bytes} bytes) still staged")
@@ -0,0 +1,153 @@
+# type: ignore
+# depth chart in a process of its own, fed through shared memory; plotting
+# libraries are only imported in that process
+import argparse
+import logging
+import multiprocessing
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Tuple
+
+import numpy as np
+
+log = logging.getLogger(__file__)
+
+# ring header: sequence number of the latest published snapshot
+HEADER_WORDS = 1
+# slot header: seqlock, event time, n bid levels, n ask levels
+SLOT_HEADER_WORDS = 4
+
+
+class DepthSnapshotRing:
+    """
+    Shared memory ring of top-K book snapshots with one writer (the book
+    thread) and any number of readers. publish() copies the levels into the
+    next slot and never waits; each slot carries a seqlock (odd while being
+    written) so a reader that raced the writer retries instead of drawing a
+    torn snapshot. Readers only ever look at the latest one.
+    """
+
+    def __init__(self, name: str, n_levels: int, n_slots: int = 8, create: bool = False):
+        self.n_levels = n_levels
+        self.n_slots = n_slots
+        self.slot_words = SLOT_HEADER_WORDS + 4 * n_levels
+        size = 8 * (HEADER_WORDS + n_slots * self.slot_words)
+        if create:
+            try:
+                # left behind by a killed collector
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.owner = create
+        if not create and multiprocessing.parent_process() is None:
+            # a standalone reader has a resource tracker of its own, which
+            # would unlink the segment when the reader exits
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.words = np.ndarray(HEADER_WORDS + n_slots * self.slot_words, dtype=np.int64,
+                                buffer=self.shm.buf)
+        self.values = self.words.view(np.float64)
+        if create:
+            self.words[:] = 0
+        self.seq = int(self.words[0])
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _slot(self, seq: int) -> int:
+        return HEADER_WORDS + (seq % self.n_slots) * self.slot_words
+
+    def publish(self, event_time: int, top_bids: np.ndarray, top_asks: np.ndarray) -> None:
+        seq = self.seq + 1
+        start = self._slot(seq)
+        n_bids, n_asks = min(len(top_bids), self.n_levels), min(len(top_asks), self.n_levels)
+        words = self.words
+        words[start] = 2 * seq - 1
+        words[start + 1:start + 4] = (event_time, n_bids, n_asks)
+        levels = start + SLOT_HEADER_WORDS
+        self.values[levels:levels + 2 * n_bids] = top_bids[:n_bids].ravel()
+        levels += 2 * self.n_levels
+        self.values[levels:levels + 2 * n_asks] = top_asks[:n_asks].ravel()
+        words[start] = 2 * seq
+        words[0] = seq
+        self.seq = seq
+
+    def latest(self) -> Tuple[int, int, np.ndarray, np.ndarray]:
+        """(seq, event_time, bids, asks) of the latest snapshot, seq 0 before the first one."""
+        while True:
+            seq = int(self.words[0])
+            if seq == 0:
+                return 0, 0, np.empty((0, 2)), np.empty((0, 2))
+            start = self._slot(seq)
+            lock = int(self.words[start])
+            event_time, n_bids, n_asks = (int(w) for w in self.words[start + 1:start + 4])
+            levels = start + SLOT_HEADER_WORDS
+            bids = self.values[levels:levels + 2 * n_bids].reshape(-1, 2).copy()
+            levels += 2 * self.n_levels
+            asks = self.values[levels:levels + 2 * n_asks].reshape(-1, 2).copy()
+            if lock == 2 * seq and int(self.words[start]) == lock:
+                return seq, event_time, bids, asks
+
+    def close(self) -> None:
+        del self.words, self.values
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_visualizer(ring_name: str, n_levels: int, fps: float = 10.0, title: str = "") -> None:
+    """Draw the latest snapshot of the ring fps times a second until the window is closed."""
+    import warnings
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # seaborn 0.12 sets a pandas option deprecated in pandas 2.1 on every plot
+    warnings.filterwarnings("ignore", message="use_inf_as_na option is deprecated",
+                            category=FutureWarning)
+    sns.set_theme()
+    ring = DepthSnapshotRing(ring_name, n_levels)
+    plt.ion()
+    fig, ax = plt.subplots()
+    ax.ticklabel_format(useOffset=False, style="plain")
+    last_seq = 0
+    try:
+        while plt.fignum_exists(fig.number):
+            seq, event_time, bids, asks = ring.latest()
+            if seq != last_seq and len(bids) and len(asks):
+                last_seq = seq
+                bids, asks = bids[np.isfinite(bids).all(axis=1)], asks[np.isfinite(asks).all(axis=1)]
+                ax.clear()
+                # cumulative quantity from the touch outwards
+                sns.ecdfplot(x=bids[:, 0], weights=bids[:, 1], stat="count", color="red",
+                             complementary=True, ax=ax)
+                sns.ecdfplot(x=asks[:, 0], weights=asks[:, 1], stat="count", color="blue", ax=ax)
+                ax.set_title(f"{title} {time.strftime('%H:%M:%S', time.gmtime(event_time / 1000))}")
+                fig.canvas.draw_idle()
+            plt.pause(1 / fps)
+    finally:
+        ring.close()
+
+
+def start_visualizer(ring: DepthSnapshotRing, fps: float = 10.0, title: str = ""):
+    # spawn, so the viewer never inherits the collector's threads and sockets
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_visualizer, args=(ring.name, ring.n_levels, fps, title),
+        name="depth-visualizer", daemon=True,
+    )
+    process.start()
+    log.info(f"Depth visualizer (pid {process.pid}) reading {ring.name}")
+    return process
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Attach a depth chart to a running collector")
+    parser.add_argument("ring", help="shared memory name, depth_<token> for a collector")
+    parser.add_argument("--levels", type=int, required=True, help="n_depth_pairs of the collector")
+    parser.add_argument("--fps", type=float, default=10.0)
+    args = parser.parse_args()
+    run_visualizer(args.ring, args.levels, args.fps, args.ring)
@@ -0,0 +1,179 @@
+# type: ignore
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from binance_data_saver.metrics import LogHistogram
+
+log = logging.getLogger(__file__)
+
+OP_OHLC = 1
+OP_AGG_TRADE = 2
+OP_DEPTH = 3
+OP_LEVELS = 4
+OP_TRADE = 5
+
+# op, payload length, crc32 of the payload
+HEADER = struct.Struct("<BII")
+OHLC = struct.Struct("<q5d4q")
+AGG_TRADE = struct.Struct("<q2d3q")
+# a decoding.AggTrade, appended to the trade tape
+TRADE = struct.Struct("<q2d5q")
+# event time, n bid levels, n ask levels, followed by the float64 levels
+DEPTH = struct.Struct("<qII")
+# target table, event time, update id, side, n levels, followed by the float64 levels
+LEVELS = struct.Struct("<BqqBI")
+
+LEVELS_CHANGES = 0
+LEVELS_CHECKPOINTS = 1
+
+
+class WriteAheadLog:
+    """
+    Append only log of the mutations of the saver's buffers, so a buffer
+    lost with the process is rebuilt by replaying them. Rows are updated
+    in place (trades are merged, depth overwritten) which is why the log
+    holds the operations rather than rows. One file per sealed buffer
+    (generation): rotate() is called when the buffer is sealed and the
+    file is removed once the batch is committed. Every append is one
+    unbuffered write into the page cache, so a killed process loses
+    nothing; a background thread fsyncs every fsync_interval_ms, which
+    bounds what a power failure can lose.
+    """
+
+    def __init__(self, directory: str, fsync_interval_ms: float = 200):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.fsync_interval_s = fsync_interval_ms / 1000
+        existing = self.pending_files()
+        self.generation = int(os.path.basename(existing[-1])[4:12]) + 1 if existing else 0
+        self.file = self._open(self.generation)
+        # rotated files waiting for their last fsync
+        self.retired = []
+        self.n_bytes = 0
+        self.dirty = False
+        self.closed = False
+        self.fsync_ms = LogHistogram()
+        self.syncer = threading.Thread(target=self._sync_periodically, name="wal-fsync",
+                                       daemon=True)
+        self.syncer.start()
+
+    def path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:08d}.log")
+
+    def pending_files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "wal-*.log")))
+
+    def _open(self, generation: int):
+        return open(self.path(generation), "ab", buffering=0)
+
+    def _append(self, op: int, payload: bytes) -> None:
+        record = HEADER.pack(op, len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self.file.write(record)
+            self.n_bytes += len(record)
+            self.dirty = True
+
+    def log_ohlc(self, *kline) -> None:
+        self._append(OP_OHLC, OHLC.pack(*kline))
+
+    def log_agg_trade(self, event_time: int, price: float, quantity: float,
+                      is_market_maker: int, first_trade_id: int, last_trade_id: int) -> None:
+        self._append(OP_AGG_TRADE, AGG_TRADE.pack(event_time, price, quantity, is_market_maker,
+                                                  first_trade_id, last_trade_id))
+
+    def log_trade(self, trade) -> None:
+        self._append(OP_TRADE, TRADE.pack(*trade))
+
+    def log_depth(self, event_time: int, top_bids: np.ndarray, top_asks: np.ndarray) -> None:
+        top_bids = np.ascontiguousarray(top_bids, dtype=np.float64)
+        top_asks = np.ascontiguousarray(top_asks, dtype=np.float64)
+        self._append(OP_DEPTH, DEPTH.pack(event_time, len(top_bids), len(top_asks))
+                     + top_bids.tobytes() + top_asks.tobytes())
+
+    def log_levels(self, target: int, event_time: int, update_id: int, side: int,
+                   levels: np.ndarray) -> None:
+        levels = np.ascontiguousarray(levels, dtype=np.float64)
+        self._append(OP_LEVELS, LEVELS.pack(target, event_time, update_id, side, len(levels))
+                     + levels.tobytes())
+
+    def _sync(self, file) -> None:
+        start = time.perf_counter()
+        os.fsync(file.fileno())
+        self.fsync_ms.record((time.perf_counter() - start) * 1000)
+
+    def sync(self) -> None:
+        # fsync outside the lock, appends never wait for the disk
+        with self.lock:
+            files = self.retired + ([self.file] if self.dirty else [])
+            self.retired = []
+            self.dirty = False
+            current = self.file
+        for file in files:
+            self._sync(file)
+            if file is not current:
+                file.close()
+
+    def _sync_periodically(self) -> None:
+        while not self.closed:
+            time.sleep(self.fsync_interval_s)
+            if not self.closed:
+                self.sync()
+
+    def rotate(self) -> str:
+        """Start the next generation, returns the path of the completed one."""
+        with self.lock:
+            completed = self.path(self.generation)
+            self.retired.append(self.file)
+            self.generation += 1
+            self.file = self._open(self.generation)
+        return completed
+
+    def close(self) -> None:
+        self.closed = True
+        self.syncer.join()
+        with self.lock:
+            self.retired.append(self.file)
+            self.dirty = False
+        self.sync()
+        # sync() leaves the current generation open
+        self.file.close()
+        if os.path.getsize(self.path(self.generation)) == 0:
+            os.remove(self.path(self.generation))
+
+
+def read_wal(path: str) -> Iterator[Tuple[int, tuple]]:
+    """Yield (op, values) records, stopping at a torn or corrupt tail."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        op, length, crc = HEADER.unpack_from(data, offset)
+        payload = data[offset + HEADER.size:offset + HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            log.warning(f"{path} ends in a partial record after {offset} bytes")
+            return
+        offset += HEADER.size + length
+        if op == OP_OHLC:
+            yield op, OHLC.unpack(payload)
+        elif op == OP_AGG_TRADE:
+            yield op, AGG_TRADE.unpack(payload)
+        elif op == OP_TRADE:
+            yield op, TRADE.unpack(payload)
+        elif op == OP_DEPTH:
+            event_time, n_bids, n_asks = DEPTH.unpack_from(payload)
+            levels = np.frombuffer(payload, dtype=np.float64, offset=DEPTH.size)
+            yield op, (event_time, levels[:2 * n_bids].reshape(-1, 2),
+                       levels[2 * n_bids:].reshape(-1, 2))
+        elif op == OP_LEVELS:
+            target, event_time, update_id, side, n = LEVELS.unpack_from(payload)
+            levels = np.frombuffer(payload, dtype=np.float64, offset=LEVELS.size)
+            yield op, (target, event_time, update_id, side, levels.reshape(-1, 2))
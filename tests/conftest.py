@@ -0,0 +1,27 @@
+import os
+
+import pytest
+import yaml
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                           "binance_data_saver", "config.yaml")
+
+
+@pytest.fixture
+def config(tmp_path):
+    """config.yaml with everything that reaches the network or the repo turned off."""
+    with open(CONFIG_PATH, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config.update(
+        save_dir=str(tmp_path / "data"),
+        spill_dir=str(tmp_path / "spill"),
+        wal_dir=str(tmp_path / "wal"),
+        s3_bucket="",
+        tick_size=0.01,
+        step_size=0.0001,
+        metrics_port=None,
+        metrics_log_interval_s=0,
+        validation_interval_s=0,
+        should_plot_depth=False,
+    )
+    return config
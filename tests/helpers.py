@@ -0,0 +1,34 @@
+"""Event streams shared by the saver tests."""
+import json
+
+import numpy as np
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.orderbook import make_orderbook
+
+
+def market_events(seed, n_seconds, config):
+    """(event time, callback name, message) of klines, aggTrades and depth updates in time order."""
+    market = SyntheticMarket(seed=seed, book_size=200)
+    snapshot = market.snapshot()
+    book = make_orderbook(config, config["tick_size"])
+    book.load_snapshot(np.array(snapshot["bids"], dtype=float).reshape(-1, 2),
+                       np.array(snapshot["asks"], dtype=float).reshape(-1, 2))
+    events = [(kline["E"], "ohlc_cb", kline) for kline in market.klines(n_seconds)]
+    events += [(trade["E"], "agg_trades_cb", trade)
+               for trade in market.agg_trades(5 * n_seconds)]
+    for message in market.depth_diffs(10 * n_seconds):
+        diff = json.loads(message)
+        changed = book.apply_diff(np.array(diff["b"], dtype=float).reshape(-1, 2),
+                                  np.array(diff["a"], dtype=float).reshape(-1, 2))
+        top_bids, top_asks = book.top_k(config["n_depth_pairs"])
+        events.append((diff["E"], "depth_cb",
+                       {"E": diff["E"], "top_bids": top_bids, "top_asks": top_asks,
+                        "changed": changed}))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def feed(saver, events):
+    for _, callback, message in events:
+        getattr(saver, callback)(message)
@@ -0,0 +1,102 @@
+import pytest
+
+from binance_data_saver import aligner as aligner_module
+from binance_data_saver.aligner import EventTimeAligner
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(aligner_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def aligner(clock):
+    batches = []
+    # the thread never steps on its own, the tests call step()
+    aligner = EventTimeAligner(["kline", "aggTrade"], batches.append, lateness_ms=100,
+                               interval_ms=10_000_000, idle_ms=5000)
+    aligner.batches = batches
+    yield aligner
+    aligner.close()
+
+
+def times(batch):
+    return [(stream, event_time) for event_time, stream, _ in batch]
+
+
+def test_events_are_emitted_in_event_time_order(aligner):
+    for event_time in (1000, 1300, 1200):
+        aligner.push("aggTrade", event_time, None)
+    aligner.push("kline", 1100, None)
+    # watermark: min(1300, 1100) - 100
+    assert aligner.step() == 1
+    assert times(aligner.batches[0]) == [("aggTrade", 1000)]
+    aligner.push("kline", 1500, None)
+    # watermark: min(1300, 1500) - 100
+    assert aligner.step() == 2
+    assert times(aligner.batches[1]) == [("kline", 1100), ("aggTrade", 1200)]
+    assert aligner.n_pending == 2 and aligner.n_late == 0
+
+
+def test_late_events_go_into_the_next_batch(aligner):
+    aligner.push("aggTrade", 1500, None)
+    aligner.push("aggTrade", 2000, None)
+    aligner.push("kline", 2000, None)
+    assert aligner.step() == 1
+    assert aligner.watermark == 1900
+    # below the emitted watermark: counted and emitted with the next batch, not dropped
+    aligner.push("kline", 1850, None)
+    assert aligner.step() == 1
+    assert times(aligner.batches[-1]) == [("kline", 1850)]
+    assert aligner.n_late == 1
+    assert aligner.n_emitted == 2
+
+
+def test_an_idle_stream_stops_holding_the_watermark(aligner, clock):
+    aligner.push("kline", 1000, None)
+    aligner.push("aggTrade", 1000, None)
+    assert aligner.step() == 0
+    clock.now += 1
+    for event_time in (2000, 3000):
+        aligner.push("aggTrade", event_time, None)
+    # the kline stream is active and still at 1000
+    assert aligner.step() == 0
+    clock.now += 5
+    aligner.push("aggTrade", 4000, None)
+    # 6 s without a kline, only aggTrade holds the watermark
+    assert aligner.step() == 4
+    assert times(aligner.batches[-1]) == [("kline", 1000), ("aggTrade", 1000),
+                                          ("aggTrade", 2000), ("aggTrade", 3000)]
+    assert aligner.watermark == 3900
+
+
+def test_everything_idle_releases_the_pending_events(aligner, clock):
+    aligner.push("kline", 1000, None)
+    aligner.push("aggTrade", 1050, None)
+    assert aligner.step() == 0
+    clock.now += 10
+    # nothing more is expected, the last events are not held until new data arrives
+    assert aligner.step() == 2
+    assert aligner.watermark == 1050
+
+
+def test_close_flushes_what_is_pending(clock):
+    batches = []
+    aligner = EventTimeAligner(["kline", "aggTrade"], batches.extend, lateness_ms=100,
+                               interval_ms=10_000_000)
+    aligner.push("kline", 1000, "a")
+    aligner.push("aggTrade", 990, "b")
+    aligner.push("aggTrade", 1010, "c")
+    aligner.close()
+    assert [event for _, _, event in batches] == ["b", "a", "c"]
+    assert aligner.n_pending == 0 and not aligner.thread.is_alive()
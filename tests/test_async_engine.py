@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.manage_ws_depth import SYNC_STATE_LIVE
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from binance_data_saver.async_engine import AsyncIngestionEngine  # noqa: E402
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.klines, self.trades, self.depths = [], [], []
+
+    def ohlc_cb(self, data):
+        self.klines.append(data)
+
+    def agg_trades_cb(self, data):
+        self.trades.append(data)
+
+    def depth_cb(self, data):
+        self.depths.append(data)
+
+
+class FakeBinance:
+    """Combined stream and REST endpoints of one symbol, served by aiohttp.web on localhost."""
+
+    def __init__(self, market: SyntheticMarket):
+        self.market = market
+        self.early = market.depth_diffs(5)
+        self.snapshot = market.snapshot()
+        self.late = market.depth_diffs(20)
+        self.depth_requests = []
+        self.engine = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/stream", self.stream)
+        app.router.add_get("/api/v3/depth", self.depth)
+        app.router.add_get("/api/v3/exchangeInfo", self.exchange_info)
+        return app
+
+    async def depth(self, request):
+        self.depth_requests.append(dict(request.query))
+        if len(self.depth_requests) == 1:
+            # the first request is rate limited, the engine backs off and retries
+            return web.json_response({"code": -1003, "msg": "Too many requests"}, status=429)
+        return web.json_response(self.snapshot)
+
+    async def exchange_info(self, request):
+        return web.json_response({"symbols": [{"symbol": "ETHUSDT", "filters": [
+            {"filterType": "PRICE_FILTER", "tickSize": "0.01000000"},
+            {"filterType": "LOT_SIZE", "stepSize": "0.00010000"},
+        ]}]})
+
+    async def stream(self, request):
+        streams = request.query["streams"].split("/")
+        assert streams == ["ethusdt@kline_1s", "ethusdt@aggTrade", "ethusdt@depth@100ms"]
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        for kline in self.market.klines(3):
+            await ws.send_str(json.dumps({"stream": streams[0], "data": kline}))
+        for trade in self.market.agg_trades(4):
+            await ws.send_str(json.dumps({"stream": streams[1], "data": trade}))
+        for diff in self.early:
+            await ws.send_str(json.dumps({"stream": streams[2], "data": json.loads(diff)}))
+        # let the resync complete on the engine's loop before the rest arrives
+        for _ in range(500):
+            if self.engine.depth_cache_manager.state == SYNC_STATE_LIVE:
+                break
+            await asyncio.sleep(0.01)
+        for diff in self.late:
+            await ws.send_str(json.dumps({"stream": streams[2], "data": json.loads(diff)}))
+        await ws.close()
+        return ws
+
+
+async def run_against(fake: FakeBinance, config) -> AsyncIngestionEngine:
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    config = dict(config, ws_base_url=f"ws://127.0.0.1:{port}",
+                  rest_base_url=f"http://127.0.0.1:{port}")
+    fake.engine = AsyncIngestionEngine("ETHUSDT", config, RecordingHandler())
+    try:
+        await asyncio.wait_for(fake.engine.run(max_reconnects=0), timeout=30)
+    finally:
+        await runner.cleanup()
+    return fake.engine
+
+
+def test_combined_stream_and_resync_over_http(config):
+    config = dict(config, tick_size=None, orderbook_engine="tick_ladder", depth_update_rate=100,
+                  resync_backoff_s=0.01)
+    fake = FakeBinance(SyntheticMarket(seed=7, book_size=200))
+    engine = asyncio.run(run_against(fake, config))
+    handler = engine.data_handler
+    assert len(handler.klines) == 3 and len(handler.trades) == 4
+    manager = engine.depth_cache_manager
+    assert manager.orderbook.tick_size == 0.01
+    assert len(fake.depth_requests) == 2
+    assert fake.depth_requests[-1]["symbol"] == "ETHUSDT"
+    assert manager.sync_stats["failed_snapshots"] == 1
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.last_update_id == json.loads(fake.late[-1])["u"]
+    assert handler.depths
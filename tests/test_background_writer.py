@@ -0,0 +1,102 @@
+import os
+import threading
+
+import pyarrow as pa
+
+from binance_data_saver import background_writer
+from binance_data_saver.background_writer import BackgroundWriter, SpilledBatch
+
+
+class TableBatch:
+    def __init__(self, i, n_rows=1000):
+        self.table = pa.table({"i": pa.array([i] * n_rows, pa.int64())})
+        self.nbytes = self.table.nbytes
+        self.wal_path = f"wal-{i}"
+
+    def to_table(self):
+        return self.table
+
+
+class BlockedWriter:
+    """write_fn that holds the workers until released, so the queue fills up."""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.written = []
+        self.done = []
+
+    def write(self, kind, table):
+        self.released.wait()
+        self.written.append((kind, table.column("i")[0].as_py()))
+
+    def on_done(self, kind, batch):
+        self.done.append(batch)
+
+
+def spill_files(spill_dir):
+    return sorted(name for name in os.listdir(spill_dir) if name.endswith(".arrow"))
+
+
+def wait_for_spills(writer, n):
+    for _ in range(500):
+        if writer.metrics()["spilled_batches"] >= n:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"{writer.metrics()['spilled_batches']} of {n} batches spilled")
+
+
+def test_spills_off_the_submitting_thread_and_drains_in_order(tmp_path, monkeypatch):
+    spill_threads = []
+    spill = SpilledBatch.spill.__func__
+
+    def recording_spill(cls, path, table):
+        spill_threads.append(threading.current_thread().name)
+        return spill(cls, path, table)
+
+    monkeypatch.setattr(background_writer.SpilledBatch, "spill", classmethod(recording_spill))
+    sink = BlockedWriter()
+    spill_dir = str(tmp_path / "spill")
+    # room for two batches in memory
+    writer = BackgroundWriter(sink.write, memory_budget_bytes=2 * TableBatch(0).nbytes,
+                              spill_dir=spill_dir, on_done=sink.on_done)
+    for i in range(6):
+        writer.submit("rows", TableBatch(i))
+    wait_for_spills(writer, 4)
+    assert len(spill_files(spill_dir)) == 4
+    assert set(spill_threads) == {"parquet-writer-spill"}
+    sink.released.set()
+    writer.close()
+    assert sink.written == [("rows", i) for i in range(6)]
+    assert [batch.wal_path for batch in sink.done] == [f"wal-{i}" for i in range(6)]
+    assert sum(isinstance(batch, SpilledBatch) for batch in sink.done) == 4
+    metrics = writer.metrics()
+    assert metrics["spilled_batches"] == 4 and metrics["queued_bytes"] == 0
+    assert spill_files(spill_dir) == []
+
+
+def test_spilled_batches_are_drained_after_a_restart(tmp_path):
+    spill_dir = str(tmp_path / "spill")
+    budget = TableBatch(0).nbytes
+    stuck = BlockedWriter()
+    crashed = BackgroundWriter(stuck.write, memory_budget_bytes=budget, spill_dir=spill_dir)
+    for i in range(4):
+        crashed.submit("trades", TableBatch(i))
+    wait_for_spills(crashed, 3)
+    # the process dies with the first batch in memory and three on disk
+
+    restarted_sink = BlockedWriter()
+    restarted_sink.released.set()
+    restarted = BackgroundWriter(restarted_sink.write, memory_budget_bytes=budget,
+                                 spill_dir=spill_dir)
+    restarted.submit("trades", TableBatch(4))
+    restarted.close()
+    assert restarted_sink.written == [("trades", i) for i in (1, 2, 3, 4)]
+    assert spill_files(spill_dir) == []
+
+    # with a write-ahead log to rebuild them from, spilled files are dropped instead
+    for i in range(2):
+        SpilledBatch.spill(os.path.join(spill_dir, f"0000000{i}.rows.arrow"), TableBatch(i).table)
+    BackgroundWriter(restarted_sink.write, memory_budget_bytes=budget, spill_dir=spill_dir,
+                     requeue_spilled=False).close()
+    assert spill_files(spill_dir) == []
+    assert restarted_sink.written[-1] == ("trades", 4)
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from binance_data_saver.compact import compact, drop_duplicates, merge_sorted
+from binance_data_saver.reader import DataReader
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.schema import CompactSchema
+
+
+def rows(times, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.asarray(times, dtype=np.float64)
+    return pa.table({
+        TIME_COLUMN: times,
+        "c": np.round(2000 + rng.integers(-500, 500, len(times)) * 0.01, 2),
+        "v": np.round(rng.integers(1, 10000, len(times)) * 0.0001, 4),
+    })
+
+
+def write_overlapping(directory, n_files=11, n_rows=300, seed=15):
+    """Files covering overlapping time ranges, each in arrival (not time) order."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths, tables = [], []
+    for i in range(n_files):
+        times = 100 * i + rng.choice(2000, n_rows, replace=False)
+        table = rows(times, seed=seed + i)
+        path = os.path.join(directory, f"data_{i + 1}.parquet")
+        pq.write_table(table, path, row_group_size=64)
+        paths.append(path)
+        tables.append(table)
+    return paths, pa.concat_tables(tables)
+
+
+def assert_same_rows(actual, expected):
+    key = [(TIME_COLUMN, "ascending"), ("c", "ascending"), ("v", "ascending")]
+    assert actual.sort_by(key).equals(expected.sort_by(key))
+
+
+@pytest.mark.parametrize("max_open_files", [64, 3])
+def test_merge_sorted_orders_overlapping_unsorted_files(tmp_path, max_open_files):
+    paths, expected = write_overlapping(str(tmp_path / "source"))
+    schema = expected.schema
+    tmp_dir = str(tmp_path / "runs")
+    os.makedirs(tmp_dir)
+    tables = list(merge_sorted(paths, schema, batch_rows=50, max_open_files=max_open_files,
+                               tmp_dir=tmp_dir))
+    merged = pa.concat_tables(tables)
+    times = merged.column(TIME_COLUMN).to_numpy()
+    assert (np.diff(times) >= 0).all()
+    assert_same_rows(merged, expected)
+    # intermediate runs are removed
+    assert os.listdir(tmp_dir) == []
+
+
+def test_drop_duplicates_keeps_distinct_rows_of_a_millisecond():
+    table = pa.table({
+        TIME_COLUMN: [1.0, 1.0, 1.0, 2.0, 2.0, 3.0],
+        "c": [10.0, 10.0, 11.0, np.nan, np.nan, 10.0],
+        "symbol": ["a", "a", "a", "b", "b", None],
+    })
+    deduped = drop_duplicates(table)
+    assert deduped.column("c").to_pylist()[:2] == [10.0, 11.0]
+    assert deduped.num_rows == 4
+    # rows differing only in a string column stay
+    table = pa.table({TIME_COLUMN: [1.0, 1.0], "symbol": ["a", "b"]})
+    assert drop_duplicates(table).num_rows == 2
+
+
+def test_compact_merges_dedupes_and_decodes_mixed_mappings(tmp_path):
+    source = tmp_path / "source" / "symbol=ETHUSDT"
+    paths, expected = write_overlapping(str(source), n_files=6)
+    # a WAL replay wrote the rows of a flush twice
+    pq.write_table(pq.read_table(paths[2]), str(source / "data_7.parquet"))
+    # the later files were written with the compact schema
+    encoder = CompactSchema(0.01, 0.0001)
+    for path in paths[4:]:
+        pq.write_table(encoder.encode(pq.read_table(path)), path)
+    dest = str(tmp_path / "dest")
+    # 24 byte rows: row groups of 250 rows, files of 500
+    written = compact(str(tmp_path / "source"), dest, row_group_bytes=24 * 250,
+                      file_bytes=24 * 500, merge_bytes=64 * 1024, max_open_files=2,
+                      tmp_dir=str(tmp_path))
+    assert len(written["ETHUSDT/rows"]) > 1
+    # mixed mappings are written decoded
+    assert pq.read_schema(written["ETHUSDT/rows"][0]).field("c").type == pa.float64()
+    actual = DataReader(dest).read("ETHUSDT")
+    assert (np.diff(actual.column(TIME_COLUMN).to_numpy()) >= 0).all()
+    assert_same_rows(actual.select(expected.column_names), expected)
+
+
+def test_compact_keeps_a_single_mapping_encoded(tmp_path):
+    source = tmp_path / "source" / "symbol=ETHUSDT"
+    paths, expected = write_overlapping(str(source), n_files=3)
+    encoder = CompactSchema(0.01, 0.0001)
+    for path in paths:
+        pq.write_table(encoder.encode(pq.read_table(path)), path)
+    dest = str(tmp_path / "dest")
+    written = compact(str(tmp_path / "source"), dest)
+    assert pq.read_schema(written["ETHUSDT/rows"][0]).field("c").type == pa.int64()
+    actual = DataReader(dest).read("ETHUSDT")
+    assert_same_rows(actual.select(expected.column_names).cast(expected.schema), expected)
+    with pytest.raises(ValueError):
+        compact(dest, dest)
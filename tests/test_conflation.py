@@ -0,0 +1,56 @@
+import pytest
+
+from binance_data_saver.conflation import DepthConflator
+
+
+def conflate(mode, interval_ms, updates, flush=True):
+    emitted = []
+    conflator = DepthConflator(mode, interval_ms, lambda t, depth: emitted.append((t, depth)))
+    for event_time, depth in updates:
+        conflator.push(event_time, depth)
+    if flush:
+        conflator.flush()
+    return emitted, conflator
+
+
+def test_every_change_emits_every_update():
+    updates = [(0, "A"), (10, "B"), (20, "C")]
+    emitted, conflator = conflate("every_change", 100, updates)
+    assert emitted == updates
+    assert conflator.metrics()["updates_per_row"] == 1.0
+
+
+def test_interval_emits_the_held_book_before_the_next_one():
+    emitted, conflator = conflate("interval", 1000, [(0, "A"), (50, "B"), (5000, "C")],
+                                  flush=False)
+    # B was the book from 50 ms until C, it is not lost
+    assert emitted == [(0, "A"), (1000, "B"), (5000, "C")]
+    assert conflator.n_updates == 3
+
+
+def test_interval_keeps_the_latest_book_and_the_rate():
+    updates = [(t, f"book{t}") for t in range(0, 3000, 100)]
+    emitted, conflator = conflate("interval", 1000, updates, flush=False)
+    times = [t for t, _ in emitted]
+    assert all(b - a >= 1000 for a, b in zip(times, times[1:]))
+    # every emitted book is the latest one at its time
+    for t, depth in emitted:
+        assert depth == f"book{max(u for u, _ in updates if u <= t)}"
+    conflator.flush()
+    assert emitted[-1][1] == "book2900"
+    assert conflator.updates_per_row.count == conflator.n_emitted
+
+
+def test_kline_aligned_emits_the_book_as_of_each_tick():
+    updates = [(999_400, "A"), (999_900, "B"), (1_000_000, "C"), (1_000_300, "D"),
+               (1_002_500, "E")]
+    emitted, conflator = conflate("kline_aligned", 1000, updates)
+    assert emitted == [(1_000_000, "C"), (1_001_000, "D"), (1_003_000, "E")]
+    assert conflator.n_emitted == 3
+
+
+def test_invalid_settings():
+    with pytest.raises(AssertionError):
+        DepthConflator("sometimes", 100, print)
+    with pytest.raises(AssertionError):
+        DepthConflator("kline_aligned", 300, print)
@@ -0,0 +1,77 @@
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from binance_data_saver.dataset_writer import HOUR_MS, RollingDatasetWriter
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.row_buffer import TIME_COLUMN
+
+START = 1_700_000_000_000 // HOUR_MS * HOUR_MS
+
+
+def rows(times):
+    times = np.asarray(times, dtype=np.int64)
+    return pa.table({TIME_COLUMN: times, "c": times.astype(np.float64)})
+
+
+def new_writer(tmp_path, **kwargs):
+    closed = []
+    writer = RollingDatasetWriter(str(tmp_path), "ethusdt", "ZSTD",
+                                  on_file_closed=lambda path, info: closed.append((path, info)),
+                                  **kwargs)
+    return writer, closed
+
+
+def test_rows_split_into_hour_partitions(tmp_path):
+    writer, closed = new_writer(tmp_path)
+    writer.write("rows", rows([START + 1, START + HOUR_MS - 1, START + HOUR_MS + 5]))
+    writer.write("rows", rows([START + 2]))
+    assert len(writer.open_paths()) == 2 and closed == []
+    writer.close()
+    assert writer.open_paths() == set()
+    by_hour = {info["min_time"] // HOUR_MS: (path, info) for path, info in closed}
+    path, info = by_hour[START // HOUR_MS]
+    assert "/rows/symbol=ETHUSDT/date=2023-11-14/hour=22/" in path
+    assert (info["rows"], info["row_groups"]) == (3, 2)
+    assert (info["min_time"], info["max_time"]) == (START + 1, START + HOUR_MS - 1)
+    # one row group per write, rows in written order
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+    assert pq.read_table(path).column(TIME_COLUMN).to_pylist() == \
+        [START + 1, START + HOUR_MS - 1, START + 2]
+    assert by_hour[START // HOUR_MS + 1][1]["rows"] == 1
+
+
+def test_files_roll_past_roll_max_bytes(tmp_path):
+    writer, closed = new_writer(tmp_path, roll_max_bytes=1)
+    for i in range(3):
+        writer.write("rows", rows([START + i]))
+    # every write rolls its file, nothing stays open
+    assert len(closed) == 3 and writer.open_paths() == set()
+    assert all(pq.read_table(path).num_rows == 1 for path, _ in closed)
+
+
+def test_open_partitions_stay_bounded_with_late_rows(tmp_path):
+    writer, closed = new_writer(tmp_path, max_open_partitions=2)
+    for hour in (5, 6):
+        writer.write("rows", rows([START + hour * HOUR_MS]))
+    # late rows reopen hour 4, the oldest other hour is closed to make room
+    writer.write("rows", rows([START + 4 * HOUR_MS]))
+    assert len(writer.open_paths()) == 2
+    assert [info["min_time"] for _, info in closed] == [START + 5 * HOUR_MS]
+    # partitions of another kind have their own bound
+    writer.write("trades", rows([START]))
+    assert len(writer.open_paths()) == 3
+    writer.close()
+    assert len(closed) == 4
+
+
+def test_saver_warns_without_the_wal(config, caplog):
+    with caplog.at_level(logging.WARNING):
+        ParquetSaver(dict(config, output_layout="dataset")).close()
+    assert "roll_max_seconds" in caplog.text
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        ParquetSaver(dict(config, output_layout="dataset", wal_enabled=True)).close()
+    assert "roll_max_seconds" not in caplog.text
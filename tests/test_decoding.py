@@ -0,0 +1,92 @@
+import importlib.util
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from binance_data_saver import decoding
+
+KLINE = {
+    "e": "kline", "E": 1700000000123, "s": "ETHUSDT",
+    "k": {"t": 1700000000000, "T": 1700000059999, "s": "ETHUSDT", "i": "1m",
+          "f": 100, "L": 200, "o": "2071.37", "c": "2072.01", "h": "2073.50",
+          "l": "2070.00", "v": "12.3456", "n": 101, "x": False},
+}
+AGG_TRADE = {
+    "e": "aggTrade", "E": 1700000000456, "s": "ETHUSDT", "a": 555, "p": "2071.38",
+    "q": "0.0125", "f": 1000, "l": 1002, "T": 1700000000450, "m": True, "M": True,
+}
+DEPTH_DIFF = {
+    "e": "depthUpdate", "E": 1700000000789, "s": "ETHUSDT", "U": 157, "u": 160,
+    "b": [["2071.37", "1.5"], ["2071.36", "0"]],
+    "a": [["2071.38", "0.25"]],
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def decoder(request, monkeypatch):
+    if request.param == "orjson":
+        module = decoding
+    else:
+        # a separate copy, reloading decoding itself would swap the record
+        # classes under the modules that imported them
+        monkeypatch.setitem(sys.modules, "orjson", None)
+        spec = importlib.util.spec_from_file_location("decoding_without_orjson", decoding.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    assert module.loads.__module__ == request.param
+    return module
+
+
+@pytest.mark.parametrize("encode", [json.dumps, lambda d: json.dumps(d).encode(), lambda d: d])
+def test_decode_kline(decoder, encode):
+    kline = decoder.decode_kline(encode(KLINE))
+    assert kline == (1700000000123, 2071.37, 2073.5, 2070.0, 2072.01, 12.3456,
+                     1700000000000, 1700000059999, 100, 200)
+    assert type(kline.open) is float and type(kline.first_trade_id) is int
+
+
+@pytest.mark.parametrize("encode", [json.dumps, lambda d: json.dumps(d).encode(), lambda d: d])
+def test_decode_agg_trade(decoder, encode):
+    trade = decoder.decode_agg_trade(encode(AGG_TRADE))
+    assert trade == (1700000000456, 2071.38, 0.0125, 1, 1000, 1002, 555, 1700000000450)
+    # the buyer is the maker, a sell
+    assert trade.is_buyer_maker == 1
+    # a and T are optional, the older payloads lack them
+    legacy = {k: v for k, v in AGG_TRADE.items() if k not in ("a", "T")}
+    legacy["m"] = False
+    trade = decoder.decode_agg_trade(encode(legacy))
+    assert (trade.is_buyer_maker, trade.agg_trade_id, trade.trade_time) == (0, 0, 0)
+
+
+@pytest.mark.parametrize("encode", [json.dumps, lambda d: json.dumps(d).encode(), lambda d: d])
+def test_decode_depth_diff(decoder, encode):
+    diff = decoder.decode_depth_diff(encode(DEPTH_DIFF))
+    assert (diff.event_time, diff.first_update_id, diff.final_update_id) == (1700000000789, 157, 160)
+    np.testing.assert_array_equal(diff.bids, [[2071.37, 1.5], [2071.36, 0.0]])
+    np.testing.assert_array_equal(diff.asks, [[2071.38, 0.25]])
+    assert diff.bids.dtype == np.float64 and diff.bids.flags.c_contiguous
+
+
+def test_parse_levels_empty_and_numeric():
+    assert decoding.parse_levels([]).shape == (0, 2)
+    np.testing.assert_array_equal(decoding.parse_levels([[1, 2], ["3.5", "4"]]), [[1, 2], [3.5, 4]])
+
+
+def test_exchange_info_filters(decoder):
+    info = json.dumps({"symbols": [{"symbol": "ETHUSDT", "filters": [
+        {"filterType": "PRICE_FILTER", "tickSize": "0.01000000"},
+        {"filterType": "LOT_SIZE", "stepSize": "0.00010000"},
+    ]}]})
+    assert decoder.tick_size_from_exchange_info(info) == 0.01
+    assert decoder.step_size_from_exchange_info(info) == 0.0001
+
+
+def test_check_depth_snapshot():
+    snapshot = {"lastUpdateId": 1, "bids": [], "asks": []}
+    assert decoding.check_depth_snapshot(snapshot) is snapshot
+    with pytest.raises(ValueError, match="-1003"):
+        decoding.check_depth_snapshot({"code": -1003, "msg": "Too many requests"})
+    with pytest.raises(ValueError):
+        decoding.check_depth_snapshot(None)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.depth_delta import DepthReconstructor
+from binance_data_saver.manage_ws_depth import DepthCacheManager
+from binance_data_saver.orderbook import make_orderbook
+from binance_data_saver.parquet_saver import ParquetSaver
+
+N_LEVELS = 10
+
+
+def collect(config, symbol, seed, n_diffs):
+    """Feed a synthetic book through a delta storage saver, returns the live tops by time."""
+    market = SyntheticMarket(seed=seed, book_size=300)
+    saver = ParquetSaver(config, symbol=symbol)
+    manager = DepthCacheManager(config, should_plot=False)
+    manager.initialize_params(symbol.lower())
+    manager.orderbook = make_orderbook(config, market.tick_size)
+    tops = {}
+
+    def on_update(data):
+        tops[int(data["E"])] = tuple(side[:N_LEVELS].copy() for side in
+                                     data["book"].levels(N_LEVELS))
+        saver.depth_cb(data)
+
+    manager.update_callback = on_update
+    manager.complete_resync(market.snapshot())
+    for message in market.depth_diffs(n_diffs):
+        manager.on_message(None, message)
+    saver.close()
+    return tops
+
+
+@pytest.fixture
+def delta_config(config):
+    return dict(config, depth_storage="delta", depth_checkpoint_interval_s=1,
+                depth_changes_per_write=2000)
+
+
+def test_books_are_rebuilt_per_symbol(delta_config):
+    eth = collect(delta_config, "ETHUSDT", 1, 300)
+    # same event times, other prices: mixing the symbols would break the books
+    collect(delta_config, "BTCUSDT", 2, 300)
+    reconstructor = DepthReconstructor.from_dir(delta_config["save_dir"], "ETHUSDT", N_LEVELS)
+    for event_time in list(eth)[::17]:
+        bids, asks = reconstructor.book_at(event_time)
+        np.testing.assert_array_equal(bids, eth[event_time][0])
+        np.testing.assert_array_equal(asks, eth[event_time][1])
+
+
+def test_books_between_matches_book_at(delta_config):
+    eth = collect(delta_config, "ETHUSDT", 3, 400)
+    times = sorted(eth)
+    start_time, end_time = times[150], times[320]
+    reconstructor = DepthReconstructor.from_dir(delta_config["save_dir"], "ETHUSDT",
+                                                N_LEVELS, start_time, end_time)
+    # only the files from the last checkpoint before start_time are read
+    assert reconstructor.checkpoint_times[0] <= start_time
+    assert reconstructor.checkpoint_times[0] > times[0]
+    sampled, bids, asks = reconstructor.books_between(start_time, end_time, step_ms=30)
+    for i, event_time in enumerate(sampled.tolist()):
+        live_time = max(t for t in times if t <= event_time)
+        expected_bids, expected_asks = eth[live_time]
+        np.testing.assert_array_equal(bids[i, :len(expected_bids)], expected_bids)
+        np.testing.assert_array_equal(asks[i, :len(expected_asks)], expected_asks)
+        book_bids, book_asks = reconstructor.book_at(event_time)
+        np.testing.assert_array_equal(bids[i, :len(book_bids)], book_bids)
+    event_times, _, _ = reconstructor.books_between(start_time, end_time)
+    assert event_times.tolist() == [t for t in times if start_time <= t <= end_time]
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from binance_data_saver.features import FeatureStage
+from binance_data_saver.row_buffer import TIME_COLUMN, ColumnarRowBuffer
+
+T0 = 1_700_000_000_000
+
+
+@pytest.fixture
+def config(config):
+    return dict(config, n_depth_pairs=5, feature_imbalance_levels=2, bar_intervals_ms=[100, 1000])
+
+
+def new_buffer(config, n_rows=1000):
+    return ColumnarRowBuffer(config, n_rows)
+
+
+def book(bid, bid_qty, ask, ask_qty):
+    return [[bid, bid_qty], [bid - 0.01, 1.0]], [[ask, ask_qty], [ask + 0.01, 1.0]]
+
+
+def test_bars_match_a_pandas_groupby_across_flushes(config):
+    rng = np.random.default_rng(14)
+    times = T0 + np.sort(rng.choice(4500, 600, replace=False))
+    trades = pd.DataFrame({
+        "time": times,
+        "price": np.round(100 + rng.normal(0, 0.1, len(times)), 2),
+        "quantity": np.round(rng.exponential(1.0, len(times)), 4) + 0.0001,
+        "is_market_maker": rng.integers(0, 2, len(times)),
+    })
+    stage = FeatureStage(config)
+    bars = []
+    # flushes cut through the middle of open bars
+    cuts = [0, 137, 290, 451, len(trades)]
+    chunks = [trades.iloc[start:end] for start, end in zip(cuts, cuts[1:])]
+    for i, chunk in enumerate(chunks):
+        row_buffer = new_buffer(config)
+        for trade in chunk.itertuples():
+            row_buffer.add_agg_trade(trade.time, trade.price, trade.quantity,
+                                     trade.is_market_maker, 0, 0)
+        batch = stage.process(row_buffer, final=i == len(chunks) - 1)
+        if batch is not None:
+            bars.append(batch.to_table())
+    bars = pa.concat_tables(bars).to_pandas()
+
+    trades["sign"] = np.where(trades["is_market_maker"] == 1, -1.0, 1.0)
+    trades["notional"] = trades["price"] * trades["quantity"]
+    trades["signed"] = trades["sign"] * trades["quantity"]
+    for interval in (100, 1000):
+        actual = bars[bars["interval_ms"] == interval].set_index(TIME_COLUMN).sort_index()
+        # every bar once, carried bars are not emitted twice
+        assert actual.index.is_unique
+        groups = trades.groupby(trades["time"] // interval * interval)
+        expected = pd.DataFrame({
+            "open": groups["price"].first(),
+            "high": groups["price"].max(),
+            "low": groups["price"].min(),
+            "close": groups["price"].last(),
+            "volume": groups["quantity"].sum(),
+            "vwap": groups["notional"].sum() / groups["quantity"].sum(),
+            "signed_volume": groups["signed"].sum(),
+        })
+        assert list(actual.index) == list(expected.index)
+        for name in expected.columns:
+            np.testing.assert_allclose(actual[name].to_numpy(), expected[name].to_numpy(),
+                                       rtol=1e-9, err_msg=f"{name} of {interval} ms bars")
+
+
+def test_depth_is_forward_filled_into_trade_rows_and_flushes(config):
+    stage = FeatureStage(config)
+    first = new_buffer(config)
+    first.set_depth(T0 + 1, *book(100.0, 1.0, 101.0, 3.0))
+    first.add_agg_trade(T0 + 2, 100.5, 1.0, 0, 0, 0)
+    stage.process(first)
+    features = first.extra_columns
+    np.testing.assert_array_equal(features["mid"], [100.5, 100.5])
+    np.testing.assert_array_equal(features["spread"], [1.0, 1.0])
+    # (bid * ask_qty + ask * bid_qty) / (bid_qty + ask_qty)
+    np.testing.assert_allclose(features["microprice"], [100.25, 100.25])
+    # top 2 levels: (1 + 1 - 3 - 1) / 6
+    np.testing.assert_allclose(features["imbalance_2"], [-1 / 3, -1 / 3])
+
+    # the next flush starts with a trade, it gets the last depth of the previous one
+    second = new_buffer(config)
+    second.add_agg_trade(T0 + 3, 100.5, 1.0, 0, 0, 0)
+    second.set_depth(T0 + 4, *book(100.0, 3.0, 100.5, 1.0))
+    stage.process(second)
+    features = second.extra_columns
+    np.testing.assert_allclose(features["mid"], [100.5, 100.25])
+    np.testing.assert_allclose(features["microprice"], [100.25, 100.375])
+    table = second.to_table()
+    assert table.column("mid").to_pylist() == [100.5, 100.25]
+
+
+def test_rows_before_any_depth_have_no_book_features(config):
+    row_buffer = new_buffer(config)
+    row_buffer.add_agg_trade(T0, 100.0, 1.0, 0, 0, 0)
+    row_buffer.set_depth(T0 + 1, *book(100.0, 1.0, 101.0, 1.0))
+    FeatureStage(config).process(row_buffer)
+    assert np.isnan(row_buffer.extra_columns["mid"][0])
+    assert row_buffer.extra_columns["mid"][1] == 100.5
+
+
+def test_ofi_signs_follow_the_book_pressure(config):
+    row_buffer = new_buffer(config)
+    row_buffer.set_depth(T0 + 1, *book(100.0, 1.0, 101.0, 1.0))
+    # more size on the same best bid: buying pressure
+    row_buffer.set_depth(T0 + 2, *book(100.0, 3.0, 101.0, 1.0))
+    # the ask steps down: selling pressure
+    row_buffer.set_depth(T0 + 3, *book(100.0, 3.0, 100.5, 2.0))
+    # the bid steps up, the ask is unchanged
+    row_buffer.set_depth(T0 + 4, *book(100.2, 1.0, 100.5, 2.0))
+    row_buffer.add_agg_trade(T0 + 5, 100.3, 1.0, 0, 0, 0)
+    FeatureStage(config).process(row_buffer)
+    # the first depth row has nothing to compare against, trade rows carry no OFI
+    np.testing.assert_array_equal(row_buffer.extra_columns["ofi"], [0.0, 2.0, -2.0, 1.0, 0.0])
+
+
+def test_signed_volume_follows_the_taker_side(config):
+    row_buffer = new_buffer(config)
+    # the buyer is the maker: a seller took liquidity
+    row_buffer.add_agg_trade(T0 + 1, 100.0, 2.0, 1, 0, 0)
+    row_buffer.add_agg_trade(T0 + 2, 100.0, 3.0, 0, 1, 1)
+    # both sides in one millisecond: merged row, side unknown
+    row_buffer.add_agg_trade(T0 + 3, 100.0, 1.0, 0, 2, 2)
+    row_buffer.add_agg_trade(T0 + 3, 100.0, 1.0, 1, 3, 3)
+    row_buffer.set_depth(T0 + 4, *book(100.0, 1.0, 101.0, 1.0))
+    bars = FeatureStage(config).process(row_buffer, final=True).to_table().to_pandas()
+    np.testing.assert_array_equal(row_buffer.extra_columns["signed_volume"],
+                                  [-2.0, 3.0, 0.0, 0.0])
+    second = bars[bars["interval_ms"] == 1000].iloc[0]
+    assert (second["buy_volume"], second["sell_volume"], second["signed_volume"]) == \
+        (3.0, 2.0, 1.0)
+    assert second["volume"] == 7.0
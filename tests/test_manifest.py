@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from binance_data_saver.manifest import Manifest, file_info
+from binance_data_saver.reader import DataReader
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.schema import CompactSchema
+
+
+def write_file(directory, name, times, symbol="ETHUSDT", kind="rows", row_group_size=None):
+    path = os.path.join(directory, name)
+    table = pa.table({TIME_COLUMN: pa.array(times, pa.int64()),
+                      "c": pa.array(np.arange(len(times)), pa.float64())})
+    pq.write_table(table, path, row_group_size=row_group_size)
+    Manifest(directory).add(path, file_info(path, kind, symbol))
+    return path
+
+
+def test_select_prunes_files_by_time_symbol_and_kind(tmp_path):
+    directory = str(tmp_path)
+    write_file(directory, "data_1.parquet", [100, 200])
+    write_file(directory, "data_2.parquet", [300, 400])
+    write_file(directory, "data_3.parquet", [500, 600])
+    write_file(directory, "btc_1.parquet", [300, 400], symbol="BTCUSDT")
+    write_file(directory, "bars_1.parquet", [300, 400], kind="bars")
+    manifest = Manifest(directory)
+    selected = manifest.select("ethusdt", "rows", 250, 450)
+    assert [os.path.basename(entry["path"]) for entry in selected] == ["data_2.parquet"]
+    assert len(manifest.select("ETHUSDT", "rows")) == 3
+    assert len(manifest.select("ETHUSDT", "rows", end_time=300)) == 2
+
+
+def test_select_keeps_files_without_time_bounds(tmp_path):
+    directory = str(tmp_path)
+    write_file(directory, "data_1.parquet", [100, 200])
+    write_file(directory, "data_2.parquet", [])
+    selected = Manifest(directory).select("ETHUSDT", "rows", 150, 180)
+    # an empty file is unbounded, and sorts first
+    assert [os.path.basename(entry["path"]) for entry in selected] == \
+        ["data_2.parquet", "data_1.parquet"]
+
+
+def test_reader_reads_the_time_range_in_order(tmp_path):
+    directory = str(tmp_path)
+    write_file(directory, "data_2.parquet", list(range(1000, 2000)), row_group_size=100)
+    write_file(directory, "data_1.parquet", list(range(0, 1000)), row_group_size=100)
+    reader = DataReader(directory)
+    table = reader.read("ETHUSDT", 950, 1049)
+    np.testing.assert_array_equal(table.column(TIME_COLUMN).to_numpy(), np.arange(950, 1050))
+    batches = list(reader.iter_batches("ETHUSDT", 950, 1049, columns=[TIME_COLUMN]))
+    times = np.concatenate([batch.column(0).to_numpy() for batch in batches])
+    np.testing.assert_array_equal(times, np.arange(950, 1050))
+    assert reader.read("ETHUSDT", 5000, 6000) is None
+
+
+@pytest.fixture
+def s3_endpoint(monkeypatch):
+    moto_server = pytest.importorskip("moto.server")
+    pytest.importorskip("s3fs")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        yield f"http://{host}:{port}"
+    finally:
+        server.stop()
+
+
+def upload(endpoint_url, local, key):
+    import s3fs
+    s3 = s3fs.S3FileSystem(endpoint_url=endpoint_url)
+    if not s3.exists("bucket"):
+        s3.mkdir("bucket")
+    s3.put_file(local, f"bucket/{key}")
+    return f"s3://bucket/{key}"
+
+
+def test_reader_uses_the_s3_endpoint(tmp_path, s3_endpoint):
+    local = write_file(str(tmp_path), "data_1.parquet", [1, 2, 3])
+    path = upload(s3_endpoint, local, "data_1.parquet")
+    directory = str(tmp_path / "index")
+    os.makedirs(directory)
+    Manifest(directory).add(path, file_info(local, "rows", "ETHUSDT"))
+    table = DataReader(directory, s3_endpoint_url=s3_endpoint).read("ETHUSDT", 2, 3)
+    assert table.column(TIME_COLUMN).to_pylist() == [2, 3]
+
+
+def test_reader_mixes_local_and_s3_files(tmp_path, s3_endpoint):
+    directory = str(tmp_path)
+    staged = str(tmp_path / "staged")
+    os.makedirs(staged)
+    uploaded = write_file(staged, "data_1.parquet", [1, 2, 3])
+    Manifest(directory).add(upload(s3_endpoint, uploaded, "data_1.parquet"),
+                            file_info(uploaded, "rows", "ETHUSDT"))
+    write_file(directory, "data_2.parquet", [4, 5])
+    reader = DataReader(directory, s3_endpoint_url=s3_endpoint)
+    assert reader.read("ETHUSDT", 2).column(TIME_COLUMN).to_pylist() == [2, 3, 4, 5]
+    batches = list(reader.iter_batches("ETHUSDT", 2))
+    assert [batch.column(0).to_pylist() for batch in batches] == [[2, 3], [4, 5]]
+
+
+def write_prices(directory, name, times, prices, tick_size=None):
+    path = os.path.join(directory, name)
+    table = pa.table({TIME_COLUMN: pa.array(times, pa.float64()),
+                      "c": pa.array(prices, pa.float64())})
+    if tick_size is not None:
+        table = CompactSchema(tick_size, 0.0001).encode(table)
+    pq.write_table(table, path)
+    Manifest(directory).add(path, file_info(path, "rows", "ETHUSDT"))
+
+
+def test_reader_decodes_each_column_mapping(tmp_path):
+    directory = str(tmp_path)
+    write_prices(directory, "data_1.parquet", [1, 2], [2071.37, 2071.38])
+    write_prices(directory, "data_2.parquet", [3, 4], [2071.39, 2071.4], tick_size=0.01)
+    write_prices(directory, "data_3.parquet", [5, 6], [2071.5, 2071.6], tick_size=0.1)
+    write_prices(directory, "data_4.parquet", [7], [2071.41], tick_size=0.01)
+    reader = DataReader(directory)
+    table = reader.read("ETHUSDT")
+    assert table.column(TIME_COLUMN).to_pylist() == [1, 2, 3, 4, 5, 6, 7]
+    assert table.column("c").to_pylist() == \
+        [2071.37, 2071.38, 2071.39, 2071.4, 2071.5, 2071.6, 2071.41]
+    # one file at a time
+    batches = list(reader.iter_batches("ETHUSDT", 5))
+    assert [batch.column("c").to_pylist() for batch in batches] == [[2071.5, 2071.6], [2071.41]]
+    # the compact files alone, encoded with one scale each
+    assert reader.read("ETHUSDT", 3, 4, decode=False).column("c").to_pylist() == [207139, 207140]
+    with pytest.raises(ValueError):
+        reader.read("ETHUSDT", decode=False)
@@ -0,0 +1,147 @@
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from binance_data_saver.metrics import (
+    LAST_BUCKET,
+    SUB_BUCKETS,
+    LogHistogram,
+    MetricsRegistry,
+    timed,
+)
+
+
+def test_buckets_cover_every_value():
+    values = np.concatenate([np.arange(1, 5000), np.geomspace(1, 2.0 ** 39, 20_000)])
+    for value in values:
+        idx = LogHistogram._index(value)
+        assert LogHistogram._upper_bound(idx - 1) <= value < LogHistogram._upper_bound(idx)
+        # a bucket is at most 1 / SUB_BUCKETS of its lower bound wide
+        width = LogHistogram._upper_bound(idx) - LogHistogram._upper_bound(idx - 1)
+        assert width <= LogHistogram._upper_bound(idx - 1) / SUB_BUCKETS
+    # powers of two start a new bucket
+    assert LogHistogram._index(1.0) == 1
+    assert LogHistogram._index(2.0) == SUB_BUCKETS + 1
+    assert LogHistogram._index(2.0) - LogHistogram._index(np.nextafter(2.0, 0)) == 1
+
+
+def test_small_negative_and_huge_values():
+    histogram = LogHistogram()
+    for value in (-5.0, 0.0, 0.25, 0.999):
+        histogram.record(value)
+    assert histogram.counts[0] == 4
+    assert histogram.total == pytest.approx(1.249)
+    histogram.record(2.0 ** 60)
+    assert histogram.counts[LAST_BUCKET] == 1
+    assert histogram.max == 2.0 ** 60
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_quantiles_within_a_bucket_of_numpy(seed):
+    rng = np.random.default_rng(seed)
+    values = 1 + rng.lognormal(mean=4, sigma=2, size=20_000)
+    histogram = LogHistogram()
+    for value in values:
+        histogram.record(value)
+    qs = (0.1, 0.5, 0.9, 0.99, 0.999, 1.0)
+    result = histogram.quantiles(qs)
+    for q in qs:
+        expected = np.quantile(values, q, method="inverted_cdf")
+        # the upper bound of the bucket holding the q-th value, capped at the max
+        assert expected <= result[q] <= expected * (1 + 1 / SUB_BUCKETS)
+    assert result[1.0] == values.max()
+    assert histogram.count == len(values)
+    assert histogram.total == pytest.approx(values.sum())
+
+
+def test_empty_quantiles():
+    assert LogHistogram().quantiles((0.5, 0.99)) == {0.5: 0.0, 0.99: 0.0}
+
+
+def test_concurrent_records_are_all_counted():
+    histogram = LogHistogram()
+
+    def run():
+        for value in range(1, 10_001):
+            histogram.record(value)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.count == sum(histogram.counts) == 40_000
+
+
+def test_timed_records_microseconds():
+    class Handler:
+        callback_us = {"cb": LogHistogram()}
+
+        @timed("cb")
+        def cb(self, data):
+            if data is None:
+                raise ValueError
+            return data * 2
+
+    handler = Handler()
+    assert handler.cb(21) == 42
+    with pytest.raises(ValueError):
+        handler.cb(None)
+    # failed calls are timed too
+    assert handler.callback_us["cb"].count == 2
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    histogram = LogHistogram()
+    for value in (1.0, 2.0, 3.0, 100.0):
+        histogram.record(value)
+    registry.add_histogram("lag_ms", "receive lag", histogram, symbol="ETHUSDT", stream="kline")
+    registry.add_histogram("lag_ms", "receive lag", LogHistogram(), symbol="ETHUSDT", stream="depth")
+    registry.add_gauge("queue_depth", "queued batches", lambda: 3, symbol="ETHUSDT")
+    registry.add_counter("bytes_total", "bytes written", lambda: 1024)
+    assert registry.render() == "\n".join([
+        "# HELP lag_ms receive lag",
+        "# TYPE lag_ms summary",
+        'lag_ms{symbol="ETHUSDT",stream="kline",quantile="0.5"} 2.125',
+        'lag_ms{symbol="ETHUSDT",stream="kline",quantile="0.9"} 100.0',
+        'lag_ms{symbol="ETHUSDT",stream="kline",quantile="0.99"} 100.0',
+        'lag_ms{symbol="ETHUSDT",stream="kline",quantile="0.999"} 100.0',
+        'lag_ms_sum{symbol="ETHUSDT",stream="kline"} 106.0',
+        'lag_ms_count{symbol="ETHUSDT",stream="kline"} 4',
+        'lag_ms{symbol="ETHUSDT",stream="depth",quantile="0.5"} 0.0',
+        'lag_ms{symbol="ETHUSDT",stream="depth",quantile="0.9"} 0.0',
+        'lag_ms{symbol="ETHUSDT",stream="depth",quantile="0.99"} 0.0',
+        'lag_ms{symbol="ETHUSDT",stream="depth",quantile="0.999"} 0.0',
+        'lag_ms_sum{symbol="ETHUSDT",stream="depth"} 0.0',
+        'lag_ms_count{symbol="ETHUSDT",stream="depth"} 0',
+        "# HELP queue_depth queued batches",
+        "# TYPE queue_depth gauge",
+        'queue_depth{symbol="ETHUSDT"} 3.0',
+        "# HELP bytes_total bytes written",
+        "# TYPE bytes_total counter",
+        "bytes_total 1024.0",
+    ]) + "\n"
+    # empty histograms are left out of the log line
+    assert registry.log_line() == ("lag_ms[ETHUSDT,kline] p50=2.12 p99=100 max=100 n=4 | "
+                                   "queue_depth[ETHUSDT]=3 | bytes_total[]=1024")
+
+
+def test_serve_metrics_endpoint():
+    registry = MetricsRegistry()
+    registry.add_counter("bytes_total", "bytes written", lambda: 7)
+    server = registry.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.orderbook import (
+    OrderBook,
+    SortedDictOrderBook,
+    TickLadderOrderBook,
+    make_orderbook,
+)
+
+
+def levels(side):
+    return np.array(side, dtype=np.float64).reshape(-1, 2)
+
+
+def both_books(k=20, **config):
+    config = dict(n_depth_pairs=k, **config)
+    return SortedDictOrderBook(config), TickLadderOrderBook(config, 0.01)
+
+
+def assert_same_tops(reference, ladder, k=None):
+    for expected, actual in zip(reference.top_k(k), ladder.top_k(k)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_tick_ladder_matches_sorted_dict_on_a_diff_stream():
+    market = SyntheticMarket(seed=8, book_size=300, levels_per_diff=30)
+    reference, ladder = both_books()
+    snapshot = market.snapshot()
+    for book in (reference, ladder):
+        book.load_snapshot(levels(snapshot["bids"]), levels(snapshot["asks"]))
+    assert_same_tops(reference, ladder)
+    for message in market.depth_diffs(500):
+        diff = json.loads(message)
+        bids, asks = levels(diff["b"]), levels(diff["a"])
+        assert ladder.apply_diff(bids, asks) == reference.apply_diff(bids, asks)
+        assert_same_tops(reference, ladder)
+    for expected, actual in zip(reference.levels(250), ladder.levels(250)):
+        np.testing.assert_array_equal(actual, expected)
+    # a different k recomputes the view
+    assert_same_tops(reference, ladder, k=5)
+
+
+def test_removed_levels_and_levels_behind_the_top():
+    reference, ladder = both_books(k=3)
+    bids = levels([[100.0, 1], [99.99, 2], [99.98, 3], [99.97, 4]])
+    asks = levels([[100.01, 1], [100.02, 2]])
+    for book in (reference, ladder):
+        book.load_snapshot(bids, asks)
+    # removals expose the next level
+    diff_bids, diff_asks = levels([[99.99, 0], [100.0, 5]]), levels([[100.01, 0]])
+    assert reference.apply_diff(diff_bids, diff_asks) and ladder.apply_diff(diff_bids, diff_asks)
+    np.testing.assert_array_equal(ladder.top_k()[0], [[100.0, 5], [99.98, 3], [99.97, 4]])
+    np.testing.assert_array_equal(ladder.top_k()[1], [[100.02, 2]])
+    assert_same_tops(reference, ladder)
+    # a change behind the k-th level leaves the view alone
+    assert not ladder.apply_diff(levels([[90.0, 1]]), levels([]))
+    assert not reference.apply_diff(levels([[90.0, 1]]), levels([]))
+    for expected, actual in zip(reference.levels(10), ladder.levels(10)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_tick_ladder_rounds_prices_to_the_tick():
+    _, ladder = both_books(k=3)
+    ladder.load_snapshot(levels([[0.1 + 0.2, 1]]), levels([[0.31, 1]]))
+    # float keys would hold 0.30000000000000004 and 0.3 as two levels
+    ladder.apply_diff(levels([[0.3, 2]]), levels([]))
+    np.testing.assert_array_equal(ladder.top_k()[0], [[0.3, 2]])
+
+
+def test_make_orderbook_engines():
+    assert isinstance(make_orderbook({}), SortedDictOrderBook)
+    assert isinstance(make_orderbook({"orderbook_engine": "tick_ladder"}, 0.01),
+                      TickLadderOrderBook)
+    with pytest.raises(AssertionError):
+        make_orderbook({"orderbook_engine": "tick_ladder"})
+    with pytest.raises(AssertionError):
+        make_orderbook({"orderbook_engine": "btree"})
+
+
+def test_engines_implement_the_abstract_methods():
+    with pytest.raises(TypeError):
+        OrderBook({})
+
+    class NoTop(OrderBook):
+        def clear(self):
+            pass
+
+        def _apply(self, bids, asks):
+            pass
+
+    with pytest.raises(TypeError, match="_compute_top"):
+        NoTop({})
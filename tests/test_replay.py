@@ -0,0 +1,91 @@
+import json
+import os
+
+import numpy as np
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.reader import DataReader
+from binance_data_saver.recorder import (
+    KIND_AGG_TRADE,
+    KIND_DEPTH,
+    KIND_KLINE,
+    KIND_SNAPSHOT,
+    RawMessageRecorder,
+    read_records,
+)
+from binance_data_saver.replay import replay, replay_config
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.wal import WriteAheadLog
+
+
+def record_session(path, seed=13, n_seconds=10):
+    """A recording as the collector writes it: the snapshot answers the first diff."""
+    market = SyntheticMarket(seed=seed, book_size=200)
+    recorder = RawMessageRecorder(path)
+    snapshot = market.snapshot()
+    diffs = market.depth_diffs(10 * n_seconds)
+    events = [(json.loads(diff)["E"], KIND_DEPTH, diff) for diff in diffs]
+    events += [(kline["E"], KIND_KLINE, kline) for kline in market.klines(n_seconds)]
+    events += [(trade["E"], KIND_AGG_TRADE, trade) for trade in market.agg_trades(5 * n_seconds)]
+    events.sort(key=lambda event: event[0])
+    recorder.record(events[0][1], events[0][2])
+    recorder.record(KIND_SNAPSHOT, snapshot)
+    for _, kind, payload in events[1:]:
+        recorder.record(kind, payload)
+    recorder.close()
+    return events
+
+
+def test_records_read_back_in_order(tmp_path):
+    path = str(tmp_path / "raw.zst")
+    recorder = RawMessageRecorder(path)
+    seen = []
+    callback = recorder.wrap(KIND_KLINE, seen.append)
+    callback({"E": 1, "k": {}})
+    recorder.record(KIND_DEPTH, '{"E": 2}', recv_time_ns=5)
+    recorder.record(KIND_SNAPSHOT, b'{"lastUpdateId": 3}')
+    recorder.close()
+    assert seen == [{"E": 1, "k": {}}]
+    records = list(read_records(path))
+    assert [kind for kind, _, _ in records] == [KIND_KLINE, KIND_DEPTH, KIND_SNAPSHOT]
+    assert records[1][1:] == (5, b'{"E": 2}')
+    assert [payload for _, _, payload in read_records(path, kinds={KIND_SNAPSHOT})] == \
+        [b'{"lastUpdateId": 3}']
+
+
+def test_truncated_recording_stops_at_the_last_record(tmp_path):
+    path = str(tmp_path / "raw.zst")
+    record_session(path)
+    n_records = len(list(read_records(path)))
+    with open(path, "rb") as f:
+        data = f.read()
+    # the collector was killed mid frame, the replay stops instead of raising
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    assert len(list(read_records(path))) < n_records
+
+
+def test_replay_leaves_the_collector_wal_and_spill_alone(config, tmp_path):
+    path = str(tmp_path / "raw.zst")
+    events = record_session(path)
+    live_config = dict(config, wal_enabled=True, memory_budget_bytes=1, n_events_per_write=50,
+                       n_depth_pairs=10)
+    # a segment of the collector running for the same symbol
+    live_wal = WriteAheadLog(os.path.join(live_config["wal_dir"], "ETHUSDT"))
+    live_wal.log_ohlc(123, 1.0, 1.0, 1.0, 1.0, 1.0, 0, 999, 1, 1)
+    segment = live_wal.rotate()
+    live_wal.close()
+    os.makedirs(os.path.join(live_config["spill_dir"], "ETHUSDT"), exist_ok=True)
+    spilled = os.path.join(live_config["spill_dir"], "ETHUSDT", "batch-live.arrow")
+    open(spilled, "wb").close()
+
+    replay_dir = str(tmp_path / "replayed")
+    replayed_config = replay_config(dict(live_config, save_dir=replay_dir))
+    counts = replay(path, replayed_config, ParquetSaver(replayed_config))
+    assert counts == {"depth": 100, "kline": 10, "aggTrade": 50}
+    assert os.path.exists(segment) and os.path.exists(spilled)
+    table = DataReader(replay_dir).read("ETHUSDT")
+    # no row of the collector's segment made it into the replay
+    assert table.column(TIME_COLUMN).to_numpy().min() >= events[0][0]
+    assert np.isfinite(table.column("bid_price_0").to_numpy()).any()
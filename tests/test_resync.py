@@ -0,0 +1,161 @@
+import json
+
+import numpy as np
+import pytest
+import requests
+
+from benchmarks.synthetic import SyntheticMarket
+from binance_data_saver.manage_ws_depth import (
+    SYNC_STATE_LIVE,
+    SYNC_STATE_RESYNCING,
+    DepthCacheManager,
+)
+from binance_data_saver.orderbook import make_orderbook
+
+
+class ScriptedDepthCacheManager(DepthCacheManager):
+    """Snapshot requests answered from a list, an Exception entry is raised."""
+
+    def __init__(self, config, snapshots):
+        super().__init__(config, should_plot=False)
+        self.resync_in_background = False
+        self.snapshots = list(snapshots)
+        self.n_requests = 0
+        self.initialize_params("ethusdt")
+        self.orderbook = make_orderbook(config, config["tick_size"])
+        self.updates_seen = []
+        self.update_callback = self.updates_seen.append
+
+    def get_snapshot(self, record=True, limit=None):
+        self.n_requests += 1
+        snapshot = self.snapshots.pop(0)
+        if isinstance(snapshot, Exception):
+            raise snapshot
+        return snapshot
+
+
+def reference_book(config, snapshot, diffs):
+    book = make_orderbook(dict(config, orderbook_engine="sorted_dict"), config["tick_size"])
+    book.load_snapshot(np.array(snapshot["bids"], dtype=float).reshape(-1, 2),
+                       np.array(snapshot["asks"], dtype=float).reshape(-1, 2))
+    for message in diffs:
+        diff = json.loads(message)
+        if diff["u"] <= snapshot["lastUpdateId"]:
+            continue
+        book.apply_diff(np.array(diff["b"], dtype=float).reshape(-1, 2),
+                        np.array(diff["a"], dtype=float).reshape(-1, 2))
+    return book.top_k(config["n_depth_pairs"])
+
+
+def assert_same_top(manager, expected):
+    bids, asks = manager.orderbook.top_k(manager.config["n_depth_pairs"])
+    np.testing.assert_array_equal(bids, expected[0])
+    np.testing.assert_array_equal(asks, expected[1])
+
+
+def test_buffered_diffs_are_replayed_on_the_snapshot(config):
+    market = SyntheticMarket(seed=1, book_size=200)
+    early = market.depth_diffs(5)
+    snapshot = market.snapshot()
+    late = market.depth_diffs(20)
+    manager = ScriptedDepthCacheManager(config, [snapshot])
+    # the first diff requests the snapshot, diffs older than it are dropped on load
+    for message in early + late:
+        manager.on_message(None, message)
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.last_update_id == json.loads(late[-1])["u"]
+    assert manager.sync_stats["resyncs"] == 1
+    assert_same_top(manager, reference_book(config, snapshot, late))
+
+
+def test_gap_starts_a_resync(config):
+    market = SyntheticMarket(seed=2, book_size=200)
+    snapshot = market.snapshot()
+    diffs = market.depth_diffs(10)
+    manager = ScriptedDepthCacheManager(config, [snapshot])
+    for message in diffs[:5]:
+        manager.on_message(None, message)
+    assert manager.state == SYNC_STATE_LIVE
+    # diffs[5] never arrives
+    second = market.snapshot()
+    later = market.depth_diffs(5)
+    manager.snapshots.append(second)
+    for message in diffs[6:] + later:
+        manager.on_message(None, message)
+    assert manager.sync_stats["gaps"] == 1
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.last_update_id == json.loads(later[-1])["u"]
+
+
+def test_old_snapshot_is_requested_again(config):
+    market = SyntheticMarket(seed=3, book_size=200)
+    old = market.snapshot()
+    market.depth_diffs(10)
+    diffs = market.depth_diffs(10)
+    fresh = market.snapshot()
+    more = market.depth_diffs(5)
+    manager = ScriptedDepthCacheManager(config, [old, fresh])
+    for message in diffs + more:
+        manager.on_message(None, message)
+    assert manager.n_requests == 2
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.sync_stats["failed_snapshots"] == 1
+    assert_same_top(manager, reference_book(config, fresh, more))
+
+
+def test_error_body_does_not_wedge_the_resync(config):
+    market = SyntheticMarket(seed=4, book_size=200)
+    error_body = {"code": -1003, "msg": "Too many requests"}
+    snapshot = market.snapshot()
+    diffs = market.depth_diffs(10)
+    manager = ScriptedDepthCacheManager(config, [error_body, snapshot])
+    manager.on_message(None, diffs[0])
+    # the failed request is not left in flight, the next diff asks again
+    assert manager.state == SYNC_STATE_RESYNCING
+    assert not manager.snapshot_in_flight
+    for message in diffs[1:]:
+        manager.on_message(None, message)
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.n_requests == 2
+
+
+def test_snapshot_with_an_empty_side(config):
+    market = SyntheticMarket(seed=5, book_size=50)
+    snapshot = dict(market.snapshot(), asks=[])
+    manager = ScriptedDepthCacheManager(config, [snapshot])
+    manager.on_message(None, market.depth_diffs(1)[0])
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.bounds[1] is None
+
+
+def test_background_resync_backs_off(config, monkeypatch):
+    market = SyntheticMarket(seed=6, book_size=50)
+    config = dict(config, resync_backoff_s=1, resync_max_backoff_s=3)
+    manager = ScriptedDepthCacheManager(
+        config, [IOError("down"), IOError("down"), IOError("down"), market.snapshot()])
+    manager.resync_in_background = True
+    delays = []
+    monkeypatch.setattr("binance_data_saver.manage_ws_depth.time.sleep", delays.append)
+    manager.snapshot_in_flight = True
+    manager.fetch_snapshot_and_resync()
+    assert manager.state == SYNC_STATE_LIVE
+    assert manager.snapshot_failures == 0
+    assert manager.sync_stats["failed_snapshots"] == 3
+    assert len(delays) == 3
+    for delay, cap in zip(delays, (1, 2, 3)):
+        assert cap / 2 <= delay <= cap
+
+
+def test_get_snapshot_raises_on_http_errors(config):
+    manager = DepthCacheManager(config, should_plot=False)
+    manager.initialize_params("ethusdt")
+    response = requests.Response()
+    response.status_code = 429
+    response.url = "https://api.binance.com/api/v3/depth"
+    response._content = b'{"code":-1003,"msg":"Too many requests"}'
+    manager.session.get = lambda *args, **kwargs: response
+    with pytest.raises(requests.HTTPError):
+        manager.get_snapshot()
+    response.status_code = 200
+    with pytest.raises(ValueError):
+        manager.get_snapshot()
@@ -0,0 +1,62 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.reader import DataReader
+from binance_data_saver.row_buffer import TIME_COLUMN
+from binance_data_saver.schema import CompactSchema, column_mapping, decode_table
+from tests.helpers import feed, market_events
+
+
+def test_encode_decode_is_exact():
+    table = pa.table({
+        TIME_COLUMN: pa.array([1, 2, 3], pa.float64()),
+        "o": [2071.37, 2071.38, 0.1 + 0.2],
+        "v": [0.0001, 12.3456, 1e-4 * 3],
+        "bid_price_0": [2071.36, 2071.37, 2071.01],
+        "bid_quantity_0": [1.5, 0.0002, 7.0],
+        "is_market_maker": [0.0, 1.0, 1.0],
+        "price_trade": [2071.3712, 2071.38, 2071.0],
+    })
+    encoded = CompactSchema(0.01, 0.0001).encode(table)
+    assert encoded.schema.field("o").type == pa.int64()
+    assert encoded.schema.field(TIME_COLUMN).type == pa.int64()
+    assert encoded.schema.field("is_market_maker").type == pa.int8()
+    assert encoded.schema.field("price_trade").type == pa.float64()
+    assert encoded.column("o").to_pylist() == [207137, 207138, 30]
+    decoded = decode_table(encoded)
+    for name in ("o", "v", "bid_price_0", "bid_quantity_0", "price_trade"):
+        expected = np.round(table.column(name).to_numpy(), 8)
+        np.testing.assert_array_equal(decoded.column(name).to_numpy(), expected)
+    # decoding a decoded table is a no-op
+    assert decode_table(decoded).equals(decoded)
+
+
+def test_float32_quantities():
+    table = pa.table({"o": [2071.37], "v": [12.3456]})
+    encoded = CompactSchema(0.01, 0, "float32").encode(table)
+    assert encoded.schema.field("v").type == pa.float32()
+    assert column_mapping(encoded.schema)["v"] == {"encoding": "float32"}
+    assert decode_table(encoded).column("o").to_pylist() == [2071.37]
+
+
+def test_compact_files_read_back_as_legacy(config, tmp_path):
+    config = dict(config, n_events_per_write=300, n_depth_pairs=10)
+    events = market_events(10, 20, config)
+    legacy_config = dict(config, save_dir=str(tmp_path / "legacy"))
+    compact_config = dict(config, output_schema="compact", save_dir=str(tmp_path / "compact"))
+    for saver_config in (legacy_config, compact_config):
+        saver = ParquetSaver(saver_config)
+        feed(saver, events)
+        saver.close()
+    legacy = DataReader(legacy_config["save_dir"]).read("ETHUSDT")
+    compact_reader = DataReader(compact_config["save_dir"])
+    compact = compact_reader.read("ETHUSDT")
+    path = compact_reader.files("ETHUSDT")[0]["path"]
+    assert pq.read_schema(path).field("bid_price_0").type == pa.int64()
+    assert compact.schema.field("bid_price_0").type == pa.float64()
+    assert compact.num_rows == legacy.num_rows
+    for name in legacy.column_names:
+        np.testing.assert_allclose(compact.column(name).to_numpy(),
+                                   legacy.column(name).to_numpy(), rtol=1e-12, err_msg=name)
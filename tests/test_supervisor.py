@@ -0,0 +1,111 @@
+import subprocess
+import sys
+
+import pytest
+
+from binance_data_saver import supervisor as supervisor_module
+from binance_data_saver.supervisor import ShardSupervisor, shard_symbols
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProcess:
+    def __init__(self):
+        self.exitcode = None
+        self.joined = False
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    def join(self, timeout=None):
+        self.joined = True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(supervisor_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def supervisor(config, clock, monkeypatch):
+    supervisor = ShardSupervisor(["BTCUSDT", "ETHUSDT"], config, n_shards=2)
+    supervisor.started = []
+
+    def start_shard(i):
+        supervisor.processes[i] = FakeProcess()
+        supervisor.started.append((i, clock.now))
+
+    monkeypatch.setattr(supervisor, "start_shard", start_shard)
+    for i in range(len(supervisor.shards)):
+        supervisor.start_shard(i)
+    supervisor.started.clear()
+    return supervisor
+
+
+def test_shard_symbols_round_robin():
+    assert shard_symbols(["a", "b", "c", "d", "e"], 2) == [["a", "c", "e"], ["b", "d"]]
+    assert shard_symbols(["a", "b"], 8) == [["a"], ["b"]]
+    assert shard_symbols(["a"], 0) == [["a"]]
+
+
+def test_supervisor_does_not_import_the_async_engine():
+    # multi-symbol mode needs the asyncio extra in the shards only
+    code = ("import sys, binance_data_saver.supervisor; "
+            "assert 'binance_data_saver.async_engine' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_dead_shard_restarts_after_backoff(supervisor, clock):
+    dead = supervisor.processes[0]
+    dead.exitcode = 1
+    supervisor.poll()
+    assert dead.joined
+    assert supervisor.started == []
+    # the first restart waits 2 ** 0 seconds
+    clock.now += 0.5
+    supervisor.poll()
+    assert supervisor.started == []
+    clock.now += 0.5
+    supervisor.poll()
+    assert supervisor.started == [(0, 1001.0)]
+    assert supervisor.restarts == [1, 0]
+    # the other shard is left alone
+    assert supervisor.processes[1].is_alive()
+
+
+def test_backoff_doubles_up_to_a_minute(supervisor, clock):
+    delays = []
+    for _ in range(8):
+        supervisor.processes[0].exitcode = 1
+        supervisor.poll()
+        crashed_at = clock.now
+        while not supervisor.started:
+            clock.now += 1
+            supervisor.poll()
+        delays.append(supervisor.started.pop()[1] - crashed_at)
+    assert delays == [1, 2, 4, 8, 16, 32, 60, 60]
+
+
+def test_backoff_resets_after_a_healthy_shard(supervisor, clock):
+    for _ in range(3):
+        supervisor.processes[0].exitcode = 1
+        supervisor.poll()
+        clock.now += 60
+        supervisor.poll()
+    assert supervisor.restarts[0] == 3
+    clock.now += 301
+    supervisor.poll()
+    assert supervisor.restarts[0] == 0
+    supervisor.processes[0].exitcode = 1
+    supervisor.poll()
+    clock.now += 1
+    supervisor.poll()
+    assert supervisor.started[-1] == (0, clock.now)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from binance_data_saver.decoding import AggTrade
+from binance_data_saver.row_buffer import ColumnarRowBuffer
+from binance_data_saver.trade_tape import TradeTapeBuffer
+
+def trade(event_time, price, quantity, is_buyer_maker, first_trade_id):
+    return AggTrade(event_time, price, quantity, is_buyer_maker, first_trade_id,
+                    first_trade_id + 1, first_trade_id, event_time - 1)
+
+
+def assert_tape_matches_rows(config, trades):
+    rows = ColumnarRowBuffer(config, len(trades))
+    for values in trades:
+        rows.add_agg_trade(*values[:6])
+    tape = TradeTapeBuffer(len(trades))
+    for values in trades:
+        tape.append(values)
+    taped = ColumnarRowBuffer(config, len(trades))
+    taped.set_agg_trades(tape.merged())
+    expected, table = rows.to_table(), taped.to_table()
+    assert table.column_names == expected.column_names
+    for name in expected.column_names:
+        assert table.column(name).equals(expected.column(name)), name
+    return table
+
+
+def test_mixed_sides_in_one_millisecond(config):
+    table = assert_tape_matches_rows(config, [
+        trade(100, 10.0, 1.0, 0, 1),
+        trade(100, 11.0, 3.0, 1, 3),
+        trade(200, 12.0, 1.0, 1, 5),
+        trade(200, 12.5, 1.0, 1, 7),
+        trade(300, 13.0, 2.0, 0, 9),
+    ])
+    assert table.column("price_trade").to_pylist() == [10.75, 12.25, 13.0]
+    assert table.column("is_market_maker").to_pylist() == [-1, 1, 0]
+    assert table.column("first_trade_id_aggtrade").to_pylist() == [1, 5, 9]
+    assert table.column("last_trade_id_aggtrade").to_pylist() == [4, 8, 10]
+
+
+def test_zero_quantity_trades(config):
+    table = assert_tape_matches_rows(config, [
+        # leading zero quantity trades are replaced by the next one
+        trade(100, 10.0, 0.0, 0, 1),
+        trade(100, 11.0, 2.0, 1, 3),
+        # all zero, the last trade is kept
+        trade(200, 12.0, 0.0, 1, 5),
+        trade(200, 13.0, 0.0, 0, 7),
+        # a trailing zero quantity trade still counts for the side
+        trade(300, 14.0, 1.0, 1, 9),
+        trade(300, 15.0, 0.0, 0, 11),
+    ])
+    assert table.column("price_trade").to_pylist() == [11.0, 13.0, 14.0]
+    assert table.column("quantity_trade").to_pylist() == [2.0, 0.0, 1.0]
+    assert table.column("is_market_maker").to_pylist() == [1, 0, -1]
+    assert table.column("first_trade_id_aggtrade").to_pylist() == [3, 7, 9]
+    assert table.column("last_trade_id_aggtrade").to_pylist() == [4, 8, 12]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_tape_matches_rows(config, seed):
+    rng = np.random.default_rng(seed)
+    n = 2000
+    # few distinct times, out of order, with a fifth of the quantities zero
+    times = 1000 + rng.integers(0, 300, n)
+    prices = np.round(2000 + rng.normal(0, 5, n), 2)
+    quantities = np.where(rng.random(n) < 0.2, 0.0, np.round(rng.exponential(0.5, n), 4))
+    sides = rng.integers(0, 2, n)
+    assert_tape_matches_rows(config, [
+        trade(int(t), float(p), float(q), int(m), 10 * i)
+        for i, (t, p, q, m) in enumerate(zip(times, prices, quantities, sides))
+    ])
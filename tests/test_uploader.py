@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+import pytest
+import requests
+
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.reader import DataReader
+from binance_data_saver.uploader import S3Uploader, expected_etag
+
+moto_server = pytest.importorskip("moto.server")
+s3fs = pytest.importorskip("s3fs")
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """s3fs filesystem of a moto server on localhost, with a "bucket" bucket."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+    # moto keeps its buckets per process, start every test from none
+    requests.post(f"{endpoint_url}/moto-api/reset").raise_for_status()
+    filesystem = s3fs.S3FileSystem(endpoint_url=endpoint_url)
+    filesystem.mkdir("bucket")
+    yield filesystem
+    server.stop()
+
+
+def write_bytes(path, n_bytes, seed=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = np.random.default_rng(seed).bytes(n_bytes)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def test_multipart_upload_is_verified_and_unstaged(tmp_path, s3):
+    staging = tmp_path / "staging"
+    small = write_bytes(str(staging / "data_1.parquet"), 1000)
+    # two 5 MB parts and a rest, in flight together
+    large = write_bytes(str(staging / "symbol=ETHUSDT" / "data_2.parquet"), 11 * MB, seed=1)
+    assert expected_etag(str(staging / "symbol=ETHUSDT" / "data_2.parquet"), 5 * MB).endswith("-3")
+    uploaded = []
+    uploader = S3Uploader(str(staging), "s3://bucket/prefix", s3, n_workers=2,
+                          part_size=5 * MB, part_concurrency=3, max_attempts=2,
+                          on_uploaded=lambda path, remote, info: uploaded.append(remote))
+    uploader.submit(str(staging / "data_1.parquet"))
+    uploader.submit(str(staging / "symbol=ETHUSDT" / "data_2.parquet"))
+    uploader.close(timeout_s=60)
+    assert sorted(uploaded) == ["bucket/prefix/data_1.parquet",
+                                "bucket/prefix/symbol=ETHUSDT/data_2.parquet"]
+    assert s3.cat_file("bucket/prefix/data_1.parquet") == small
+    assert s3.cat_file("bucket/prefix/symbol=ETHUSDT/data_2.parquet") == large
+    assert not os.path.exists(staging / "data_1.parquet")
+    assert not os.path.exists(staging / "symbol=ETHUSDT" / "data_2.parquet")
+    metrics = uploader.metrics()
+    assert metrics["uploaded_files"] == 2 and metrics["backlog_files"] == 0
+    assert metrics["failures"] == 0 and metrics["retries"] == 0
+
+
+def test_failed_upload_stays_staged(tmp_path, s3):
+    staging = tmp_path / "staging"
+    write_bytes(str(staging / "data_1.parquet"), 1000)
+    uploader = S3Uploader(str(staging), "s3://missing-bucket", s3, n_workers=1,
+                          max_attempts=2, backoff_s=0.01)
+    uploader.submit(str(staging / "data_1.parquet"))
+    uploader.close(timeout_s=30)
+    assert os.path.exists(staging / "data_1.parquet")
+    assert uploader.metrics()["failures"] == 1
+    assert uploader.metrics()["retries"] == 1
+
+
+def test_failed_callback_keeps_the_file_and_retries(tmp_path, s3):
+    staging = tmp_path / "staging"
+    write_bytes(str(staging / "data_1.parquet"), 1000)
+    calls = []
+
+    def on_uploaded(path, remote, info):
+        # the file is still staged while the callback runs
+        calls.append(os.path.exists(path))
+        if len(calls) == 1:
+            raise IOError("manifest not writable")
+
+    # retried forever, the second attempt succeeds
+    uploader = S3Uploader(str(staging), "s3://bucket", s3, n_workers=1,
+                          max_attempts=0, backoff_s=0.01, on_uploaded=on_uploaded)
+    uploader.submit(str(staging / "data_1.parquet"), {"rows": 1})
+    uploader.close(timeout_s=30)
+    assert calls == [True, True]
+    assert not os.path.exists(staging / "data_1.parquet")
+    metrics = uploader.metrics()
+    assert metrics["uploaded_files"] == 1 and metrics["retries"] == 1
+    assert metrics["failures"] == 0 and metrics["backlog_files"] == 0
+
+
+def test_upload_of_a_removed_file_is_not_retried(tmp_path, s3):
+    staging = tmp_path / "staging"
+    write_bytes(str(staging / "data_1.parquet"), 1000)
+
+    def on_uploaded(path, remote, info):
+        os.remove(path)
+        raise IOError("manifest not writable")
+
+    uploader = S3Uploader(str(staging), "s3://bucket", s3, n_workers=1,
+                          max_attempts=0, backoff_s=0.01, on_uploaded=on_uploaded)
+    uploader.submit(str(staging / "data_1.parquet"))
+    uploader.close(timeout_s=30)
+    assert not any(worker.is_alive() for worker in uploader.workers)
+    metrics = uploader.metrics()
+    assert metrics["failures"] == 1 and metrics["retries"] == 0
+    assert metrics["backlog_files"] == 0 and metrics["backlog_bytes"] == 0
+
+
+def test_saver_files_end_up_in_the_bucket(config, s3):
+    from benchmarks.synthetic import SyntheticMarket
+
+    endpoint_url = s3.endpoint_url
+    config = dict(config, s3_bucket="s3://bucket/data", s3_endpoint_url=endpoint_url,
+                  n_events_per_write=500, upload_max_attempts=3)
+    saver = ParquetSaver(config)
+    market = SyntheticMarket(seed=0)
+    for message in market.klines(2000):
+        saver.ohlc_cb(message)
+    saver.close()
+    entries = list(saver.manifest.entries())
+    assert entries and all(entry["path"].startswith("s3://bucket/data/") for entry in entries)
+    assert not [name for name in os.listdir(config["save_dir"]) if name.endswith(".parquet")]
+    table = DataReader(config["save_dir"], s3_endpoint_url=endpoint_url).read("ETHUSDT")
+    assert table.num_rows == 2000
@@ -0,0 +1,78 @@
+import multiprocessing
+import uuid
+
+import numpy as np
+import pytest
+
+from binance_data_saver.visualizer import DepthSnapshotRing
+
+N_LEVELS = 50
+
+
+def snapshot(seq):
+    """Levels of snapshot seq, every value derived from seq so a torn read shows."""
+    n = seq % N_LEVELS + 1
+    bids = np.column_stack([np.full(n, float(seq)), np.arange(n, dtype=np.float64)])
+    asks = np.column_stack([np.full(N_LEVELS - n + 1, -float(seq)),
+                            np.arange(N_LEVELS - n + 1, dtype=np.float64)])
+    return bids, asks
+
+
+def publish_until(ring_name, stop):
+    ring = DepthSnapshotRing(ring_name, N_LEVELS, n_slots=2)
+    seq = 0
+    while not stop.is_set():
+        seq += 1
+        ring.publish(seq, *snapshot(seq))
+    ring.close()
+
+
+@pytest.fixture
+def ring():
+    # two slots, so the writer comes back to the slot being read as often as possible
+    ring = DepthSnapshotRing(f"test_{uuid.uuid4().hex[:12]}", N_LEVELS, n_slots=2, create=True)
+    yield ring
+    ring.close()
+
+
+def test_publish_and_latest(ring):
+    assert ring.latest()[0] == 0
+    for seq in range(1, 6):
+        ring.publish(seq * 100, *snapshot(seq))
+    seq, event_time, bids, asks = ring.latest()
+    assert (seq, event_time) == (5, 500)
+    expected_bids, expected_asks = snapshot(5)
+    np.testing.assert_array_equal(bids, expected_bids)
+    np.testing.assert_array_equal(asks, expected_asks)
+    # levels beyond n_levels are cut
+    ring.publish(600, np.ones((80, 2)), np.ones((0, 2)))
+    _, _, bids, asks = ring.latest()
+    assert bids.shape == (N_LEVELS, 2) and asks.shape == (0, 2)
+
+
+def test_reads_racing_a_writer_process_are_never_torn(ring):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    writer = context.Process(target=publish_until, args=(ring.name, stop), daemon=True)
+    writer.start()
+    try:
+        n_reads, last_seq = 0, 0
+        while n_reads < 50_000:
+            seq, event_time, bids, asks = ring.latest()
+            if seq == 0:
+                assert writer.is_alive()
+                continue
+            n_reads += 1
+            assert seq >= last_seq
+            last_seq = seq
+            # header and levels all belong to the same snapshot
+            assert event_time == seq
+            expected_bids, expected_asks = snapshot(seq)
+            assert np.array_equal(bids, expected_bids) and np.array_equal(asks, expected_asks), \
+                f"torn read of snapshot {seq}"
+        # the writer kept publishing while the reads went on
+        assert last_seq > 1000
+    finally:
+        stop.set()
+        writer.join(10)
+    assert writer.exitcode == 0
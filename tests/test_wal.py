@@ -0,0 +1,102 @@
+import os
+import threading
+
+import numpy as np
+
+from binance_data_saver.parquet_saver import ParquetSaver
+from binance_data_saver.reader import DataReader
+from binance_data_saver.wal import OP_DEPTH, OP_OHLC, WriteAheadLog, read_wal
+from tests.helpers import feed, market_events
+
+
+def test_buffered_rows_survive_a_crash(config, tmp_path):
+    config = dict(config, wal_enabled=True, n_events_per_write=200, n_depth_pairs=10)
+    events = market_events(9, 30, config)
+    reference_config = dict(config, wal_enabled=False, save_dir=str(tmp_path / "reference"))
+    reference = ParquetSaver(reference_config)
+    feed(reference, events)
+    reference.close()
+    expected = DataReader(reference_config["save_dir"]).read("ETHUSDT")
+
+    crashed = ParquetSaver(config)
+    feed(crashed, events)
+    # the process dies: written batches stay, the buffer is only in the WAL
+    crashed.writer.close()
+    crashed.wal.closed = True
+    crashed.wal.syncer.join()
+    crashed.wal.sync()
+    wal_dir = os.path.dirname(crashed.wal.path(0))
+    assert len(crashed.wal.pending_files()) == 1
+    assert len(DataReader(config["save_dir"]).read("ETHUSDT")) < len(expected)
+
+    restarted = ParquetSaver(config)
+    restarted.close()
+    actual = DataReader(config["save_dir"]).read("ETHUSDT")
+    assert actual.equals(expected)
+    # replayed generations are removed once written
+    assert os.listdir(wal_dir) == []
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal"), fsync_interval_ms=10)
+    wal.log_ohlc(1000, 1.0, 2.0, 0.5, 1.5, 10.0, 0, 999, 1, 2)
+    wal.log_depth(1001, np.array([[1.0, 2.0]]), np.array([[1.1, 3.0], [1.2, 4.0]]))
+    path = wal.rotate()
+    wal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x10\x00")
+    records = list(read_wal(path))
+    assert [op for op, _ in records] == [OP_OHLC, OP_DEPTH]
+    assert records[0][1] == (1000, 1.0, 2.0, 0.5, 1.5, 10.0, 0, 999, 1, 2)
+    event_time, bids, asks = records[1][1]
+    assert event_time == 1001
+    np.testing.assert_array_equal(asks, [[1.1, 3.0], [1.2, 4.0]])
+    # the empty current generation is not left behind
+    assert wal.pending_files() == [path]
+
+
+def test_close_closes_the_current_generation(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal"), fsync_interval_ms=10)
+    wal.log_ohlc(1000, 1.0, 2.0, 0.5, 1.5, 10.0, 0, 999, 1, 2)
+    wal.close()
+    assert wal.file.closed
+    assert len(wal.pending_files()) == 1
+
+
+def test_generations_are_released_with_rolling_dataset_files(config):
+    # every row group rolls its file, on four writer threads
+    config = dict(config, wal_enabled=True, output_layout="dataset", n_events_per_write=50,
+                  n_flush_workers=4, roll_max_bytes=1, n_depth_pairs=10)
+    saver = ParquetSaver(config)
+    feed(saver, market_events(11, 60, config))
+    saver.close()
+    assert saver.wal_awaiting_close == {} and saver.wal_refs == {}
+    assert saver.dataset_writer.open_paths() == set()
+    assert saver.wal.pending_files() == []
+
+
+def test_file_closed_while_a_generation_completes(config):
+    config = dict(config, wal_enabled=True, output_layout="dataset", n_events_per_write=10000,
+                  n_depth_pairs=10)
+    saver = ParquetSaver(config)
+    feed(saver, market_events(12, 5, config))
+    dataset_writer = saver.dataset_writer
+    open_paths = dataset_writer.open_paths
+    closers = []
+
+    def close_files_after_the_snapshot():
+        paths = open_paths()
+        # the rows just written reach disk here, on another thread
+        closers.append(threading.Thread(target=dataset_writer.close))
+        closers[-1].start()
+        closers[-1].join(timeout=0.5)
+        return paths
+
+    dataset_writer.open_paths = close_files_after_the_snapshot
+    completed = saver.wal.path(saver.wal.generation)
+    saver.save_to_parquet()
+    saver.writer.close()
+    closers[0].join()
+    assert saver.wal_awaiting_close == {}
+    assert not os.path.exists(completed)
+    saver.wal.close()